@@ -9,8 +9,21 @@ https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
 
 import os
 
-from django.core.asgi import get_asgi_application
+import django
+from django.core.handlers.asgi import ASGIHandler
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ecommerce_site.settings')
 
-application = get_asgi_application()
+# What get_asgi_application() does, with a handler that serves the async views.
+django.setup(set_prefix=False)
+
+
+class AsyncViewsHandler(ASGIHandler):
+    """Routes requests through asgi_urls so the storefront pages run as async views."""
+
+    async def get_response_async(self, request):
+        request.urlconf = 'ecommerce_site.asgi_urls'
+        return await super().get_response_async(request)
+
+
+application = AsyncViewsHandler()
@@ -0,0 +1,13 @@
+"""URLconf used under ASGI: the read-heavy storefront pages are async views."""
+from django.urls import path
+
+from products import async_views
+
+from .urls import urlpatterns as sync_urlpatterns
+
+urlpatterns = [
+    path('products/', async_views.products, name='products'),
+    path('product/<int:pk>/', async_views.product_detail, name='product_detail'),
+    path('cart/', async_views.cart, name='cart'),
+    path('order-history/', async_views.order_history, name='order_history'),
+] + sync_urlpatterns
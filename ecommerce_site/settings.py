@@ -40,10 +40,15 @@ INSTALLED_APPS = [
     'rest_framework',
     'rest_framework_simplejwt',
     'social_django',
+    'jobs',
     'products',
 ]
 
 MIDDLEWARE = [
+    'products.middleware.AdmissionControlMiddleware',
+    'products.middleware.RequestMetricsMiddleware',
+    'products.middleware.PrimaryPinMiddleware',
+    'products.middleware.GuestCartMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -51,6 +56,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'products.middleware.RateLimitMiddleware',
 ]
 
 ROOT_URLCONF = 'ecommerce_site.urls'
@@ -59,12 +65,21 @@ TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
         'DIRS': [BASE_DIR / "templates"],
-        'APP_DIRS': True,
         'OPTIONS': {
+            # Templates are parsed once per process and the compiled nodes are
+            # reused by every render. The autoreloader clears this cache when
+            # a template changes under runserver.
+            'loaders': [
+                ('django.template.loaders.cached.Loader', [
+                    'django.template.loaders.filesystem.Loader',
+                    'django.template.loaders.app_directories.Loader',
+                ]),
+            ],
             'context_processors': [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'products.context_processors.cart_summary',
                 'social_django.context_processors.backends',
                 'social_django.context_processors.login_redirect',
             ],
@@ -78,13 +93,134 @@ WSGI_APPLICATION = 'ecommerce_site.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# DJANGO_DB_ENGINE selects one of the layouts below. Both have a 'replica'
+# alias that products.routers sends catalog reads to; in tests it mirrors
+# 'default'.
+
+DB_ENGINE = os.environ.get('DJANGO_DB_ENGINE', 'sqlite')
+
+if DB_ENGINE == 'postgres':
+    # Needs psycopg (and psycopg_pool for DJANGO_DB_POOL=1). The replica is
+    # DJANGO_DB_REPLICA_HOST, or the primary itself if unset.
+    _pool = os.environ.get('DJANGO_DB_POOL') == '1'
+    _primary = {
+        'ENGINE': 'django.db.backends.postgresql',
+        'NAME': os.environ.get('DJANGO_DB_NAME', 'ecommerce'),
+        'USER': os.environ.get('DJANGO_DB_USER', ''),
+        'PASSWORD': os.environ.get('DJANGO_DB_PASSWORD', ''),
+        'HOST': os.environ.get('DJANGO_DB_HOST', ''),
+        'PORT': os.environ.get('DJANGO_DB_PORT', ''),
+        # A pool hands connections back after each request, so it replaces
+        # persistent connections rather than adding to them.
+        'CONN_MAX_AGE': 0 if _pool else int(os.environ.get('DJANGO_DB_CONN_MAX_AGE', 60)),
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {'pool': {'min_size': 2, 'max_size': 20, 'timeout': 10}} if _pool else {},
+    }
+    DATABASES = {
+        'default': _primary,
+        'replica': dict(
+            _primary,
+            HOST=os.environ.get('DJANGO_DB_REPLICA_HOST', _primary['HOST']),
+            TEST={'MIRROR': 'default'},
+        ),
+    }
+else:
+    # WAL lets readers run alongside the single writer instead of queueing
+    # behind it, so both aliases open the same file on their own connections.
+    SQLITE_PRAGMAS = [
+        'PRAGMA journal_mode=WAL',
+        # In WAL mode only checkpoints need fsync to stay corruption-safe.
+        'PRAGMA synchronous=NORMAL',
+        'PRAGMA temp_store=MEMORY',
+        'PRAGMA cache_size=-32768',  # 32 MiB per connection
+        'PRAGMA mmap_size=268435456',
+    ]
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / 'db.sqlite3',
+            'OPTIONS': {
+                'init_command': '; '.join(SQLITE_PRAGMAS),
+                # Take the write lock when a transaction starts; a read lock
+                # upgraded mid-transaction fails at once instead of waiting.
+                'transaction_mode': 'IMMEDIATE',
+                'timeout': 20,
+            },
+        },
+        'replica': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / 'db.sqlite3',
+            # query_only turns a write routed here by mistake into an error.
+            'OPTIONS': {'init_command': '; '.join(SQLITE_PRAGMAS + ['PRAGMA query_only=ON']), 'timeout': 20},
+            'TEST': {'MIRROR': 'default'},
+        },
     }
+
+DATABASE_ROUTERS = ['products.routers.PrimaryReplicaRouter']
+DATABASE_REPLICAS = ['replica']
+
+
+# Cache
+# DJANGO_CACHE_BACKEND selects one of CACHE_BACKENDS; DJANGO_CACHE_LOCATION
+# overrides its LOCATION (e.g. redis://127.0.0.1:6379/0).
+
+CACHE_BACKENDS = {
+    # In-process LRU: entries expire after TIMEOUT and the least recently
+    # used third is culled once MAX_ENTRIES is reached. Async calls run inline.
+    'locmem': {
+        'BACKEND': 'products.cache_backends.LocMemCache',
+        'LOCATION': 'ecommerce-site',
+        'TIMEOUT': 300,
+        'OPTIONS': {'MAX_ENTRIES': 10000, 'CULL_FREQUENCY': 3},
+    },
+    'file': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / '.django_cache',
+        'TIMEOUT': 300,
+        'OPTIONS': {'MAX_ENTRIES': 50000},
+    },
+    'redis': {
+        'BACKEND': 'products.cache_backends.RespCache',
+        'LOCATION': 'redis://127.0.0.1:6379/0',
+        'TIMEOUT': 300,
+        'OPTIONS': {'SOCKET_TIMEOUT': 5},
+    },
 }
 
+CACHE_BACKEND = os.environ.get('DJANGO_CACHE_BACKEND', 'locmem')
+
+CACHES = {
+    'default': dict(CACHE_BACKENDS[CACHE_BACKEND]),
+}
+if os.environ.get('DJANGO_CACHE_LOCATION'):
+    CACHES['default']['LOCATION'] = os.environ['DJANGO_CACHE_LOCATION']
+
+# Sessions are read from the cache and written through to the database.
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+
+
+# Rate limits per URL name, counted in the cache; see products/throttling.py
+# for the rule format. Password checks are slow on purpose, so logins get few
+# tries per address and per account; cart writes allow short bursts.
+RATE_LIMITS = {
+    'login': [('ip', '20/min'), ('username', '10/15min')],
+    'signup': [('ip', '10/h')],
+    'admin:login': [('ip', '20/min'), ('username', '10/15min')],
+    'api_token_obtain_pair': [('ip', '20/min'), ('username', '10/15min')],
+    'add_to_cart': [('user', '2/s', 20), ('ip', '300/min')],
+    'update_cart_item': [('user', '2/s', 20), ('ip', '300/min')],
+    'update_cart': [('user', '2/s', 20), ('ip', '300/min')],
+    'api_cart': [('user', '2/s', 20), ('ip', '300/min')],
+    'api_cart_item': [('user', '2/s', 20), ('ip', '300/min')],
+}
+# Proxies in front of the site that append to X-Forwarded-For; 0 trusts REMOTE_ADDR only.
+RATE_LIMIT_PROXY_COUNT = int(os.environ.get('DJANGO_PROXY_COUNT', 0))
+
+# Admission control, per worker process: see AdmissionControlMiddleware.
+ADMISSION_MAX_IN_FLIGHT = int(os.environ.get('DJANGO_MAX_IN_FLIGHT', 64))
+ADMISSION_MAX_DB_MS = float(os.environ.get('DJANGO_MAX_DB_MS', 50))
+ADMISSION_EXEMPT_PATHS = ('/ops/', '/admin/')
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -130,7 +266,7 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 AUTHENTICATION_BACKENDS = (
     
-    'social_core.backends.google.GoogleOAuth2',
+    'products.auth_backends.GoogleOAuth2',
     'django.contrib.auth.backends.ModelBackend',
 )
 
@@ -138,8 +274,9 @@ REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
         'rest_framework_simplejwt.authentication.JWTAuthentication',
     ),
-    'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
+    'DEFAULT_PAGINATION_CLASS': 'products.pagination.IdCursorPagination',
     'PAGE_SIZE': 5,
+    'DEFAULT_THROTTLE_CLASSES': ('products.throttling.RateLimitThrottle',),
 }
 
 MEDIA_URL = '/media/'
@@ -147,5 +284,8 @@ MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
 LOGIN_URL = '/login/'
 
+# Order confirmations are sent by the job worker (manage.py run_jobs).
+EMAIL_BACKEND = os.environ.get('DJANGO_EMAIL_BACKEND', 'django.core.mail.backends.console.EmailBackend')
+
 SESSION_COOKIE_AGE = 1209600  
 SESSION_EXPIRE_AT_BROWSER_CLOSE = True
\ No newline at end of file
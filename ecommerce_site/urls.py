@@ -1,3 +1,5 @@
+from django.conf import settings
+from django.conf.urls.static import static
 from django.contrib import admin
 from django.urls import path, include
 
@@ -5,6 +7,11 @@ from django.urls import path, include
 
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path('api/v1/', include('products.api_urls')),
     path('', include('products.urls')),
     
 ]
+
+# Uploads are only served by Django under DEBUG; in production point the web
+# server at MEDIA_ROOT. Stored names are content hashes, so they can be cached forever.
+urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
@@ -0,0 +1,15 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from jobs import queue
+
+
+class Command(BaseCommand):
+    help = "Print queue depth and recent job latency as JSON."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sample', type=int, default=1000, help="Number of recent done jobs to time.")
+
+    def handle(self, *args, **options):
+        self.stdout.write(json.dumps(queue.stats(options['sample']), indent=2))
@@ -0,0 +1,73 @@
+import os
+import signal
+import socket
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, close_old_connections
+from django.utils import timezone
+
+from jobs import queue
+
+# How often the worker requeues jobs with expired leases and prunes old ones.
+MAINTENANCE_INTERVAL = 60
+
+
+class Command(BaseCommand):
+    help = "Run queued jobs on a pool of worker threads. Several workers may run side by side."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=4)
+        parser.add_argument('--poll-interval', type=float, default=1.0, help="Seconds to sleep when the queue is empty.")
+        parser.add_argument('--burst', action='store_true', help="Exit once no due jobs are left.")
+        parser.add_argument('--keep-days', type=int, default=7, help="Delete done jobs older than this.")
+
+    def handle(self, *args, **options):
+        worker = f'{socket.gethostname()}:{os.getpid()}'
+        threads = options['threads']
+        stop = threading.Event()
+        signal.signal(signal.SIGTERM, lambda *args: stop.set())
+        self.stdout.write(f"Worker {worker} running jobs on {threads} threads")
+
+        in_flight = set()
+        next_maintenance = 0
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            try:
+                while not stop.is_set():
+                    if time.monotonic() >= next_maintenance:
+                        queue.requeue_expired()
+                        queue.prune(timezone.now() - timedelta(days=options['keep_days']))
+                        next_maintenance = time.monotonic() + MAINTENANCE_INTERVAL
+
+                    in_flight = {future for future in in_flight if not future.done()}
+                    free = threads - len(in_flight)
+                    try:
+                        jobs = queue.claim(worker, free) if free else []
+                    except OperationalError as e:
+                        # e.g. "database is locked" on SQLite; nothing was claimed.
+                        self.stderr.write(f"Could not claim jobs: {e}")
+                        stop.wait(options['poll_interval'])
+                        continue
+                    in_flight.update(pool.submit(self.run_job, job) for job in jobs)
+                    if jobs:
+                        continue
+                    if in_flight:
+                        wait(in_flight, timeout=options['poll_interval'], return_when=FIRST_COMPLETED)
+                    elif options['burst']:
+                        break
+                    else:
+                        stop.wait(options['poll_interval'])
+            except KeyboardInterrupt:
+                pass
+            # Leaving the pool waits for running jobs; claimed ones are never abandoned.
+        self.stdout.write(f"Worker {worker} stopped")
+
+    @staticmethod
+    def run_job(job):
+        try:
+            queue.run(job)
+        finally:
+            close_old_connections()
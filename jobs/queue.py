@@ -0,0 +1,188 @@
+import logging
+import random
+import traceback
+from datetime import timedelta
+
+from django.db import connection, transaction
+from django.db.models import Count, F
+from django.utils import timezone
+
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_ATTEMPTS = 5
+# How long a worker may hold a job before it is presumed dead and the job is requeued.
+LEASE_SECONDS = 300
+# Retry n waits BACKOFF_BASE * 2**(n-1) seconds, capped at BACKOFF_MAX, plus up to 10% jitter.
+BACKOFF_BASE = 10
+BACKOFF_MAX = 3600
+
+_tasks = {}
+
+
+class UnknownTask(LookupError):
+    pass
+
+
+def task(name):
+    """Register the decorated function as the handler for jobs called ``name``.
+
+    The handler is called with the job payload as keyword arguments. Jobs
+    may run more than once (retries, expired leases), so handlers should be
+    idempotent.
+    """
+    def decorator(fn):
+        _tasks[name] = fn
+        return fn
+    return decorator
+
+
+def enqueue(name, payload=None, delay=0, max_attempts=DEFAULT_MAX_ATTEMPTS):
+    """Queue a job. Inside a transaction it only becomes visible to workers on commit."""
+    if name not in _tasks:
+        raise UnknownTask(name)
+    now = timezone.now()
+    return Job.objects.create(
+        name=name,
+        payload=payload or {},
+        run_at=now + timedelta(seconds=delay),
+        created_at=now,
+        max_attempts=max_attempts,
+    )
+
+
+def enqueue_unique(name, payload=None, delay=0, max_attempts=DEFAULT_MAX_ATTEMPTS):
+    """Queue a job unless an identical one is still waiting to run, and return the waiting job.
+
+    For sweeps and other jobs where one pending run covers every request for it.
+    """
+    waiting = Job.objects.filter(name=name, status=Job.QUEUED, payload=payload or {}).order_by('run_at').first()
+    return waiting or enqueue(name, payload, delay, max_attempts)
+
+
+def claim(worker, limit=1):
+    """Move up to ``limit`` due jobs to RUNNING under ``worker`` and return them.
+
+    Uses SELECT ... FOR UPDATE SKIP LOCKED where the database has it. On
+    SQLite each candidate is taken with an UPDATE conditional on the job
+    still being queued, so concurrent workers never claim the same job.
+    """
+    now = timezone.now()
+    due = Job.objects.filter(status=Job.QUEUED, run_at__lte=now).order_by('run_at', 'id')
+    claimed = {
+        'status': Job.RUNNING,
+        'locked_by': worker,
+        'locked_until': now + timedelta(seconds=LEASE_SECONDS),
+        'started_at': now,
+        'attempts': F('attempts') + 1,
+    }
+    # One transaction, so a failure before the claimed rows are read back
+    # leaves them queued instead of running with nobody working on them.
+    with transaction.atomic():
+        if connection.features.has_select_for_update_skip_locked:
+            ids = list(due.select_for_update(skip_locked=True).values_list('pk', flat=True)[:limit])
+            Job.objects.filter(pk__in=ids).update(**claimed)
+        else:
+            ids = [
+                pk for pk in due.values_list('pk', flat=True)[:limit]
+                if Job.objects.filter(pk=pk, status=Job.QUEUED).update(**claimed)
+            ]
+        return list(Job.objects.filter(pk__in=ids).order_by('run_at', 'id'))
+
+
+def backoff(attempt):
+    seconds = min(BACKOFF_BASE * 2 ** (attempt - 1), BACKOFF_MAX)
+    return timedelta(seconds=seconds * (1 + random.random() / 10))
+
+
+def _finish(job, **fields):
+    # Only the lease holder records an outcome: after an expired lease the
+    # job may already be queued or running elsewhere.
+    return Job.objects.filter(pk=job.pk, status=Job.RUNNING, locked_by=job.locked_by).update(
+        locked_by='', locked_until=None, **fields,
+    )
+
+
+def run(job):
+    """Run a claimed job, then mark it done, schedule a retry or mark it failed."""
+    handler = _tasks.get(job.name)
+    try:
+        if handler is None:
+            raise UnknownTask(job.name)
+        handler(**job.payload)
+    except Exception:
+        error = traceback.format_exc()
+        now = timezone.now()
+        if handler is not None and job.attempts < job.max_attempts:
+            retry_at = now + backoff(job.attempts)
+            _finish(job, status=Job.QUEUED, run_at=retry_at, last_error=error)
+            logger.warning("%s failed (attempt %d/%d), retrying at %s", job, job.attempts, job.max_attempts, retry_at)
+        else:
+            _finish(job, status=Job.FAILED, finished_at=now, last_error=error)
+            logger.error("%s failed permanently after %d attempts", job, job.attempts)
+        return False
+
+    finished = timezone.now()
+    _finish(job, status=Job.DONE, finished_at=finished, last_error='')
+    logger.info(
+        "%s done in %.0fms after waiting %.0fms", job,
+        (finished - job.started_at).total_seconds() * 1000, (job.started_at - job.run_at).total_seconds() * 1000,
+    )
+    return True
+
+
+def requeue_expired():
+    """Requeue running jobs whose lease ran out, failing those out of attempts."""
+    now = timezone.now()
+    expired = Job.objects.filter(status=Job.RUNNING, locked_until__lt=now)
+    released = {'locked_by': '', 'locked_until': None, 'last_error': 'Lease expired'}
+    failed = expired.filter(attempts__gte=F('max_attempts')).update(status=Job.FAILED, finished_at=now, **released)
+    requeued = expired.filter(attempts__lt=F('max_attempts')).update(status=Job.QUEUED, run_at=now, **released)
+    return requeued + failed
+
+
+def prune(older_than):
+    """Delete done jobs scheduled before ``older_than``; failed jobs are kept for inspection."""
+    return Job.objects.filter(status=Job.DONE, run_at__lt=older_than).delete()[0]
+
+
+def _percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def stats(sample=1000):
+    """Queue depth by status and, per job name, wait/run latency of recent done jobs."""
+    now = timezone.now()
+    depth = dict.fromkeys([status for status, _ in Job.STATUS_CHOICES], 0)
+    depth.update(Job.objects.order_by().values_list('status').annotate(n=Count('id')))
+    oldest_due = (
+        Job.objects.filter(status=Job.QUEUED, run_at__lte=now)
+        .order_by('run_at').values_list('run_at', flat=True).first()
+    )
+
+    timings = {}
+    recent = (
+        Job.objects.filter(status=Job.DONE).order_by('-run_at')
+        .values_list('name', 'run_at', 'started_at', 'finished_at')[:sample]
+    )
+    for name, run_at, started_at, finished_at in recent:
+        waits, runs = timings.setdefault(name, ([], []))
+        waits.append((started_at - run_at).total_seconds() * 1000)
+        runs.append((finished_at - started_at).total_seconds() * 1000)
+
+    return {
+        'depth': depth,
+        'oldest_due_age_s': round((now - oldest_due).total_seconds(), 1) if oldest_due else 0,
+        'latency': {
+            name: {
+                'sampled': len(waits),
+                'wait_p50_ms': round(_percentile(waits, 50), 1),
+                'wait_p95_ms': round(_percentile(waits, 95), 1),
+                'run_p50_ms': round(_percentile(runs, 50), 1),
+                'run_p95_ms': round(_percentile(runs, 95), 1),
+            }
+            for name, (waits, runs) in timings.items()
+        },
+    }
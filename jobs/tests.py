@@ -0,0 +1,152 @@
+import threading
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.management import call_command
+from django.db import OperationalError
+from django.test import TestCase, TransactionTestCase
+from django.utils import timezone
+
+from products.checkout import place_order
+from products.models import CartItem, Product
+
+from . import queue
+from .models import Job
+
+calls = []
+
+
+@queue.task('test_record')
+def record(value):
+    calls.append(value)
+
+
+@queue.task('test_fail')
+def fail():
+    raise RuntimeError("boom")
+
+
+class QueueTests(TestCase):
+    def setUp(self):
+        calls.clear()
+
+    def test_enqueue_rejects_unknown_tasks(self):
+        with self.assertRaises(queue.UnknownTask):
+            queue.enqueue('no_such_task')
+
+    def test_enqueue_unique_reuses_the_waiting_job(self):
+        first = queue.enqueue_unique('test_record', {'value': 1}, delay=60)
+        self.assertEqual(queue.enqueue_unique('test_record', {'value': 1}), first)
+        self.assertNotEqual(queue.enqueue_unique('test_record', {'value': 2}), first)
+        Job.objects.filter(pk=first.pk).update(status=Job.RUNNING)
+        self.assertNotEqual(queue.enqueue_unique('test_record', {'value': 1}), first)
+
+    def test_claim_takes_due_jobs_in_order_once(self):
+        later = queue.enqueue('test_record', {'value': 'later'}, delay=60)
+        first = queue.enqueue('test_record', {'value': 1})
+        second = queue.enqueue('test_record', {'value': 2})
+
+        claimed = queue.claim('w1', limit=5)
+        self.assertEqual([job.pk for job in claimed], [first.pk, second.pk])
+        self.assertEqual({job.status for job in claimed}, {Job.RUNNING})
+        self.assertEqual(claimed[0].attempts, 1)
+        self.assertEqual(queue.claim('w2', limit=5), [])
+        later.refresh_from_db()
+        self.assertEqual(later.status, Job.QUEUED)
+
+    def test_successful_run_marks_job_done(self):
+        job = queue.enqueue('test_record', {'value': 'x'})
+        self.assertTrue(queue.run(queue.claim('w1')[0]))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.locked_by), (Job.DONE, ''))
+        self.assertEqual(calls, ['x'])
+
+    def test_failures_retry_with_backoff_then_fail(self):
+        job = queue.enqueue('test_fail', max_attempts=2)
+        with self.assertLogs('jobs.queue', 'WARNING'):
+            self.assertFalse(queue.run(queue.claim('w1')[0]))
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.QUEUED)
+        self.assertGreaterEqual(job.run_at - timezone.now(), timedelta(seconds=queue.BACKOFF_BASE - 1))
+        self.assertIn('RuntimeError: boom', job.last_error)
+
+        Job.objects.filter(pk=job.pk).update(run_at=timezone.now())
+        with self.assertLogs('jobs.queue', 'ERROR'):
+            queue.run(queue.claim('w1')[0])
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.FAILED, 2))
+
+    def test_expired_leases_are_requeued(self):
+        job = queue.enqueue('test_record', {'value': 'x'})
+        claimed = queue.claim('dead-worker')[0]
+        Job.objects.filter(pk=job.pk).update(locked_until=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(queue.requeue_expired(), 1)
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.QUEUED)
+        # The dead worker's late result is ignored.
+        queue.run(claimed)
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.QUEUED)
+
+    def test_stats_report_depth_and_latency(self):
+        queue.enqueue('test_record', {'value': 1})
+        queue.enqueue('test_record', {'value': 2})
+        queue.run(queue.claim('w1')[0])
+        stats = queue.stats()
+        self.assertEqual(stats['depth'], {'queued': 1, 'running': 0, 'done': 1, 'failed': 0})
+        self.assertEqual(stats['latency']['test_record']['sampled'], 1)
+        out = StringIO()
+        call_command('job_stats', stdout=out)
+        self.assertIn('"queued": 1', out.getvalue())
+
+
+class CheckoutJobTests(TransactionTestCase):
+    databases = {'default', 'replica'}
+
+    # The worker runs jobs on its own threads, which only see committed rows.
+    def test_checkout_queues_order_placed_and_worker_sends_confirmation(self):
+        seller = User.objects.create_user('seller', password='pw')
+        buyer = User.objects.create_user('buyer', email='buyer@example.com', password='pw')
+        product = Product.objects.create(user=seller, name='Widget', description='d', price=Decimal('5.00'), stock=3)
+        CartItem.objects.create(user=buyer, product=product, quantity=2)
+        order = place_order(buyer, {'address_line_1': '1 Main St', 'city': 'X'}, {'payment_method': 'cod'})
+
+        job = Job.objects.get()
+        self.assertEqual((job.name, job.payload), ('order_placed', {'order_id': order.pk}))
+        call_command('run_jobs', burst=True, threads=1, stdout=StringIO())
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.DONE)
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertIn('2 x Widget', mail.outbox[0].body)
+
+
+class ConcurrentClaimTests(TransactionTestCase):
+    databases = {'default', 'replica'}
+
+    def test_workers_never_claim_the_same_job(self):
+        for i in range(60):
+            queue.enqueue('test_record', {'value': i})
+        claimed = []
+        lock = threading.Lock()
+
+        def work(name):
+            while True:
+                try:
+                    jobs = queue.claim(name, limit=3)
+                except OperationalError:
+                    continue  # SQLite table lock under contention; try again.
+                if not jobs:
+                    return
+                with lock:
+                    claimed.extend(job.pk for job in jobs)
+
+        threads = [threading.Thread(target=work, args=(f'w{n}',)) for n in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(claimed), 60)
+        self.assertEqual(len(set(claimed)), 60)
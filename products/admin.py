@@ -1,6 +1,191 @@
-from django.contrib import admin
-from .models import Product, CartItem
+from django import forms
+from django.contrib import admin, messages
+from django.contrib.admin.helpers import ActionForm
+from django.contrib.auth.models import User
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import F, Max, Q
+from django.db.models.functions import Round
+from django.utils import timezone
+from django.utils.functional import cached_property
 
-# Register your models here.
-admin.site.register(Product)
-admin.site.register(CartItem)
\ No newline at end of file
+from . import carts, search
+from .catalog import bump_catalog_version
+from .models import Product, CartItem, Order, OrderItem
+
+# Rows are only ever added, so the largest primary key is close to the row count.
+APPEND_ONLY_MODELS = (Order, OrderItem)
+
+
+class EstimatedCountPaginator(Paginator):
+    """Changelist paginator that never counts a big table row by row.
+
+    An unfiltered list takes the row count from the planner's statistics on
+    PostgreSQL, which can lag recent writes. Elsewhere only append-only
+    tables are estimated, by their largest primary key; tables with deletes,
+    such as cart lines, would be overcounted and offer pages that do not
+    exist. Below ``exact_below`` rows, and for every list without an
+    estimate, the count is exact but stops at ``exact_below``.
+    """
+
+    exact_below = 10_000
+
+    def _estimate(self):
+        queryset = self.object_list
+        connection = connections[queryset.db]
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT reltuples FROM pg_class WHERE oid = %s::regclass', [queryset.model._meta.db_table])
+                row = cursor.fetchone()
+            # -1 until the table is first analyzed.
+            return int(row[0]) if row and row[0] >= 0 else None
+        if queryset.model in APPEND_ONLY_MODELS:
+            return queryset.model._default_manager.using(queryset.db).aggregate(last=Max('pk'))['last'] or 0
+        return None
+
+    @cached_property
+    def count(self):
+        if not self.object_list.query.has_filters():
+            estimate = self._estimate()
+            if estimate is not None and estimate >= self.exact_below:
+                return estimate
+        return self.object_list.order_by()[:self.exact_below].count()
+
+
+class FastCountAdmin(admin.ModelAdmin):
+    paginator = EstimatedCountPaginator
+    # Skips the second, unfiltered COUNT(*) on filtered changelists.
+    show_full_result_count = False
+
+
+class ExactSearchAdmin(FastCountAdmin):
+    """Changelist search for an exact id or buyer's username, each an index lookup.
+
+    The admin's own ``=field`` search is ``iexact``, a LIKE that scans the
+    table. ``search_id_field`` is matched when the term is a number and
+    ``search_user_field``, if set, against the user with that username.
+    """
+    search_id_field = 'pk'
+    search_user_field = 'user'
+
+    def get_search_results(self, request, queryset, search_term):
+        search_term = search_term.strip()
+        if not search_term:
+            return queryset, False
+        match = Q(pk__in=[])
+        if search_term.isdigit():
+            match |= Q(**{self.search_id_field: int(search_term)})
+        if self.search_user_field:
+            users = User.objects.filter(username=search_term).values('pk')
+            match |= Q(**{f'{self.search_user_field}__in': users})
+        return queryset.filter(match), False
+
+
+class ProductActionForm(ActionForm):
+    quantity = forms.IntegerField(label="Units", required=False, min_value=1, help_text="Units to add when restocking.")
+    percent = forms.DecimalField(
+        label="Percent", required=False, min_value=-90, max_value=1000, decimal_places=2,
+        help_text="Price change in percent, e.g. 10 or -15.",
+    )
+
+
+def _update_products(queryset, **changes):
+    # One UPDATE; signals do not fire, so do what they would.
+    updated = queryset.update(**changes, version=F('version') + 1, updated_at=timezone.now())
+    bump_catalog_version()
+    return updated
+
+
+@admin.register(Product)
+class ProductAdmin(FastCountAdmin):
+    list_display = ('name', 'sku', 'user', 'price', 'stock', 'reserved', 'stock_shards', 'updated_at')
+    list_select_related = ('user',)
+    autocomplete_fields = ('user',)
+    # Full-text matches come from the search index; see get_search_results.
+    search_fields = ('name',)
+    search_help_text = "Words from the name or description, or an exact SKU."
+    action_form = ProductActionForm
+    actions = ('restock', 'update_prices')
+
+    def get_search_results(self, request, queryset, search_term):
+        search_term = search_term.strip()
+        tokens = search.tokenize(search_term)
+        if not tokens:
+            return queryset, False
+        # Every match the index ranks, the newest SEARCH_CANDIDATES.
+        pks = search.get_backend().search(tokens, {}, offset=0, limit=search.SEARCH_CANDIDATES)
+        return queryset.filter(Q(pk__in=pks) | Q(sku=search_term)), False
+
+    def _action_value(self, request, field):
+        form = self.action_form(request.POST)
+        form.fields['action'].choices = self.get_action_choices(request)
+        value = form.cleaned_data[field] if form.is_valid() else None
+        if value is None:
+            self.message_user(request, f"Enter a valid {form.fields[field].label.lower()} for this action.", messages.ERROR)
+        return value
+
+    @admin.action(description="Restock selected products", permissions=['change'])
+    def restock(self, request, queryset):
+        quantity = self._action_value(request, 'quantity')
+        if quantity is not None:
+            updated = _update_products(queryset, stock=F('stock') + quantity)
+            self.message_user(request, f"Added {quantity} units to {updated} products.", messages.SUCCESS)
+
+    @admin.action(description="Change prices of selected products by a percentage", permissions=['change'])
+    def update_prices(self, request, queryset):
+        percent = self._action_value(request, 'percent')
+        if percent is not None:
+            updated = _update_products(queryset, price=Round(F('price') * (1 + percent / 100), 2))
+            carts.bump_prices_version()
+            self.message_user(request, f"Changed the price of {updated} products by {percent}%.", messages.SUCCESS)
+
+
+@admin.register(CartItem)
+class CartItemAdmin(ExactSearchAdmin):
+    # Explicit columns: __str__ would load the product and user once per row.
+    list_display = ('id', 'user', 'product', 'quantity')
+    list_select_related = ('user', 'product')
+    autocomplete_fields = ('user', 'product')
+    # Shows the search box; ExactSearchAdmin does the matching.
+    search_fields = ('id', 'user__username')
+    search_help_text = "A cart line id or the buyer's exact username."
+
+
+class OrderItemInline(admin.TabularInline):
+    model = OrderItem
+    fields = ('product', 'product_name', 'quantity', 'price_at_purchase')
+    # Order lines are a record of the sale; correct them with a new order instead.
+    readonly_fields = fields
+    extra = 0
+    can_delete = False
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('product')
+
+
+@admin.register(Order)
+class OrderAdmin(ExactSearchAdmin):
+    list_display = ('id', 'user', 'created_at', 'total_price', 'payment_method')
+    list_select_related = ('user',)
+    raw_id_fields = ('user',)
+    search_fields = ('id', 'user__username')
+    search_help_text = "An order number or the buyer's exact username."
+    inlines = (OrderItemInline,)
+
+    def get_queryset(self, request):
+        # The change page title is Order.__str__, which shows the username.
+        return super().get_queryset(request).select_related('user')
+
+
+@admin.register(OrderItem)
+class OrderItemAdmin(ExactSearchAdmin):
+    list_display = ('id', 'order', 'product_name', 'quantity', 'price_at_purchase')
+    list_select_related = ('order__user',)
+    raw_id_fields = ('order', 'product')
+    search_fields = ('order__id',)
+    search_help_text = "An order number."
+    search_id_field = 'order_id'
+    search_user_field = None
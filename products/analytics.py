@@ -0,0 +1,163 @@
+"""Seller sales reports, read from daily rollups.
+
+Checkout adds each order to DailyProductSales in the order's own
+transaction, so a report aggregates at most one row per product per day
+instead of every OrderItem, and rollups never disagree with committed
+orders. ``backfill`` rebuilds them from the order history.
+
+Days are calendar days in the current time zone (settings.TIME_ZONE).
+"""
+from collections import defaultdict
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Case, Count, DecimalField, ExpressionWrapper, F, IntegerField, Max, Sum, Value, When
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import DailyProductSales, Order, OrderItem, Product
+
+BACKFILL_BATCH_SIZE = 10_000
+# Products per UPDATE; each adds three CASE branches and an IN parameter.
+RECORD_CHUNK_SIZE = 500
+TOP_PRODUCTS = 10
+# Day ranges offered by the sales report; the first is the default.
+REPORT_PERIODS = (30, 7, 90, 365)
+
+MONEY = DecimalField(max_digits=14, decimal_places=2)
+LINE_REVENUE = ExpressionWrapper(F('quantity') * F('price_at_purchase'), output_field=MONEY)
+
+
+def _by_product(values, output_field):
+    return Case(
+        *[When(product_id=product_id, then=Value(value)) for product_id, value in values.items()],
+        default=Value(0),
+        output_field=output_field,
+    )
+
+
+def _add(day, sales):
+    """Add ``{product_id: {'seller_id', 'orders', 'units', 'revenue'}}`` to ``day``'s rollups."""
+    items = list(sales.items())
+    for start in range(0, len(items), RECORD_CHUNK_SIZE):
+        chunk = dict(items[start:start + RECORD_CHUNK_SIZE])
+        DailyProductSales.objects.bulk_create(
+            [DailyProductSales(day=day, product_id=pk, seller_id=sale['seller_id']) for pk, sale in chunk.items()],
+            ignore_conflicts=True,
+        )
+        # Increments rather than overwrites, so concurrent checkouts on the same row both count.
+        DailyProductSales.objects.filter(day=day, product_id__in=list(chunk)).update(**{
+            field: F(field) + _by_product({pk: sale[field] for pk, sale in chunk.items()}, output_field)
+            for field, output_field in (('orders', IntegerField()), ('units', IntegerField()), ('revenue', MONEY))
+        })
+
+
+def _fill(day, sales):
+    """Like ``_add`` for a day only backfill writes to: new rows are inserted with their totals."""
+    existing = set(DailyProductSales.objects.filter(day=day).values_list('product_id', flat=True))
+    DailyProductSales.objects.bulk_create([
+        DailyProductSales(day=day, product_id=pk, **sale) for pk, sale in sales.items() if pk not in existing
+    ])
+    # Products whose day straddles two batches.
+    _add(day, {pk: sale for pk, sale in sales.items() if pk in existing})
+
+
+def record_order(order, lines):
+    """Add an order's ``(product, quantity, price)`` lines to the rollups; call inside its transaction."""
+    sales = {}
+    for product, quantity, price in lines:
+        sale = sales.setdefault(product.pk, {'seller_id': product.user_id, 'orders': 1, 'units': 0, 'revenue': 0})
+        sale['units'] += quantity
+        sale['revenue'] += quantity * price
+    _add(timezone.localdate(order.created_at), sales)
+
+
+def backfill(batch_size=BACKFILL_BATCH_SIZE, progress=None):
+    """Rebuild every rollup from OrderItem, ``batch_size`` orders at a time; returns the orders covered.
+
+    Each batch is one GROUP BY over an order id range and commits on its own,
+    so memory use is flat and the database is never locked for long. Orders
+    placed while it runs are newer than the last id it covers and are counted
+    by checkout as usual. Reports are incomplete until it finishes.
+    """
+    # Checkout can only add to today's rows and later ones; older days are backfill's alone.
+    today = timezone.localdate()
+    with transaction.atomic():
+        DailyProductSales.objects.all().delete()
+        last_id = Order.objects.aggregate(last=Max('pk'))['last'] or 0
+    covered = 0
+    for start in range(0, last_id, batch_size):
+        batch = OrderItem.objects.filter(order_id__gt=start, order_id__lte=start + batch_size)
+        rows = (
+            batch.annotate(day=TruncDate('order__created_at'))
+            .values('day', 'product_id', 'product__user_id')
+            .annotate(orders=Count('order_id', distinct=True), units=Sum('quantity'), revenue=Sum(LINE_REVENUE))
+            .order_by()
+        )
+        by_day = defaultdict(dict)
+        for row in rows:
+            by_day[row['day']][row['product_id']] = {
+                'seller_id': row['product__user_id'], 'orders': row['orders'],
+                'units': row['units'], 'revenue': row['revenue'],
+            }
+        with transaction.atomic():
+            for day, sales in by_day.items():
+                (_add if day >= today else _fill)(day, sales)
+        covered = min(start + batch_size, last_id)
+        if progress:
+            progress(covered, last_id)
+    return covered
+
+
+def period(days):
+    """``(start, end)`` of the last ``days`` days including today."""
+    end = timezone.localdate()
+    return end - timedelta(days=days - 1), end
+
+
+def rollups(seller=None, start=None, end=None):
+    """DailyProductSales rows between ``start`` and ``end`` inclusive, optionally for one seller."""
+    rollups = DailyProductSales.objects.all()
+    if seller is not None:
+        rollups = rollups.filter(seller=seller)
+    if start is not None:
+        rollups = rollups.filter(day__gte=start)
+    if end is not None:
+        rollups = rollups.filter(day__lte=end)
+    return rollups.order_by()
+
+
+def totals(seller=None, start=None, end=None):
+    """``{'units', 'revenue'}`` sold between ``start`` and ``end`` inclusive, optionally for one seller."""
+    result = rollups(seller, start, end).aggregate(units=Sum('units'), revenue=Sum('revenue'))
+    return {'units': result['units'] or 0, 'revenue': result['revenue'] or Decimal('0.00')}
+
+
+def revenue_by_day(seller=None, start=None, end=None):
+    """``[{'day', 'units', 'revenue'}]`` for each day with sales, oldest first."""
+    return list(
+        rollups(seller, start, end).values('day')
+        .annotate(units=Sum('units'), revenue=Sum('revenue')).order_by('day')
+    )
+
+
+def top_products(seller=None, start=None, end=None, limit=TOP_PRODUCTS, by='revenue'):
+    """The ``limit`` best sellers by ``'revenue'`` or ``'units'``: ``[{'product', 'orders', 'units', 'revenue'}]``."""
+    rows = list(
+        rollups(seller, start, end).values('product_id')
+        .annotate(orders=Sum('orders'), units=Sum('units'), revenue=Sum('revenue'))
+        .order_by(f'-{by}', 'product_id')[:limit]
+    )
+    products = Product.objects.only('name').in_bulk([row['product_id'] for row in rows])
+    for row in rows:
+        row['product'] = products[row.pop('product_id')]
+    return rows
+
+
+def revenue_by_seller(start=None, end=None):
+    """``[{'seller_id', 'units', 'revenue'}]``, highest revenue first."""
+    return list(
+        rollups(start=start, end=end).values('seller_id')
+        .annotate(units=Sum('units'), revenue=Sum('revenue')).order_by('-revenue', 'seller_id')
+    )
@@ -0,0 +1,112 @@
+from django.db.models import Prefetch
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition, conditional_page
+from rest_framework import generics, permissions, status
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from . import carts, catalog
+from .conditional import catalog_api_etag, catalog_api_last_modified, product_api_etag, product_api_last_modified
+from .checkout import place_order, EmptyCartError, InsufficientStockError
+from .forms import ShippingAddressForm, PaymentMethodForm
+from .models import Product, CartItem, Order, OrderItem
+from .pagination import ProductCursorPagination, OrderCursorPagination
+from .serializers import (
+    PRODUCT_LIST_COLUMNS, ProductListSerializer, ProductDetailSerializer, CartItemSerializer, OrderSerializer,
+)
+
+
+def order_items_prefetch():
+    return Prefetch('items', queryset=OrderItem.objects.only(
+        'order_id', 'product_id', 'product_name', 'quantity', 'price_at_purchase',
+    ))
+
+
+@method_decorator(condition(catalog_api_etag, catalog_api_last_modified), name='dispatch')
+class ProductListAPIView(generics.ListAPIView):
+    serializer_class = ProductListSerializer
+    pagination_class = ProductCursorPagination
+    queryset = Product.objects.only(*PRODUCT_LIST_COLUMNS)
+
+    def paginate_queryset(self, queryset):
+        return catalog.with_shard_stock(super().paginate_queryset(queryset))
+
+
+@method_decorator(condition(product_api_etag, product_api_last_modified), name='dispatch')
+class ProductDetailAPIView(generics.RetrieveAPIView):
+    serializer_class = ProductDetailSerializer
+    queryset = Product.objects.defer('user')
+
+    def get_object(self):
+        return catalog.with_shard_stock([super().get_object()])[0]
+
+
+@method_decorator(conditional_page, name='dispatch')
+class CartItemListCreateAPIView(generics.ListCreateAPIView):
+    serializer_class = CartItemSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    pagination_class = None
+
+    def get_queryset(self):
+        return (
+            CartItem.objects.filter(user=self.request.user)
+            .select_related('product')
+            .only('id', 'quantity', 'product_id', *[f'product__{field}' for field in PRODUCT_LIST_COLUMNS])
+            .order_by('id')
+        )
+
+
+class CartItemDetailAPIView(generics.RetrieveUpdateDestroyAPIView):
+    serializer_class = CartItemSerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_queryset(self):
+        return CartItem.objects.filter(user=self.request.user).select_related('product')
+
+    def perform_destroy(self, instance):
+        carts.remove_item(instance)
+
+
+class CheckoutAPIView(APIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request):
+        address_form = ShippingAddressForm(request.data)
+        payment_form = PaymentMethodForm(request.data)
+        if not (address_form.is_valid() and payment_form.is_valid()):
+            return Response({**address_form.errors, **payment_form.errors}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            order = place_order(request.user, address_form.cleaned_data, payment_form.cleaned_data)
+        except EmptyCartError as e:
+            return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except InsufficientStockError as e:
+            return Response({
+                'detail': str(e),
+                'failed_lines': [
+                    {'cart_item': item.pk, 'product_id': item.product_id, 'requested': item.quantity, 'available': available}
+                    for item, available in e.failed_lines
+                ],
+            }, status=status.HTTP_409_CONFLICT)
+
+        order = Order.objects.prefetch_related(order_items_prefetch()).get(pk=order.pk)
+        return Response(OrderSerializer(order).data, status=status.HTTP_201_CREATED)
+
+
+@method_decorator(conditional_page, name='dispatch')
+class OrderListAPIView(generics.ListAPIView):
+    serializer_class = OrderSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    pagination_class = OrderCursorPagination
+
+    def get_queryset(self):
+        return Order.objects.filter(user=self.request.user).prefetch_related(order_items_prefetch())
+
+
+@method_decorator(conditional_page, name='dispatch')
+class OrderDetailAPIView(generics.RetrieveAPIView):
+    serializer_class = OrderSerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_queryset(self):
+        return Order.objects.filter(user=self.request.user).prefetch_related(order_items_prefetch())
@@ -0,0 +1,16 @@
+from django.urls import path
+from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
+
+from . import api
+
+urlpatterns = [
+    path('token/', TokenObtainPairView.as_view(), name='api_token_obtain_pair'),
+    path('token/refresh/', TokenRefreshView.as_view(), name='api_token_refresh'),
+    path('products/', api.ProductListAPIView.as_view(), name='api_product_list'),
+    path('products/<int:pk>/', api.ProductDetailAPIView.as_view(), name='api_product_detail'),
+    path('cart/', api.CartItemListCreateAPIView.as_view(), name='api_cart'),
+    path('cart/<int:pk>/', api.CartItemDetailAPIView.as_view(), name='api_cart_item'),
+    path('checkout/', api.CheckoutAPIView.as_view(), name='api_checkout'),
+    path('orders/', api.OrderListAPIView.as_view(), name='api_order_list'),
+    path('orders/<int:pk>/', api.OrderDetailAPIView.as_view(), name='api_order_detail'),
+]
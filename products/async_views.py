@@ -0,0 +1,68 @@
+"""Async-native versions of the read-heavy storefront pages, served under ASGI.
+
+They use the same service functions as the views in ``views.py`` through
+their async counterparts; writes still go through the sync views.
+"""
+from asgiref.sync import sync_to_async
+from django.contrib.auth.decorators import login_required
+from django.http import Http404
+from django.shortcuts import render
+from django.views.decorators.cache import never_cache
+
+from . import carts, catalog, orders, recommendations, views
+from .conditional import acatalog_page_etag, aproduct_page_etag, revalidated_page
+from .forms import AddToCartForm
+from .models import Product
+
+
+async def _render(request, template_name, context):
+    # Templates read request.user and the navbar cart summary through lazy,
+    # synchronous lookups; resolve both up front so rendering does no I/O.
+    request.user = await request.auser()
+    context['cart_summary'] = await carts.arequest_summary(request)
+    return render(request, template_name, context)
+
+
+@revalidated_page(acatalog_page_etag)
+async def products(request):
+    try:
+        page = await catalog.aget_page(after=request.GET.get('after'), before=request.GET.get('before'))
+    except catalog.InvalidCursor:
+        page = await catalog.aget_page()
+
+    return await _render(request, 'products.html', {
+        'products': page,
+        'product_count': await catalog.aapproximate_count(),
+    })
+
+
+@revalidated_page(aproduct_page_etag)
+async def product_detail(request, pk):
+    if request.method == 'POST':
+        # Adding to the cart needs transaction.atomic, which is sync-only.
+        return await sync_to_async(views.product_detail)(request, pk)
+    try:
+        product = await catalog.aget_product(pk)
+    except Product.DoesNotExist:
+        raise Http404("No Product matches the given query.")
+    return await _render(request, 'product_detail.html', {
+        'product': product,
+        'add_to_cart_form': AddToCartForm(),
+        'recommendations': await recommendations.afor_product(pk),
+    })
+
+
+@never_cache
+async def cart(request):
+    user = await request.auser()
+    if user.is_authenticated:
+        items = await carts.alines(user)
+    else:
+        items = await carts.guest_cart(request).alines()
+    return await _render(request, 'cart.html', {'items': items, 'total': carts.grand_total(items)})
+
+
+@login_required
+async def order_history(request):
+    page = await orders.ahistory_page(await request.auser(), request.GET.get('page'))
+    return await _render(request, 'order_history.html', {'orders': page})
@@ -0,0 +1,9 @@
+from asgiref.sync import sync_to_async
+from social_core.backends.google import GoogleOAuth2 as BaseGoogleOAuth2
+
+
+class GoogleOAuth2(BaseGoogleOAuth2):
+    """social-auth's Google backend plus the ``aget_user`` that ``request.auser()`` needs."""
+
+    async def aget_user(self, user_id):
+        return await sync_to_async(self.get_user)(user_id)
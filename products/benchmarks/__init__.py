@@ -0,0 +1,22 @@
+"""Benchmarks run with ``python manage.py bench <name>``.
+
+Each module listed in BENCHMARKS exposes ``add_arguments(parser)`` and
+``run(options, stdout)`` and is executed against a throwaway test database.
+"""
+
+BENCHMARKS = [
+    'order_history',
+    'indexes',
+    'storefront',
+    'sync_vs_async',
+    'bulk_import',
+    'page_weight',
+    'flash_sale',
+    'template_render',
+    'conditional_get',
+    'sales_report',
+    'recommendations',
+    'guest_carts',
+    'sharded_stock',
+    'search',
+]
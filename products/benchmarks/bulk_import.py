@@ -0,0 +1,73 @@
+"""Rows per second of the bulk product import and the streaming export."""
+import csv
+import io
+import time
+
+from django.db import transaction
+
+from products import bulk
+from products.models import Product
+
+from .seed import seed_users
+
+
+def add_arguments(parser):
+    parser.add_argument('--rows', type=int, default=100_000)
+    parser.add_argument('--chunk-size', type=int, default=bulk.CHUNK_SIZE)
+    parser.add_argument('--baseline-rows', type=int, default=2000,
+                        help="Rows imported one update_or_create() at a time for comparison.")
+
+
+def make_csv(count, price_offset=0):
+    out = io.StringIO()
+    writer = csv.writer(out)
+    writer.writerow(bulk.FIELDS)
+    for i in range(count):
+        writer.writerow([f'SKU-{i:07d}', f'Imported {i:07d}', f'Bulk imported product {i}.',
+                         f'{5 + (i + price_offset) % 200}.99', 100, ''])
+    out.seek(0)
+    return out
+
+
+def row_by_row(seller, rows):
+    # What a naive importer does: one transaction and several queries per row.
+    for _, row in rows:
+        values, errors = bulk.clean_row(row)
+        if not errors:
+            with transaction.atomic():
+                Product.objects.update_or_create(user=seller, sku=values.pop('sku'), defaults=values)
+
+
+def timed(fn, rows):
+    started = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - started
+    return {'rows': rows, 'seconds': round(elapsed, 3), 'rows_per_s': round(rows / elapsed) if elapsed else 0}
+
+
+def run(options, stdout):
+    seller, baseline_seller = seed_users(2)
+    count, chunk_size = options['rows'], options['chunk_size']
+
+    results = {}
+    results['insert'] = timed(
+        lambda: bulk.import_products(seller, bulk.read_rows(make_csv(count), 'csv'), chunk_size), count,
+    )
+    results['update'] = timed(
+        lambda: bulk.import_products(seller, bulk.read_rows(make_csv(count, 1), 'csv'), chunk_size), count,
+    )
+    results['export_csv'] = timed(
+        lambda: sum(1 for _ in bulk.export_lines(bulk.export_rows(seller), 'csv')), count,
+    )
+    results['export_jsonl'] = timed(
+        lambda: sum(1 for _ in bulk.export_lines(bulk.export_rows(seller), 'jsonl')), count,
+    )
+    baseline = options['baseline_rows']
+    results['row_by_row'] = timed(
+        lambda: row_by_row(baseline_seller, bulk.read_rows(make_csv(baseline), 'csv')), baseline,
+    )
+
+    stdout.write(f"bulk import/export of {count} rows, chunks of {chunk_size}")
+    for name, stats in results.items():
+        stdout.write(f"  {name:<13} {stats['rows']:>8} rows {stats['seconds']:>8.2f}s {stats['rows_per_s']:>10} rows/s")
+    return results
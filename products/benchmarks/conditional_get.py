@@ -0,0 +1,139 @@
+"""Replay of browsing sessions with and without conditional GETs.
+
+Each simulated user has a browser cache: a page it has seen is requested
+again with the stored ETag, as browsers do for ``Cache-Control: no-cache``.
+Between page views, sellers edit products and users add to their carts, which
+changes the catalog and the user's navbar respectively. The ``no validators``
+run replays the same trace without If-None-Match, as under ``never_cache``.
+"""
+import random
+import time
+
+from django.core.cache import cache
+from django.test import Client
+from django.urls import reverse
+
+from products import carts, catalog
+from products.models import CartItem, Product
+
+from .seed import seed_products, seed_users
+from .utils import summarize
+
+
+def add_arguments(parser):
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--products', type=int, default=2000)
+    parser.add_argument('--requests', type=int, default=3000)
+    parser.add_argument('--hot-products', type=int, default=50, help="Product pages most views go to.")
+    parser.add_argument('--edit-rate', type=float, default=0.01, help="Chance of a product edit before each view.")
+    parser.add_argument('--cart-rate', type=float, default=0.02, help="Chance the viewer adds to their cart first.")
+    parser.add_argument('--seed', type=int, default=1)
+
+
+def catalog_urls(pages=5):
+    urls, page = [reverse('products')], catalog.get_page()
+    while page.has_next and len(urls) < pages:
+        urls.append(f"{reverse('products')}?after={page.next_cursor}")
+        page = catalog.get_page(after=page.next_cursor)
+    return urls
+
+
+def make_trace(options, users, product_ids):
+    """(user index, url, write) triples; the same trace is replayed in every mode."""
+    rng = random.Random(options['seed'])
+    hot = product_ids[:options['hot_products']]
+    pages = catalog_urls()
+    searches = [f"{reverse('search')}?q={q}" for q in ('product', 'number 1', 'short description')]
+    trace = []
+    for _ in range(options['requests']):
+        roll = rng.random()
+        if roll < 0.4:
+            url = rng.choice(pages)
+        elif roll < 0.9:
+            pk = rng.choice(hot) if rng.random() < 0.8 else rng.choice(product_ids)
+            url = reverse('product_detail', args=[pk])
+        else:
+            url = rng.choice(searches)
+        write = None
+        if rng.random() < options['edit_rate']:
+            write = ('edit', rng.choice(product_ids))
+        elif rng.random() < options['cart_rate']:
+            write = ('cart', rng.choice(hot))
+        trace.append((rng.randrange(len(users)), url, write))
+    return trace
+
+
+def replay(trace, users, send_validators):
+    clients = []
+    for user in users:
+        client = Client()
+        client.force_login(user)
+        # Pick up the CSRF cookie a login form would have set.
+        client.get(reverse('products'))
+        clients.append(client)
+    browser_caches = [{} for _ in users]
+    timings = {200: [], 304: []}
+    body_bytes = revalidations = 0
+
+    for index, url, write in trace:
+        if write and write[0] == 'edit':
+            product = Product.objects.get(pk=write[1])
+            product.price += 1
+            product.save()
+        elif write:
+            carts.add_item(users[index], Product.objects.get(pk=write[1]))
+        headers = {}
+        if send_validators and url in browser_caches[index]:
+            headers['If-None-Match'] = browser_caches[index][url]
+            revalidations += 1
+        started = time.perf_counter()
+        response = clients[index].get(url, headers=headers)
+        timings[response.status_code].append(time.perf_counter() - started)
+        body_bytes += len(response.content)
+        if 'ETag' in response:
+            browser_caches[index][url] = response['ETag']
+    return timings, body_bytes, revalidations
+
+
+def run(options, stdout):
+    accounts = seed_users(options['users'] + 1)
+    seller, users = accounts[0], accounts[1:]
+    seed_products(seller, options['products'])
+    product_ids = list(Product.objects.order_by('pk').values_list('pk', flat=True))
+    trace = make_trace(options, users, product_ids)
+    writes = sum(1 for _, _, write in trace if write)
+
+    results = {}
+    stdout.write(
+        f"conditional GET replay: {len(trace)} page views by {len(users)} users, {writes} writes in between"
+    )
+    stdout.write(
+        f"  {'mode':<14} {'304s':>6} {'ratio':>6} {'of reval':>8} {'KiB sent':>9} {'200 p50':>9} {'304 p50':>9} "
+        f"{'total':>7}"
+    )
+    for mode, send_validators in (('no validators', False), ('validators', True)):
+        # Both runs start from the same product data, empty carts and a cold cache.
+        Product.objects.update(price=10)
+        CartItem.objects.all().delete()
+        cache.clear()
+        started = time.perf_counter()
+        timings, body_bytes, revalidations = replay(trace, users, send_validators)
+        elapsed = time.perf_counter() - started
+        not_modified = len(timings[304])
+        results[mode] = {
+            'not_modified': not_modified,
+            'ratio': round(not_modified / len(trace), 4),
+            'revalidations': revalidations,
+            'body_bytes': body_bytes,
+            'ok': summarize(timings[200]),
+            'not_modified_latency': summarize(timings[304]),
+            'seconds': round(elapsed, 3),
+        }
+        stdout.write(
+            f"  {mode:<14} {not_modified:>6} {not_modified / len(trace):>6.1%} "
+            f"{not_modified / revalidations if revalidations else 0:>8.1%} {body_bytes / 1024:>9.0f} "
+            f"{results[mode]['ok']['p50_ms']:>7.2f}ms {results[mode]['not_modified_latency']['p50_ms']:>7.2f}ms "
+            f"{elapsed:>6.2f}s"
+        )
+    stdout.write("  ratio = 304s per page view; of reval = 304s per request that sent If-None-Match")
+    return results
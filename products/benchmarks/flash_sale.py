@@ -0,0 +1,152 @@
+"""Hundreds of buyers checking out one SKU at once, with and without checkout holds.
+
+Buyers are threads that spend most of their time between pages; each page
+is served by a fixed pool of "server" workers, as behind a real app server,
+so the database sees at most --workers concurrent transactions.
+"""
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import OperationalError, connection
+
+from jobs.models import Job
+from products import carts
+from products.checkout import InsufficientStockError, place_order, reserve_cart
+from products.models import CartItem, Order, Product, Reservation
+
+from .seed import seed_users
+from .utils import summarize
+
+SHIPPING = {'address_line_1': '1 Main St', 'city': 'Springfield', 'country': 'US'}
+PAYMENT = {'payment_method': 'cod'}
+
+
+def add_arguments(parser):
+    parser.add_argument('--buyers', type=int, default=400)
+    parser.add_argument('--stock', type=int, default=50)
+    parser.add_argument('--workers', type=int, default=8, help="Server threads handling requests.")
+    parser.add_argument('--think-ms', type=float, default=20, help="Pause between checkout steps.")
+    parser.add_argument('--seed', type=int, default=1)
+
+
+class Run:
+    def __init__(self, server):
+        self.server = server
+        self.lock = threading.Lock()
+        self.timings = {'reserve': [], 'place_order': []}
+        self.outcomes = {'ordered': 0, 'turned_away_at_details': 0, 'failed_at_summary': 0}
+        self.requests = 0
+        self.wasted_requests = 0
+        self.lock_retries = 0
+
+    def call(self, step, fn):
+        return self.server.submit(self.handle, step, fn).result()
+
+    def handle(self, step, fn):
+        # SQLite reports writer contention as "table is locked"; retry like a client would.
+        started = time.perf_counter()
+        try:
+            for attempt in range(1000):
+                try:
+                    return fn()
+                except OperationalError:
+                    with self.lock:
+                        self.lock_retries += 1
+                    time.sleep(random.uniform(0, 0.001 * min(attempt + 1, 20)))
+            raise RuntimeError(f"{step} never got the database lock")
+        finally:
+            if step in self.timings:
+                with self.lock:
+                    self.timings[step].append(time.perf_counter() - started)
+
+
+def checkout(run, user, reserve, think):
+    """One buyer's trip: details page, summary page, place order."""
+    requests = 0
+    outcome = 'ordered'
+    try:
+        requests += 1
+        if reserve:
+            run.call('reserve', lambda: reserve_cart(user))
+        else:
+            run.call('details', lambda: list(carts.lines(user)))
+        time.sleep(think)
+        requests += 1
+        run.call('summary', lambda: list(carts.lines(user)))
+        time.sleep(think)
+        requests += 1
+        try:
+            run.call('place_order', lambda: place_order(user, SHIPPING, PAYMENT))
+        except InsufficientStockError:
+            outcome = 'failed_at_summary'
+    except InsufficientStockError:
+        outcome = 'turned_away_at_details'
+    with run.lock:
+        run.outcomes[outcome] += 1
+        run.requests += requests
+        if outcome != 'ordered':
+            run.wasted_requests += requests
+
+
+def reset(product, users, stock):
+    Order.objects.all().delete()
+    Reservation.objects.all().delete()
+    Job.objects.all().delete()
+    CartItem.objects.all().delete()
+    Product.objects.filter(pk=product.pk).update(stock=stock, reserved=0)
+    CartItem.objects.bulk_create([CartItem(user=user, product=product, quantity=1) for user in users])
+
+
+def run(options, stdout):
+    random.seed(options['seed'])
+    seller, *users = seed_users(options['buyers'] + 1)
+    product = Product.objects.create(user=seller, name='Flash sale item', description='d', price=10, stock=0)
+
+    results = {}
+    for mode, reserve in (('no_holds', False), ('holds', True)):
+        reset(product, users, options['stock'])
+        with ThreadPoolExecutor(max_workers=options['workers']) as server:
+            run_ = Run(server)
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=options['buyers']) as buyers:
+                trips = [
+                    buyers.submit(checkout, run_, user, reserve, options['think_ms'] / 1000)
+                    for user in random.sample(users, len(users))
+                ]
+                for trip in trips:
+                    trip.result()
+            elapsed = time.perf_counter() - started
+            for _ in range(options['workers']):
+                server.submit(connection.close)
+
+        product.refresh_from_db()
+        sold = Order.objects.count()
+        assert sold == options['stock'] and product.stock == 0, "oversold or undersold"
+        results[mode] = {
+            'seconds': round(elapsed, 3),
+            **run_.outcomes,
+            'requests': run_.requests,
+            'wasted_requests': run_.wasted_requests,
+            'lock_retries': run_.lock_retries,
+            'reserve': summarize(run_.timings['reserve']),
+            'place_order': summarize(run_.timings['place_order']),
+        }
+
+    stdout.write(
+        f"flash sale: {options['buyers']} buyers, {options['stock']} in stock, "
+        f"{options['workers']} server workers, {options['think_ms']:g}ms between steps"
+    )
+    stdout.write(
+        f"  {'mode':<9} {'ordered':>8} {'away@1':>7} {'fail@3':>7} {'requests':>9} {'wasted':>7} "
+        f"{'retries':>8} {'order p95':>10} {'wall':>7}"
+    )
+    for mode, r in results.items():
+        stdout.write(
+            f"  {mode:<9} {r['ordered']:>8} {r['turned_away_at_details']:>7} {r['failed_at_summary']:>7} "
+            f"{r['requests']:>9} {r['wasted_requests']:>7} {r['lock_retries']:>8} "
+            f"{r['place_order']['p95_ms']:>8.1f}ms {r['seconds']:>6.2f}s"
+        )
+    stdout.write("  away@1 = turned away entering checkout; fail@3 = failed after the summary page")
+    return results
@@ -0,0 +1,145 @@
+"""Database writes of browsing sessions with account carts versus guest carts.
+
+Each session looks at the catalog and a few products, adds two of them to the
+cart, changes a quantity and looks at the cart; most leave without checking
+out. ``account carts`` replays the sessions as the site used to require:
+logged in first, every cart change a CartItem write. ``guest carts`` replays
+the same sessions anonymously, and the share given by ``--login-rate`` log
+in at the end, which merges their cart. Rate limits are off, as every
+session comes from the same address.
+"""
+import random
+import re
+import time
+from collections import Counter
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.contrib.sessions.models import Session
+from django.core.cache import cache
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.test import Client, override_settings
+from django.urls import reverse
+
+from products.models import CartItem, Product
+
+from .seed import seed_products, seed_users
+from .utils import summarize
+
+PASSWORD = 'bench-password'
+_WRITE = re.compile(r'^\s*(INSERT INTO|UPDATE|DELETE FROM)\s+"?(\w+)"?', re.IGNORECASE)
+
+
+def add_arguments(parser):
+    parser.add_argument('--sessions', type=int, default=1000)
+    parser.add_argument('--products', type=int, default=2000)
+    parser.add_argument('--login-rate', type=float, default=0.1, help="Share of guest sessions that log in at the end.")
+    parser.add_argument('--seed', type=int, default=1)
+
+
+class WriteCounter:
+    """``execute_wrapper`` counting INSERT, UPDATE and DELETE statements per table on every connection."""
+
+    def __init__(self):
+        self.writes = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        match = _WRITE.match(sql)
+        if match:
+            self.writes[f'{match[1].split()[0].upper()} {match[2]}'] += 1
+        return execute(sql, params, many, context)
+
+    def _attach(self, sender=None, connection=None, **kwargs):
+        if self not in connection.execute_wrappers:
+            connection.execute_wrappers.insert(0, self)
+
+    def install(self):
+        connection_created.connect(self._attach, weak=False)
+        for conn in connections.all(initialized_only=True):
+            self._attach(connection=conn)
+
+    def uninstall(self):
+        connection_created.disconnect(self._attach)
+        for conn in connections.all(initialized_only=True):
+            if self in conn.execute_wrappers:
+                conn.execute_wrappers.remove(self)
+
+
+def make_sessions(options, product_ids):
+    """(products viewed, products added, logs in at the end) per session; replayed in both modes."""
+    rng = random.Random(options['seed'])
+    return [
+        (rng.sample(product_ids, 3), rng.sample(product_ids, 2), rng.random() < options['login_rate'])
+        for _ in range(options['sessions'])
+    ]
+
+
+def login(client, user):
+    client.post(reverse('login'), {'username': user.username, 'password': PASSWORD})
+
+
+def browse(client, viewed, added):
+    client.get(reverse('products'))
+    for pk in viewed:
+        client.get(reverse('product_detail', args=[pk]))
+    for pk in added:
+        client.post(reverse('add_to_cart', args=[pk]))
+    item = client.get(reverse('cart')).context['items'][0]
+    client.post(reverse('update_cart_item', args=[item.pk or item.product_id]), {'quantity': 2})
+    client.get(reverse('cart'))
+
+
+def replay(sessions, users, guest):
+    timings = []
+    for (viewed, added, logs_in), user in zip(sessions, users):
+        client = Client()
+        started = time.perf_counter()
+        if not guest:
+            login(client, user)
+        browse(client, viewed, added)
+        if guest and logs_in:
+            login(client, user)
+        timings.append(time.perf_counter() - started)
+    return timings
+
+
+def run(options, stdout):
+    users = seed_users(options['sessions'] + 1)
+    seller, users = users[0], users[1:]
+    seed_products(seller, options['products'])
+    product_ids = list(Product.objects.order_by('pk').values_list('pk', flat=True))
+    sessions = make_sessions(options, product_ids)
+    results = {}
+    per = 1000 / len(sessions)
+
+    # A fast hasher so the replay times the site rather than PBKDF2.
+    with override_settings(RATE_LIMITS={}, PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher']):
+        User.objects.filter(pk__in=[user.pk for user in users]).update(password=make_password(PASSWORD))
+        stdout.write(
+            f"{len(sessions)} browsing sessions, {sum(logs_in for *_, logs_in in sessions)} of which log in "
+            f"at the end as guests"
+        )
+        stdout.write(f"  {'mode':<14} {'writes/1k sessions':>18} {'session p50':>12} {'session p95':>12}")
+        breakdowns = {}
+        for mode, guest in (('account carts', False), ('guest carts', True)):
+            CartItem.objects.all().delete()
+            Session.objects.all().delete()
+            cache.clear()
+            counter = WriteCounter()
+            counter.install()
+            try:
+                timings = replay(sessions, users, guest)
+            finally:
+                counter.uninstall()
+            total = sum(counter.writes.values())
+            stats = summarize(timings)
+            results[mode] = {'writes': total, 'writes_per_1000': round(total * per), 'by_table': dict(counter.writes),
+                             'session': stats}
+            breakdowns[mode] = counter.writes
+            stdout.write(f"  {mode:<14} {total * per:>18.0f} {stats['p50_ms']:>10.1f}ms {stats['p95_ms']:>10.1f}ms")
+        for mode, writes in breakdowns.items():
+            stdout.write(f"  {mode} per 1k sessions: " + ', '.join(
+                f"{statement} {count * per:.0f}" for statement, count in writes.most_common()
+            ))
+    return results
@@ -0,0 +1,104 @@
+"""Latency of the audited view queries with and without the hot-path indexes."""
+from django.db import connection, models, transaction
+
+from products import query_audit
+from products.models import Product, CartItem, Order
+
+from .seed import seed_cart, seed_orders, seed_products, seed_users
+from .utils import measure
+
+# Indexes and constraints added for the storefront's access paths, removed
+# again to reproduce the original schema for the "before" measurement.
+HOT_PATH_INDEXES = [
+    (Product, 'product_name_id_idx'),
+    (Product, 'product_user_name_idx'),
+    (Order, 'order_user_created_id_idx'),
+]
+HOT_PATH_CONSTRAINTS = [
+    (CartItem, 'unique_cart_item_per_user_product'),
+]
+
+
+def add_arguments(parser):
+    parser.add_argument('--products', type=int, default=1_000_000)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--sellers', type=int, default=100)
+    parser.add_argument('--orders-per-user', type=int, default=20)
+    parser.add_argument('--repeat', type=int, default=10)
+
+
+def seed(options):
+    users = seed_users(options['users'])
+    seed_products(users[:options['sellers']], options['products'])
+    sample = list(Product.objects.order_by('pk')[:100])
+    for n, user in enumerate(users):
+        seed_cart(user, sample[n % 90:n % 90 + 3])
+        seed_orders(user, sample, options['orders_per_user'])
+    with connection.cursor() as cursor:
+        cursor.execute('ANALYZE')
+    return users
+
+
+def execute(query):
+    """Run an audited query: a queryset, or an ``(sql, params)`` pair for UPDATEs and raw SQL."""
+    if isinstance(query, tuple):
+        # Rolled back, so every run of an UPDATE sees the same rows.
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(*query)
+            transaction.set_rollback(True)
+            return cursor.fetchall() if cursor.description else cursor.rowcount
+    # .all() so every run hits the database rather than the result cache.
+    return list(query.all())
+
+
+def measure_queries(user, product, repeat):
+    results = {}
+    for name, query in query_audit.audited_querysets(user, product).items():
+        stats, _ = measure(lambda: execute(query), repeat=repeat, warmup=1)
+        plan = query_audit.explain(query)
+        results[name] = {**stats, 'full_scan': bool(query_audit.full_scans(plan)), 'plan': plan}
+    return results
+
+
+def drop_hot_path_indexes():
+    """Return the schema to plain single-column foreign key indexes."""
+    with connection.schema_editor() as editor:
+        for model, name in HOT_PATH_INDEXES:
+            editor.remove_index(model, next(i for i in model._meta.indexes if i.name == name))
+        for model, name in HOT_PATH_CONSTRAINTS:
+            editor.remove_constraint(model, next(c for c in model._meta.constraints if c.name == name))
+        for model in (Product, CartItem, Order):
+            editor.add_index(model, models.Index(fields=['user'], name=f'bench_{model._meta.model_name}_user'))
+
+
+def restore_hot_path_indexes():
+    """Undo drop_hot_path_indexes()."""
+    with connection.schema_editor() as editor:
+        for model in (Product, CartItem, Order):
+            editor.remove_index(model, models.Index(fields=['user'], name=f'bench_{model._meta.model_name}_user'))
+        for model, name in HOT_PATH_INDEXES:
+            editor.add_index(model, next(i for i in model._meta.indexes if i.name == name))
+        for model, name in HOT_PATH_CONSTRAINTS:
+            editor.add_constraint(model, next(c for c in model._meta.constraints if c.name == name))
+
+
+def run(options, stdout):
+    users = seed(options)
+    user = users[len(users) // 2]
+    product = Product.objects.order_by('name', 'pk')[options['products'] // 2]
+    # A held unit for the audited "stock update from hold" to draw on.
+    Product.objects.filter(pk=product.pk).update(reserved=1)
+
+    after = measure_queries(user, product, options['repeat'])
+    drop_hot_path_indexes()
+    try:
+        before = measure_queries(user, product, options['repeat'])
+    finally:
+        restore_hot_path_indexes()
+
+    stdout.write(f"{options['products']} products, {options['users']} users")
+    stdout.write(f"  {'query':<32} {'before p50':>12} {'after p50':>12}")
+    for name in after:
+        flag = ' (full scan before)' if before[name]['full_scan'] else ''
+        stdout.write(f"  {name:<32} {before[name]['p50_ms']:>10.3f}ms {after[name]['p50_ms']:>10.3f}ms{flag}")
+    return {'before': before, 'after': after}
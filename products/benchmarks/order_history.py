@@ -0,0 +1,51 @@
+"""Query count and latency of order history for a user with many orders."""
+from django.test import Client
+from django.urls import reverse
+
+from products.models import Product, Order
+from products.orders import ORDERS_PER_PAGE
+
+from .seed import seed_users, seed_orders, seed_products
+from .utils import measure
+
+
+def add_arguments(parser):
+    parser.add_argument('--orders', type=int, default=5000)
+    parser.add_argument('--lines', type=int, default=3)
+    parser.add_argument('--repeat', type=int, default=20)
+
+
+def legacy_order_history(user):
+    # The pre-pagination view: every order, one query per order for its items
+    # and one per item for the product name.
+    for order in Order.objects.filter(user=user).order_by('-created_at'):
+        for item in order.items.all():
+            item.product.name
+
+
+def run(options, stdout):
+    seller, buyer = seed_users(2)
+    seed_products(seller, 50)
+    products = list(Product.objects.all())
+    seed_orders(buyer, products, options['orders'], lines=options['lines'])
+
+    client = Client()
+    client.force_login(buyer)
+    url = reverse('order_history')
+    last_page = -(-options['orders'] // ORDERS_PER_PAGE)
+
+    results = {}
+    results['first_page'], results['first_page_queries'] = measure(lambda: client.get(url), repeat=options['repeat'])
+    results['last_page'], results['last_page_queries'] = measure(
+        lambda: client.get(url, {'page': last_page}), repeat=options['repeat'],
+    )
+    results['legacy'], results['legacy_queries'] = measure(lambda: legacy_order_history(buyer), repeat=3, warmup=0)
+
+    stdout.write(f"order history for a user with {options['orders']} orders x {options['lines']} lines")
+    for name in ('first_page', 'last_page', 'legacy'):
+        stats = results[name]
+        stdout.write(
+            f"  {name:<11} queries={results[name + '_queries']:<6} "
+            f"p50={stats['p50_ms']:.2f}ms p95={stats['p95_ms']:.2f}ms"
+        )
+    return results
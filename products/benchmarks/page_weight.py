@@ -0,0 +1,134 @@
+"""Bytes a browser downloads for one catalog page, full-size uploads vs responsive variants."""
+import os
+import re
+import tempfile
+import time
+from html.parser import HTMLParser
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import Client, override_settings
+from django.urls import reverse
+from PIL import Image, ImageFilter
+
+from jobs import queue
+from products import catalog, images
+from products.models import Product
+
+from .seed import seed_users
+
+
+def add_arguments(parser):
+    parser.add_argument('--width', type=int, default=3000, help="Width of the uploaded originals.")
+    parser.add_argument('--height', type=int, default=2000)
+    parser.add_argument('--viewports', type=int, nargs='+', default=[375, 768, 1280, 1920])
+    parser.add_argument('--dpr', type=float, nargs='+', default=[1, 2], help="Device pixel ratios to simulate.")
+
+
+def photo(width, height, seed):
+    # Smooth gradients plus blurred noise compress roughly like a photograph.
+    red = Image.linear_gradient('L').rotate(seed * 37 % 360).resize((width, height))
+    green = Image.radial_gradient('L').resize((width, height))
+    blue = Image.effect_noise((width, height), 60 + seed % 40)
+    image = Image.merge('RGB', (red, green, blue)).filter(ImageFilter.GaussianBlur(1))
+    out = BytesIO()
+    image.save(out, 'JPEG', quality=90)
+    return out.getvalue()
+
+
+class PictureParser(HTMLParser):
+    """Collects (webp srcset, jpeg srcset, sizes, src) for each <picture> on a page."""
+
+    def __init__(self):
+        super().__init__()
+        self.pictures = []
+        self.in_picture = False
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if tag == 'picture':
+            self.in_picture = True
+            self.pictures.append({})
+        elif tag == 'source' and self.in_picture and attrs.get('type') == 'image/webp':
+            self.pictures[-1]['webp'] = attrs['srcset']
+        elif tag == 'img' and self.in_picture:
+            self.pictures[-1].update(jpg=attrs['srcset'], sizes=attrs['sizes'], src=attrs['src'])
+
+    def handle_endtag(self, tag):
+        if tag == 'picture':
+            self.in_picture = False
+
+
+def slot_width(sizes, viewport):
+    """CSS pixel width the ``sizes`` attribute selects at ``viewport`` (min-width conditions only)."""
+    for entry in sizes.split(','):
+        match = re.fullmatch(r'\s*(?:\(min-width:\s*(\d+)px\)\s*)?(\d+(?:\.\d+)?)(px|vw)\s*', entry)
+        minimum, value, unit = match.groups()
+        if minimum is None or viewport >= int(minimum):
+            return float(value) if unit == 'px' else float(value) * viewport / 100
+    return viewport
+
+
+def choose(srcset, pixels):
+    """The candidate a browser picks: the narrowest at least ``pixels`` wide, else the widest."""
+    candidates = sorted((int(w[:-1]), url) for url, w in (c.split() for c in srcset.split(', ')))
+    return next((url for width, url in candidates if width >= pixels), candidates[-1][1])
+
+
+def file_size(url):
+    return os.path.getsize(os.path.join(settings.MEDIA_ROOT, url[len(settings.MEDIA_URL):]))
+
+
+def run(options, stdout):
+    with tempfile.TemporaryDirectory() as media_root, override_settings(MEDIA_ROOT=media_root):
+        return measure(options, stdout)
+
+
+def measure(options, stdout):
+    seller, = seed_users(1)
+    for n in range(catalog.PAGE_SIZE):
+        Product.objects.create(
+            user=seller, name=f'Product {n}', description='Benchmark product.', price=10, stock=10,
+            image=SimpleUploadedFile(f'{n}.jpg', photo(options['width'], options['height'], n)),
+        )
+    started = time.perf_counter()
+    jobs = queue.claim('bench', limit=catalog.PAGE_SIZE)
+    for job in jobs:
+        queue.run(job)
+    variants_ms = (time.perf_counter() - started) * 1000 / len(jobs)
+
+    client = Client()
+    client.force_login(seller)
+    html = client.get(reverse('products')).content
+    parser = PictureParser()
+    parser.feed(html.decode())
+    originals = sum(product.image.size for product in Product.objects.all())
+
+    results = {
+        'html_bytes': len(html),
+        'original_image_bytes': originals,
+        'variants_ms_per_image': round(variants_ms, 1),
+        'fallback_src_bytes': sum(file_size(p['src']) for p in parser.pictures),
+        'viewports': {},
+    }
+    stdout.write(
+        f"catalog page: {len(parser.pictures)} pictures, originals {options['width']}x{options['height']}, "
+        f"{originals / 1024:.0f} KiB in total; variants took {variants_ms:.0f}ms per image"
+    )
+    stdout.write(f"  {'viewport':>8} {'dpr':>4} {'before':>10} {'webp':>10} {'jpeg':>10} {'saved':>7}")
+    for viewport in options['viewports']:
+        for dpr in options['dpr']:
+            webp = jpg = 0
+            for picture in parser.pictures:
+                pixels = slot_width(picture['sizes'], viewport) * dpr
+                webp += file_size(choose(picture['webp'], pixels))
+                jpg += file_size(choose(picture['jpg'], pixels))
+            saved = 1 - (len(html) + webp) / (len(html) + originals)
+            results['viewports'][f'{viewport}@{dpr:g}x'] = {'webp_bytes': webp, 'jpeg_bytes': jpg, 'saved': round(saved, 4)}
+            stdout.write(
+                f"  {viewport:>8} {dpr:>4g} {(len(html) + originals) / 1024:>8.0f}Ki "
+                f"{(len(html) + webp) / 1024:>8.0f}Ki {(len(html) + jpg) / 1024:>8.0f}Ki {saved:>7.1%}"
+            )
+    stdout.write("  before = HTML + full-size originals; webp/jpeg = HTML + the srcset candidate a browser picks")
+    return results
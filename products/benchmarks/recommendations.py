@@ -0,0 +1,124 @@
+"""Build time and lookup latency of the "customers also bought" lists.
+
+Baskets draw their products from a skewed distribution, as real sales do:
+a few products are in many orders and most are in few. The lookup is
+compared with computing one product's neighbours from OrderItem on the fly.
+"""
+import random
+import time
+
+from django.db import connection, transaction
+from django.db.models import Count
+
+from products import recommendations
+from products.models import Order, OrderItem, Product, ProductRecommendation
+
+from .seed import seed_products, seed_users
+from .utils import measure
+
+
+def add_arguments(parser):
+    parser.add_argument('--items', type=int, default=1_000_000, help="Order items to seed; try 10000000.")
+    parser.add_argument('--lines', type=int, default=4, help="Average lines per order.")
+    parser.add_argument('--products', type=int, default=20_000)
+    parser.add_argument('--batch-size', type=int, default=recommendations.REBUILD_BATCH_SIZE)
+    parser.add_argument('--repeat', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=1)
+
+
+def seed_baskets(buyer, product_ids, items, lines, rng, batch_size=5000):
+    """Insert orders totalling about ``items`` lines; returns the number of orders."""
+    weights = [1 / (rank + 1) for rank in range(len(product_ids))]
+    orders = 0
+    while items > 0:
+        created = Order.objects.bulk_create([Order(user=buyer, total_price=0, payment_method='cod') for _ in range(batch_size)])
+        rows = []
+        for order in created:
+            basket = set(rng.choices(product_ids, weights, k=rng.randint(1, 2 * lines - 1)))
+            rows += [
+                OrderItem(order=order, product_id=pk, product_name='', quantity=1, price_at_purchase=1) for pk in basket
+            ]
+        OrderItem.objects.bulk_create(rows)
+        orders += len(created)
+        items -= len(rows)
+    return orders
+
+
+def on_the_fly(pk):
+    # What the product page would run without precomputed lists.
+    orders = OrderItem.objects.filter(product_id=pk).values('order_id')
+    return list(
+        OrderItem.objects.filter(order_id__in=orders).exclude(product_id=pk).values('product_id')
+        .annotate(score=Count('pk')).order_by('-score', 'product_id')[:recommendations.SHOWN]
+    )
+
+
+def run(options, stdout):
+    rng = random.Random(options['seed'])
+    seller, buyer = seed_users(2)
+    seed_products(seller, options['products'])
+    product_ids = list(Product.objects.order_by('pk').values_list('pk', flat=True))
+    # Popularity independent of id order.
+    rng.shuffle(product_ids)
+
+    started = time.perf_counter()
+    orders = seed_baskets(buyer, product_ids, options['items'], options['lines'], rng)
+    items = OrderItem.objects.count()
+    stdout.write(f"seeded {items} order items in {orders} orders in {time.perf_counter() - started:.0f}s")
+
+    started = time.perf_counter()
+    changed = recommendations.rebuild(batch_size=options['batch_size'])
+    build_seconds = time.perf_counter() - started
+    rows = ProductRecommendation.objects.count()
+    stdout.write(
+        f"  full rebuild: {build_seconds:.1f}s for {changed} products, {rows} rows "
+        f"({items / build_seconds:,.0f} order items/s, batches of {options['batch_size']} products)"
+    )
+
+    started = time.perf_counter()
+    changed = recommendations.rebuild(batch_size=options['batch_size'])
+    stdout.write(f"  unchanged rebuild: {time.perf_counter() - started:.1f}s, {changed} products rewritten")
+
+    # Both ways must agree before either is worth timing.
+    expected = [row['product_id'] for row in on_the_fly(product_ids[0])]
+    assert [product.pk for product in recommendations.for_product(product_ids[0])] == expected, expected
+
+    # Incremental updates as checkout makes them, replaying seeded orders of the usual size.
+    baskets = {}
+    for order_id, product_id in OrderItem.objects.order_by('pk').values_list('order_id', 'product_id')[:options['repeat'] * 20]:
+        baskets.setdefault(order_id, []).append(product_id)
+    baskets = iter([(order_id, pks) for order_id, pks in baskets.items() if len(pks) >= options['lines']])
+
+    def record():
+        with transaction.atomic():
+            recommendations.record_order(*next(baskets))
+
+    record_stats, record_queries = measure(record, repeat=max(1, options['repeat'] // 2), warmup=1)
+
+    results = {
+        'items': items,
+        'orders': orders,
+        'build_seconds': round(build_seconds, 2),
+        'rows': rows,
+        'record_order': dict(record_stats, queries=record_queries),
+    }
+    stdout.write(f"  {'operation':<36} {'queries':>7} {'p50':>10} {'p95':>10}")
+    stdout.write(
+        f"  {'record_order (checkout)':<36} {record_queries:>7} {record_stats['p50_ms']:>8.2f}ms "
+        f"{record_stats['p95_ms']:>8.2f}ms"
+    )
+    popular, unpopular = product_ids[:20], product_ids[-20:]
+    cases = [
+        ('lookup, precomputed', popular, recommendations.for_product, options['repeat']),
+        ('lookup, on the fly', popular, on_the_fly, max(5, options['repeat'] // 10)),
+        ('lookup, precomputed', unpopular, recommendations.for_product, options['repeat']),
+        ('lookup, on the fly', unpopular, on_the_fly, options['repeat']),
+    ]
+    for label, pks, lookup, repeat in cases:
+        label = f"{label} ({'popular' if pks is popular else 'unpopular'})"
+        picks = iter(rng.choices(pks, k=repeat + 1))
+        stats, queries = measure(lambda: lookup(next(picks)), repeat=repeat, warmup=1)
+        results[label] = dict(stats, queries=queries)
+        stdout.write(f"  {label:<36} {queries:>7} {stats['p50_ms']:>8.2f}ms {stats['p95_ms']:>8.2f}ms")
+    stdout.write(f"  popular and unpopular: the 20 products in the most and fewest orders ({connection.vendor})")
+    return results
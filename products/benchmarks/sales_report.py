@@ -0,0 +1,141 @@
+"""Seller sales reports from the daily rollups versus aggregating OrderItem.
+
+Orders are spread evenly over ``--days`` days and many sellers, then the
+rollups are rebuilt with ``analytics.backfill``. Each report is timed both
+ways: the raw version joins every order item of the period to its order
+(for the day) and product (for the seller), as a report without rollups has
+to.
+"""
+import time
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from products import analytics
+from products.models import DailyProductSales, Order, OrderItem, Product
+
+from .seed import seed_products, seed_users
+from .utils import measure
+
+CENT = Decimal('0.01')
+
+
+def add_arguments(parser):
+    parser.add_argument('--items', type=int, default=1_000_000, help="Order items to seed; try 10000000.")
+    parser.add_argument('--lines', type=int, default=4)
+    parser.add_argument('--days', type=int, default=365)
+    parser.add_argument('--sellers', type=int, default=100)
+    parser.add_argument('--products', type=int, default=5000)
+    parser.add_argument('--period', type=int, default=30, help="Days covered by each report.")
+    parser.add_argument('--batch-size', type=int, default=analytics.BACKFILL_BATCH_SIZE)
+    parser.add_argument('--repeat', type=int, default=5)
+
+
+def seed_sales(buyer, products, orders, lines, days, batch_size=5000):
+    """Insert ``orders`` orders of ``lines`` items each, the same number on each of the last ``days`` days."""
+    first = None
+    for start in range(0, orders, batch_size):
+        created = Order.objects.bulk_create([
+            Order(user=buyer, total_price=0, payment_method='cod') for _ in range(start, min(start + batch_size, orders))
+        ])
+        first = first or created[0].pk
+        items = []
+        for n, order in enumerate(created, start):
+            for line in range(lines):
+                pk, price = products[(n * 7 + line * 13) % len(products)]
+                items.append(OrderItem(
+                    order=order, product_id=pk, product_name='', quantity=1 + line % 3, price_at_purchase=price,
+                ))
+        OrderItem.objects.bulk_create(items)
+    # auto_now_add ignores values passed to bulk_create, so backdate the orders a day at a time.
+    now = timezone.now()
+    for day in range(days):
+        Order.objects.filter(pk__gte=first + day * orders // days, pk__lt=first + (day + 1) * orders // days).update(
+            created_at=now - timedelta(days=days - 1 - day),
+        )
+
+
+def raw_items(seller, start, end):
+    items = OrderItem.objects.filter(order__created_at__date__range=(start, end))
+    if seller is not None:
+        items = items.filter(product__user=seller)
+    return items.order_by()
+
+
+def raw_reports(seller, start, end):
+    totals = raw_items(seller, start, end).aggregate(units=Sum('quantity'), revenue=Sum(analytics.LINE_REVENUE))
+    by_day = list(
+        raw_items(seller, start, end).annotate(day=TruncDate('order__created_at')).values('day')
+        .annotate(units=Sum('quantity'), revenue=Sum(analytics.LINE_REVENUE)).order_by('day')
+    )
+    top = list(
+        raw_items(seller, start, end).values('product_id')
+        .annotate(orders=Count('order_id', distinct=True), units=Sum('quantity'), revenue=Sum(analytics.LINE_REVENUE))
+        .order_by('-revenue', 'product_id')[:analytics.TOP_PRODUCTS]
+    )
+    return totals, by_day, top
+
+
+def rollup_reports(seller, start, end):
+    return (
+        analytics.totals(seller, start, end),
+        analytics.revenue_by_day(seller, start, end),
+        analytics.top_products(seller, start, end),
+    )
+
+
+def raw_by_seller(start, end):
+    return list(
+        raw_items(None, start, end).values('product__user_id')
+        .annotate(units=Sum('quantity'), revenue=Sum(analytics.LINE_REVENUE)).order_by('-revenue')
+    )
+
+
+def run(options, stdout):
+    accounts = seed_users(options['sellers'] + 1)
+    buyer, sellers = accounts[0], accounts[1:]
+    seed_products(sellers, options['products'])
+    products = list(Product.objects.order_by('pk').values_list('pk', 'price'))
+    orders = options['items'] // options['lines']
+
+    started = time.perf_counter()
+    seed_sales(buyer, products, orders, options['lines'], options['days'])
+    stdout.write(
+        f"seeded {orders * options['lines']} order items in {orders} orders over {options['days']} days "
+        f"in {time.perf_counter() - started:.0f}s"
+    )
+
+    started = time.perf_counter()
+    analytics.backfill(batch_size=options['batch_size'])
+    backfill_seconds = time.perf_counter() - started
+    rollup_rows = DailyProductSales.objects.count()
+    stdout.write(
+        f"  backfill: {rollup_rows} rollup rows in {backfill_seconds:.1f}s "
+        f"({orders / backfill_seconds:.0f} orders/s, batches of {options['batch_size']})"
+    )
+
+    seller = sellers[0]
+    start, end = analytics.period(options['period'])
+    # Both ways must agree before either is worth timing. SQLite sums decimals
+    # as floats, so compare to the cent.
+    raw_total = raw_items(seller, start, end).aggregate(revenue=Sum(analytics.LINE_REVENUE))['revenue'] or Decimal(0)
+    rollup_total = analytics.totals(seller, start, end)['revenue']
+    assert raw_total.quantize(CENT) == rollup_total.quantize(CENT), (raw_total, rollup_total)
+
+    results = {'items': orders * options['lines'], 'rollup_rows': rollup_rows, 'backfill_seconds': round(backfill_seconds, 2)}
+    stdout.write(f"  reports over the last {options['period']} days ({options['repeat']} runs each)")
+    stdout.write(f"  {'report':<28} {'queries':>7} {'p50':>10} {'p95':>10}")
+    cases = [
+        ('seller report, raw', lambda: raw_reports(seller, start, end)),
+        ('seller report, rollups', lambda: rollup_reports(seller, start, end)),
+        ('revenue by seller, raw', lambda: raw_by_seller(start, end)),
+        ('revenue by seller, rollups', lambda: analytics.revenue_by_seller(start, end)),
+    ]
+    for label, report in cases:
+        stats, queries = measure(report, repeat=options['repeat'], warmup=1)
+        results[label] = dict(stats, queries=queries)
+        stdout.write(f"  {label:<28} {queries:>7} {stats['p50_ms']:>8.1f}ms {stats['p95_ms']:>8.1f}ms")
+    return results
@@ -0,0 +1,119 @@
+"""Search latency over a large catalog, ranking capped candidates versus every match.
+
+Products get names and descriptions from small vocabularies, so common
+words match a large share of the catalog ("shirt" about 1 in 40, "red" 1 in
+12) while the ``w<n>`` codes in descriptions give prefix queries from a
+handful of terms ("w1234") to thousands ("w1"). The legacy query is the
+original FTS5 one, which ranked every match with bm25() before the LIMIT;
+the capped one ranks only the newest ``search.SEARCH_CANDIDATES``.
+"""
+import random
+from decimal import Decimal
+
+from django.db import connection
+
+from products import search
+from products.models import Product
+
+from .seed import seed_users
+from .utils import measure
+
+COLOURS = ['red', 'blue', 'green', 'black', 'white', 'grey', 'navy', 'olive', 'pink', 'brown', 'beige', 'teal']
+MATERIALS = ['cotton', 'wool', 'linen', 'leather', 'denim', 'silk', 'nylon', 'bamboo', 'canvas', 'suede']
+ITEMS = [
+    'shirt', 'jacket', 'scarf', 'hat', 'sock', 'boot', 'sneaker', 'belt', 'bag', 'wallet', 'glove', 'coat',
+    'dress', 'skirt', 'sweater', 'hoodie', 'vest', 'blazer', 'tie', 'cap', 'apron', 'blanket', 'pillow', 'towel',
+    'rug', 'curtain', 'lamp', 'mug', 'bottle', 'notebook', 'pouch', 'sandal', 'slipper', 'poncho', 'parka',
+    'cardigan', 'tunic', 'legging', 'jumpsuit', 'kimono',
+]
+CODES = 10_000
+
+QUERIES = [
+    ('common word', 'shirt', {}),
+    ('two common words', 'red cotton', {}),
+    ('wide prefix', 'w1', {}),
+    ('narrow prefix', 'w1234', {}),
+    ('common word, in stock', 'shirt', {'in_stock': True}),
+    ('common word, price band', 'shirt', {'min_price': Decimal('20'), 'max_price': Decimal('40')}),
+]
+
+
+def add_arguments(parser):
+    parser.add_argument('--products', type=int, default=1_000_000)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=1)
+
+
+def seed_catalog(seller, count, rng, batch_size=5000):
+    for start in range(0, count, batch_size):
+        products = []
+        for i in range(start, min(start + batch_size, count)):
+            colour, material, item = rng.choice(COLOURS), rng.choice(MATERIALS), rng.choice(ITEMS)
+            products.append(Product(
+                user=seller,
+                name=f'{colour.title()} {material} {item}',
+                description=f'A {colour} {item} made of {material}, style w{rng.randrange(CODES)}.',
+                price=Decimal(rng.randrange(5, 200)) + Decimal('0.99'),
+                stock=rng.choice([0, 0, 5, 20, 100]),
+            ))
+        Product.objects.bulk_create(products)
+
+
+def filters_for(min_price=None, max_price=None, in_stock=False):
+    # The same translation as search.search().
+    filters = {}
+    if min_price is not None:
+        filters['price__gte'] = min_price
+    if max_price is not None:
+        filters['price__lte'] = max_price
+    if in_stock:
+        filters['stock__gt'] = 0
+    return filters
+
+
+def legacy_search(tokens, filters, offset, limit):
+    table = Product._meta.db_table
+    sql = [
+        f'SELECT p.id FROM {search.FTS_TABLE} JOIN {table} p ON p.id = {search.FTS_TABLE}.rowid',
+        f'WHERE {search.FTS_TABLE} MATCH %s',
+    ]
+    params = [' '.join(f'"{token}"*' for token in tokens)]
+    conditions = [('price__gte', 'p.price >= %s'), ('price__lte', 'p.price <= %s'), ('stock__gt', 'p.stock > %s')]
+    for lookup, condition in conditions:
+        if lookup in filters:
+            sql.append(f'AND {condition}')
+            params.append(filters[lookup])
+    sql.append(f'ORDER BY bm25({search.FTS_TABLE}, %s, %s), p.id LIMIT %s OFFSET %s')
+    params += [search.NAME_WEIGHT, search.DESCRIPTION_WEIGHT, limit, offset]
+    with connection.cursor() as cursor:
+        cursor.execute(' '.join(sql), params)
+        return [row[0] for row in cursor.fetchall()]
+
+
+def run(options, stdout):
+    if not search.fts5_available():
+        stdout.write("SQLite FTS5 is not available; the search benchmark needs it.")
+        return {}
+    (seller,) = seed_users(1)
+    seed_catalog(seller, options['products'], random.Random(options['seed']))
+    search.rebuild_index()
+    with connection.cursor() as cursor:
+        cursor.execute('ANALYZE')
+
+    backend = search.FTS5Backend()
+    limit = search.PAGE_SIZE + 1
+    results = {}
+    for name, query, kwargs in QUERIES:
+        tokens, filters = search.tokenize(query), filters_for(**kwargs)
+        capped, _ = measure(lambda: backend.search(tokens, filters, 0, limit), repeat=options['repeat'])
+        legacy, _ = measure(lambda: legacy_search(tokens, filters, 0, limit), repeat=options['repeat'])
+        results[name] = {'query': query, 'filters': filters, 'capped': capped, 'legacy': legacy}
+
+    stdout.write(f"search over {options['products']} products, first page of {search.PAGE_SIZE}")
+    stdout.write(f"  {'query':<24} {'legacy p50':>11} {'capped p50':>11} {'capped p95':>11}")
+    for name, r in results.items():
+        stdout.write(
+            f"  {name:<24} {r['legacy']['p50_ms']:>9.2f}ms {r['capped']['p50_ms']:>9.2f}ms "
+            f"{r['capped']['p95_ms']:>9.2f}ms"
+        )
+    return results
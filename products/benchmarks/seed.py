@@ -0,0 +1,69 @@
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+
+from products.models import Product, CartItem, Order, OrderItem
+
+
+def seed_users(count, prefix='bench'):
+    # Unusable passwords skip the deliberately slow hasher; benchmarks use force_login.
+    users = [User(username=f'{prefix}{i}', password='!') for i in range(count)]
+    return User.objects.bulk_create(users, batch_size=1000)
+
+
+def seed_products(sellers, count, stock=1000, batch_size=5000):
+    """Insert ``count`` products spread over ``sellers`` in batches; returns the count."""
+    if isinstance(sellers, User):
+        sellers = [sellers]
+    for start in range(0, count, batch_size):
+        Product.objects.bulk_create([
+            Product(
+                user=sellers[i % len(sellers)],
+                name=f'Product {i:07d}',
+                description=f'Benchmark product number {i} with a short description.',
+                price=Decimal(5 + i % 200) + Decimal('0.99'),
+                stock=stock,
+            )
+            for i in range(start, min(start + batch_size, count))
+        ])
+    return count
+
+
+def seed_cart(user, products):
+    return CartItem.objects.bulk_create([CartItem(user=user, product=product, quantity=1) for product in products])
+
+
+def seed_orders(user, products, count, lines=3, batch_size=1000):
+    """Create ``count`` orders for ``user`` with ``lines`` items each."""
+    orders = Order.objects.bulk_create(
+        [Order(user=user, total_price=0, payment_method='cod') for _ in range(count)],
+        batch_size=batch_size,
+    )
+    items = []
+    for n, order in enumerate(orders):
+        for line in range(lines):
+            product = products[(n * lines + line) % len(products)]
+            items.append(OrderItem(
+                order=order,
+                product=product,
+                product_name=product.name,
+                quantity=1 + line,
+                price_at_purchase=product.price,
+            ))
+    OrderItem.objects.bulk_create(items, batch_size=batch_size)
+    return orders
+
+
+def seed_storefront(users=100, products=10_000, sellers=10, cart_lines=3, orders_per_user=5, stock=1_000_000):
+    """Seed a complete storefront and return ``(buyers, product_ids)``."""
+    accounts = seed_users(users + sellers)
+    buyers, seller_accounts = accounts[:users], accounts[users:]
+    seed_products(seller_accounts, products, stock=stock)
+    sample = list(Product.objects.order_by('pk')[:200])
+    for n, buyer in enumerate(buyers):
+        if cart_lines:
+            offset = n % (len(sample) - cart_lines)
+            seed_cart(buyer, sample[offset:offset + cart_lines])
+        if orders_per_user:
+            seed_orders(buyer, sample, orders_per_user)
+    return buyers, list(Product.objects.values_list('pk', flat=True))
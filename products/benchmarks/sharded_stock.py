@@ -0,0 +1,126 @@
+"""Checkouts per second on one SKU, with its stock in the Product row or sharded.
+
+Every buyer has one unit of the same product in their cart and places the
+order at once, on a fixed pool of "server" workers as in ``flash_sale``.
+``unsharded`` decrements the Product row as before; the sharded runs spread
+the stock over --shards StockShard counters. Stock covers every buyer, so
+every checkout succeeds and the runs differ only in where they contend.
+
+How much sharding helps depends on the database: PostgreSQL locks rows, so
+checkouts on different shards commit in parallel, while SQLite has one
+write lock for the whole database and serialises them whatever the row.
+"""
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import OperationalError, connection
+
+from jobs.models import Job
+from products import inventory
+from products.checkout import place_order
+from products.models import CartItem, Order, Product, StockShard
+
+from .seed import seed_users
+from .utils import summarize
+
+SHIPPING = {'address_line_1': '1 Main St', 'city': 'Springfield', 'country': 'US'}
+PAYMENT = {'payment_method': 'cod'}
+
+
+def add_arguments(parser):
+    parser.add_argument('--buyers', type=int, default=1000)
+    parser.add_argument('--workers', type=int, default=16, help="Server threads placing orders.")
+    parser.add_argument('--shards', default='1,4,16', help="Comma-separated shard counts to compare.")
+    parser.add_argument('--seed', type=int, default=1)
+
+
+class Run:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.timings = []
+        self.lock_retries = 0
+
+    def checkout(self, user):
+        # SQLite reports writer contention as "database is locked"; retry like a client would.
+        started = time.perf_counter()
+        try:
+            for attempt in range(1000):
+                try:
+                    return place_order(user, SHIPPING, PAYMENT)
+                except OperationalError:
+                    with self.lock:
+                        self.lock_retries += 1
+                    time.sleep(random.uniform(0, 0.001 * min(attempt + 1, 20)))
+            raise RuntimeError("place_order never got the database lock")
+        finally:
+            with self.lock:
+                self.timings.append(time.perf_counter() - started)
+
+
+def reset(product, users, shards):
+    Order.objects.all().delete()
+    Job.objects.all().delete()
+    CartItem.objects.all().delete()
+    inventory.shard_stock(product.pk, 0)
+    Product.objects.filter(pk=product.pk).update(stock=len(users), reserved=0)
+    if shards:
+        inventory.shard_stock(product.pk, shards)
+    CartItem.objects.bulk_create([CartItem(user=user, product=product, quantity=1) for user in users])
+
+
+def live_stock(product):
+    product.refresh_from_db()
+    in_shards = sum(StockShard.objects.filter(product=product).values_list('stock', flat=True))
+    return product.stock - product.stock_at_rebalance + in_shards
+
+
+def run(options, stdout):
+    random.seed(options['seed'])
+    seller, *users = seed_users(options['buyers'] + 1)
+    product = Product.objects.create(user=seller, name='Hot item', description='d', price=10, stock=0)
+    counts = [int(count) for count in options['shards'].split(',')]
+    modes = [('unsharded', 0)] + [(f"{count} shard{'s' * (count != 1)}", count) for count in counts]
+
+    results = {}
+    for mode, shards in modes:
+        reset(product, users, shards)
+        run_ = Run()
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['workers']) as server:
+            for order in [server.submit(run_.checkout, user) for user in random.sample(users, len(users))]:
+                order.result()
+            elapsed = time.perf_counter() - started
+            for _ in range(options['workers']):
+                server.submit(connection.close)
+
+        assert Order.objects.count() == len(users) and live_stock(product) == 0, "oversold or undersold"
+        rebalance_started = time.perf_counter()
+        inventory.rebalance([product.pk])
+        rebalance_ms = (time.perf_counter() - rebalance_started) * 1000
+        results[mode] = {
+            'shards': shards,
+            'seconds': round(elapsed, 3),
+            'checkouts_per_second': round(len(users) / elapsed, 1),
+            'lock_retries': run_.lock_retries,
+            'place_order': summarize(run_.timings),
+            'rebalance_ms': round(rebalance_ms, 2) if shards else None,
+        }
+
+    stdout.write(
+        f"sharded stock: {len(users)} buyers of one SKU, {options['workers']} server workers, "
+        f"{connection.vendor}"
+    )
+    stdout.write(
+        f"  {'mode':<11} {'checkouts/s':>12} {'retries':>8} {'order p50':>10} {'order p95':>10} {'rebalance':>10}"
+    )
+    for mode, r in results.items():
+        rebalance = f"{r['rebalance_ms']:.1f}ms" if r['rebalance_ms'] is not None else '-'
+        stdout.write(
+            f"  {mode:<11} {r['checkouts_per_second']:>12.1f} {r['lock_retries']:>8} "
+            f"{r['place_order']['p50_ms']:>8.1f}ms {r['place_order']['p95_ms']:>8.1f}ms {rebalance:>10}"
+        )
+    if connection.vendor == 'sqlite':
+        stdout.write("  SQLite serialises all writers; run against PostgreSQL to see shards commit in parallel.")
+    return results
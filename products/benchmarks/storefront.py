@@ -0,0 +1,330 @@
+"""Load-generate the storefront flows against the test client or a local server.
+
+Errors under concurrency on SQLite are mostly "table is locked": the test
+database is a shared-cache in-memory database with table-level locks, so
+write-heavy scenarios are best compared at equal concurrency.
+"""
+import http.client
+import logging
+import random
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.management.base import CommandError
+from django.core.servers.basehttp import ThreadedWSGIServer, WSGIRequestHandler
+from django.core.wsgi import get_wsgi_application
+from django.test import Client
+from django.urls import reverse
+from django.utils.crypto import get_random_string
+
+from products import catalog
+from products.models import Product
+
+from .seed import seed_storefront
+from .utils import GlobalQueryCounter, summarize
+
+SHIPPING_FORM = {
+    'full_name': 'Bench User',
+    'address_line_1': '1 Benchmark Way',
+    'city': 'Springfield',
+    'state': 'IL',
+    'postal_code': '62701',
+    'country': 'US',
+    'payment_method': 'cod',
+}
+
+
+def add_arguments(parser):
+    parser.add_argument('--target', choices=['client', 'wsgi', 'asgi'], default='client')
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--products', type=int, default=10_000)
+    parser.add_argument('--iterations', type=int, default=200, help="Scenario iterations per scenario.")
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--scenarios', nargs='+', choices=list(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument('--seed', type=int, default=1)
+
+
+class ClientSession:
+    """One logged-in user driving the in-process Django test client."""
+
+    def __init__(self, user):
+        self.client = Client(raise_request_exception=False)
+        self.client.force_login(user)
+        self.samples = []
+
+    def request(self, method, path, data=None):
+        started = time.perf_counter()
+        status = getattr(self.client, method.lower())(path, data or {}).status_code
+        self.samples.append((time.perf_counter() - started, status))
+
+
+class SlowHTTPConnection(http.client.HTTPConnection):
+    """Sends each request in two halves with a pause between, like a client on a slow link."""
+
+    def __init__(self, *args, send_delay, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.send_delay = send_delay
+
+    def send(self, data):
+        half = len(data) // 2
+        super().send(data[:half])
+        time.sleep(self.send_delay)
+        super().send(data[half:])
+
+
+class HTTPSession:
+    """One logged-in user talking HTTP to a server, reusing its session cookie.
+
+    With ``send_delay`` (seconds) every request trickles in slowly, which
+    ties up a server thread for the duration on a threaded WSGI server.
+    """
+
+    def __init__(self, user, address, send_delay=0):
+        client = Client()
+        client.force_login(user)
+        self.address = address
+        self.send_delay = send_delay
+        self.csrf_token = get_random_string(32)
+        self.cookie = '; '.join([
+            f'{settings.SESSION_COOKIE_NAME}={client.cookies[settings.SESSION_COOKIE_NAME].value}',
+            f'{settings.CSRF_COOKIE_NAME}={self.csrf_token}',
+        ])
+        self.samples = []
+
+    def request(self, method, path, data=None):
+        headers = {'Host': 'testserver', 'Cookie': self.cookie}
+        body = None
+        if method == 'POST':
+            body = urlencode(data or {})
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+            headers['X-CSRFToken'] = self.csrf_token
+        elif data:
+            path = f'{path}?{urlencode(data)}'
+
+        started = time.perf_counter()
+        if self.send_delay:
+            conn = SlowHTTPConnection(*self.address, timeout=60, send_delay=self.send_delay)
+        else:
+            conn = http.client.HTTPConnection(*self.address, timeout=60)
+        try:
+            conn.request(method, path, body, headers)
+            response = conn.getresponse()
+            response.read()
+            status = response.status
+        except (OSError, http.client.HTTPException):
+            status = None
+        finally:
+            conn.close()
+        self.samples.append((time.perf_counter() - started, status))
+
+
+def browse_catalog(session, ctx, rng):
+    cursor = rng.choice(ctx['cursors'])
+    session.request('GET', reverse('products'), {'after': cursor} if cursor else None)
+
+
+def view_product(session, ctx, rng):
+    session.request('GET', reverse('product_detail', args=[rng.choice(ctx['product_ids'])]))
+
+
+def view_cart(session, ctx, rng):
+    session.request('GET', reverse('cart'))
+
+
+def order_history(session, ctx, rng):
+    session.request('GET', reverse('order_history'))
+
+
+def add_to_cart(session, ctx, rng):
+    session.request('POST', reverse('add_to_cart', args=[rng.choice(ctx['product_ids'])]))
+
+
+def checkout(session, ctx, rng):
+    session.request('POST', reverse('add_to_cart', args=[rng.choice(ctx['product_ids'])]))
+    session.request('GET', reverse('checkout_details'))
+    session.request('POST', reverse('checkout_details'), SHIPPING_FORM)
+    session.request('GET', reverse('checkout_summary'))
+    session.request('POST', reverse('checkout_summary'))
+
+
+SCENARIOS = {
+    'browse_catalog': browse_catalog,
+    'product_detail': view_product,
+    'cart': view_cart,
+    'order_history': order_history,
+    'add_to_cart': add_to_cart,
+    'checkout': checkout,
+}
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class QuietWSGIRequestHandler(WSGIRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+class PooledWSGIServer(ThreadedWSGIServer):
+    """Serves connections on a fixed pool of threads, like a threaded WSGI worker."""
+
+    # Queued connections wait for a free thread instead of being refused.
+    request_queue_size = 1024
+
+    def __init__(self, *args, threads, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.pool = ThreadPoolExecutor(max_workers=threads)
+
+    def process_request(self, request, client_address):
+        self.pool.submit(self.process_request_thread, request, client_address)
+
+    def server_close(self):
+        super().server_close()
+        self.pool.shutdown(cancel_futures=True)
+
+
+@contextmanager
+def wsgi_server(threads=None):
+    """Serve the sync WSGI application; ``threads`` caps the worker threads (default: one per connection)."""
+    if threads:
+        server = PooledWSGIServer(('127.0.0.1', 0), QuietWSGIRequestHandler, allow_reuse_address=True, threads=threads)
+    else:
+        server = ThreadedWSGIServer(('127.0.0.1', 0), QuietWSGIRequestHandler, allow_reuse_address=True)
+    server.set_app(get_wsgi_application())
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield server.server_address[:2]
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+@contextmanager
+def asgi_server():
+    """Serve ecommerce_site.asgi (async storefront views) with uvicorn."""
+    try:
+        import uvicorn
+    except ImportError:
+        raise CommandError("The asgi target needs uvicorn (pip install uvicorn).")
+    from ecommerce_site.asgi import application
+
+    port = _free_port()
+    server = uvicorn.Server(uvicorn.Config(
+        application, host='127.0.0.1', port=port, log_level='warning', lifespan='off',
+    ))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        if not thread.is_alive():
+            raise CommandError("The ASGI server failed to start.")
+        time.sleep(0.01)
+    try:
+        yield ('127.0.0.1', port)
+    finally:
+        server.should_exit = True
+        thread.join()
+
+
+@contextmanager
+def quiet_request_logs():
+    # Failed requests are counted as errors; their tracebacks would drown the report.
+    loggers = [logging.getLogger(name) for name in ('django.request', 'django.server')]
+    for logger in loggers:
+        logger.disabled = True
+    try:
+        yield
+    finally:
+        for logger in loggers:
+            logger.disabled = False
+
+
+@contextmanager
+def target_sessions(target, users):
+    if target == 'client':
+        yield [ClientSession(user) for user in users]
+        return
+    server = wsgi_server if target == 'wsgi' else asgi_server
+    with server() as address:
+        yield [HTTPSession(user, address) for user in users]
+
+
+def run_scenario(fn, sessions, ctx, iterations, concurrency, counter, seed):
+    for session in sessions:
+        session.samples = []
+    per_worker = [iterations // concurrency + (1 if i < iterations % concurrency else 0) for i in range(concurrency)]
+
+    def worker(index):
+        rng = random.Random(seed + index)
+        session = sessions[index % len(sessions)]
+        for _ in range(per_worker[index]):
+            fn(session, ctx, rng)
+
+    queries_before = counter.count
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(worker, range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    samples = [sample for session in sessions for sample in session.samples]
+    requests = len(samples)
+    return {
+        'requests': requests,
+        'errors': sum(1 for _, status in samples if status is None or status >= 400),
+        'elapsed_s': round(elapsed, 3),
+        'requests_per_s': round(requests / elapsed, 1) if elapsed else 0.0,
+        'queries_per_request': round((counter.count - queries_before) / requests, 2) if requests else 0.0,
+        **summarize([latency for latency, _ in samples]),
+    }
+
+
+def build_context(product_ids, seed):
+    rng = random.Random(seed)
+    cursor_products = Product.objects.filter(pk__in=rng.sample(product_ids, min(50, len(product_ids))))
+    return {
+        'product_ids': product_ids,
+        'cursors': [None] + [catalog.encode_cursor(product) for product in cursor_products],
+    }
+
+
+def report(title, scenarios, stdout):
+    stdout.write(title)
+    stdout.write(f"  {'scenario':<16} {'req':>6} {'err':>5} {'req/s':>8} {'p50':>9} {'p95':>9} {'p99':>9} {'q/req':>6}")
+    for name, r in scenarios.items():
+        stdout.write(
+            f"  {name:<16} {r['requests']:>6} {r['errors']:>5} {r['requests_per_s']:>8.1f} "
+            f"{r['p50_ms']:>7.2f}ms {r['p95_ms']:>7.2f}ms {r['p99_ms']:>7.2f}ms {r['queries_per_request']:>6.2f}"
+        )
+
+
+def run(options, stdout):
+    users, product_ids = seed_storefront(users=options['users'], products=options['products'])
+    ctx = build_context(product_ids, options['seed'])
+
+    counter = GlobalQueryCounter()
+    counter.install()
+    results = {'target': options['target'], 'concurrency': options['concurrency'], 'scenarios': {}}
+    try:
+        # One session per worker so concurrent workers never share a cart.
+        with quiet_request_logs(), target_sessions(options['target'], users[:options['concurrency']]) as sessions:
+            for name in options['scenarios']:
+                results['scenarios'][name] = run_scenario(
+                    SCENARIOS[name], sessions, ctx, options['iterations'], options['concurrency'],
+                    counter, options['seed'],
+                )
+    finally:
+        counter.uninstall()
+
+    report(
+        f"target={options['target']} concurrency={options['concurrency']} products={options['products']}",
+        results['scenarios'], stdout,
+    )
+    return results
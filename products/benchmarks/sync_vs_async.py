@@ -0,0 +1,59 @@
+"""Sync views on a pooled WSGI server vs async views on ASGI, with slow clients."""
+from .seed import seed_storefront
+from .storefront import HTTPSession, SCENARIOS, asgi_server, build_context, report, run_scenario, wsgi_server
+from .utils import GlobalQueryCounter
+
+READ_SCENARIOS = ['browse_catalog', 'product_detail', 'cart', 'order_history']
+
+
+def add_arguments(parser):
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--products', type=int, default=10_000)
+    parser.add_argument('--iterations', type=int, default=400, help="Requests per scenario.")
+    parser.add_argument('--concurrency', type=int, default=64)
+    parser.add_argument('--wsgi-threads', type=int, default=8, help="Worker threads of the WSGI server.")
+    parser.add_argument('--client-delay-ms', type=float, default=50, help="Pause in the middle of sending each request.")
+    parser.add_argument('--scenarios', nargs='+', choices=READ_SCENARIOS, default=READ_SCENARIOS)
+    parser.add_argument('--seed', type=int, default=1)
+
+
+def run(options, stdout):
+    users, product_ids = seed_storefront(
+        users=max(options['users'], options['concurrency']), products=options['products'],
+    )
+    ctx = build_context(product_ids, options['seed'])
+    servers = {
+        'wsgi': lambda: wsgi_server(threads=options['wsgi_threads']),
+        'asgi': asgi_server,
+    }
+
+    counter = GlobalQueryCounter()
+    counter.install()
+    results = {}
+    try:
+        for target, server in servers.items():
+            with server() as address:
+                sessions = [
+                    HTTPSession(user, address, send_delay=options['client_delay_ms'] / 1000)
+                    for user in users[:options['concurrency']]
+                ]
+                results[target] = {
+                    name: run_scenario(
+                        SCENARIOS[name], sessions, ctx, options['iterations'], options['concurrency'],
+                        counter, options['seed'],
+                    )
+                    for name in options['scenarios']
+                }
+    finally:
+        counter.uninstall()
+
+    for target, scenarios in results.items():
+        report(
+            f"{target}: concurrency={options['concurrency']} wsgi_threads={options['wsgi_threads']} "
+            f"client_delay={options['client_delay_ms']}ms",
+            scenarios, stdout,
+        )
+    for name in options['scenarios']:
+        speedup = results['asgi'][name]['requests_per_s'] / (results['wsgi'][name]['requests_per_s'] or 1)
+        stdout.write(f"  {name}: asgi/wsgi throughput x{speedup:.2f}")
+    return results
@@ -0,0 +1,74 @@
+"""Render time of the catalog page by page size, template loader and card fragment caching.
+
+Only rendering is timed: the page of products is fetched once beforehand,
+so the numbers are what the template engine adds on top of the queries.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.template.loader import render_to_string
+from django.test import RequestFactory, override_settings
+from django.urls import reverse
+
+from products import catalog, images
+from products.models import Product
+
+from .seed import seed_products, seed_users
+from .utils import measure
+
+UNCACHED_LOADERS = [
+    'django.template.loaders.filesystem.Loader',
+    'django.template.loaders.app_directories.Loader',
+]
+
+
+def add_arguments(parser):
+    parser.add_argument('--page-sizes', type=int, nargs='+', default=[6, 60, 600])
+    parser.add_argument('--repeat', type=int, default=20)
+
+
+def configurations():
+    """(label, settings overrides, fragments cached?) for each way of rendering."""
+    templates = [dict(settings.TEMPLATES[0], OPTIONS=dict(settings.TEMPLATES[0]['OPTIONS'], loaders=UNCACHED_LOADERS))]
+    # {% cache %} prefers a 'template_fragments' alias; a dummy one turns fragment caching off.
+    no_fragments = dict(settings.CACHES, template_fragments={'BACKEND': 'django.core.cache.backends.dummy.DummyCache'})
+    return [
+        ('uncached loader, no fragments', {'TEMPLATES': templates, 'CACHES': no_fragments}, False),
+        ('cached loader, no fragments', {'CACHES': no_fragments}, False),
+        ('cached loader, fragments cold', {}, False),
+        ('cached loader, fragments warm', {}, True),
+    ]
+
+
+def run(options, stdout):
+    seller, = seed_users(1)
+    largest = max(options['page_sizes'])
+    seed_products(seller, largest)
+    # Uploaded pictures with variants, so each card renders a full <picture> element.
+    Product.objects.update(
+        image=f'products/ab/{"ab" * 32}.jpg',
+        image_variants={'width': 1600, 'height': 1200, 'widths': list(images.VARIANT_WIDTHS)},
+    )
+
+    request = RequestFactory().get(reverse('products'))
+    request.user = seller
+
+    results = {}
+    stdout.write(f"catalog page render time, {options['repeat']} renders each")
+    stdout.write(f"  {'configuration':<32} {'per page':>8} {'p50':>9} {'p95':>9} {'KiB':>6}")
+    for page_size in options['page_sizes']:
+        context = {'products': catalog.get_page(page_size=page_size), 'product_count': largest}
+        for label, overrides, warm in configurations():
+            with override_settings(**overrides):
+                def render():
+                    if not warm:
+                        cache.clear()
+                    return render_to_string('products.html', context, request)
+
+                html = render()
+                stats, _ = measure(render, repeat=options['repeat'])
+            results[f'{label} @ {page_size}'] = dict(stats, bytes=len(html))
+            stdout.write(
+                f"  {label:<32} {page_size:>8} {stats['p50_ms']:>7.2f}ms {stats['p95_ms']:>7.2f}ms "
+                f"{len(html) / 1024:>6.0f}"
+            )
+    return results
@@ -0,0 +1,113 @@
+import statistics
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.db import connection, connections
+from django.db.backends.signals import connection_created
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+
+@contextmanager
+def benchmark_database(verbosity=0):
+    """Create a fresh test database for the duration of a benchmark run."""
+    setup_test_environment()
+    old_name = connection.settings_dict['NAME']
+    test_name = connection.creation.create_test_db(verbosity=verbosity, autoclobber=True, serialize=False)
+    # Point the replicas at the test database too, as the test runner does.
+    replica_names = {alias: connections[alias].settings_dict['NAME'] for alias in settings.DATABASE_REPLICAS}
+    for alias in replica_names:
+        connections[alias].close()
+        connections[alias].creation.set_as_test_mirror(connection.settings_dict)
+    try:
+        yield test_name
+    finally:
+        for alias, name in replica_names.items():
+            connections[alias].close()
+            connections[alias].settings_dict['NAME'] = name
+        connection.creation.destroy_test_db(old_name, verbosity=verbosity)
+        teardown_test_environment()
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summarize(samples):
+    """Latency summary in milliseconds for a list of durations in seconds."""
+    ms = [s * 1000 for s in samples]
+    return {
+        'runs': len(ms),
+        'mean_ms': round(statistics.fmean(ms), 3) if ms else 0.0,
+        'p50_ms': round(percentile(ms, 50), 3),
+        'p95_ms': round(percentile(ms, 95), 3),
+        'p99_ms': round(percentile(ms, 99), 3),
+    }
+
+
+class QueryCounter:
+    """``connection.execute_wrapper`` hook counting queries without logging them."""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def measure(fn, repeat=20, warmup=2):
+    """Run ``fn`` repeatedly; return (latency summary, queries of the last run on any database)."""
+    for _ in range(warmup):
+        fn()
+    samples = []
+    queries = 0
+    for _ in range(repeat):
+        counter = QueryCounter()
+        with ExitStack() as stack:
+            for conn in connections.all():
+                stack.enter_context(conn.execute_wrapper(counter))
+            started = time.perf_counter()
+            fn()
+            samples.append(time.perf_counter() - started)
+        queries = counter.count
+    return summarize(samples), queries
+
+
+class GlobalQueryCounter:
+    """Counts queries on every connection in every thread, including ones opened later.
+
+    Used for server benchmarks where requests run on threads the benchmark
+    does not control. Read ``count`` before and after a phase to get deltas.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        with self._lock:
+            self.count += 1
+        return execute(sql, params, many, context)
+
+    def _attach(self, sender=None, connection=None, **kwargs):
+        # Connections can be opened inside an ``execute_wrapper()`` block, which
+        # pops the last wrapper on exit; go first so that pop is not ours.
+        if self not in connection.execute_wrappers:
+            connection.execute_wrappers.insert(0, self)
+
+    def install(self):
+        connection_created.connect(self._attach, weak=False)
+        for conn in connections.all(initialized_only=True):
+            self._attach(connection=conn)
+
+    def uninstall(self):
+        connection_created.disconnect(self._attach)
+        for conn in connections.all(initialized_only=True):
+            if self in conn.execute_wrappers:
+                conn.execute_wrappers.remove(self)
@@ -0,0 +1,157 @@
+"""Streaming CSV / JSON-lines import and export of a seller's products."""
+import csv
+import json
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from . import carts, search
+from .catalog import bump_catalog_version
+from .models import Product
+
+FORMATS = ('csv', 'jsonl')
+FIELDS = ['sku', 'name', 'description', 'price', 'stock', 'image_url']
+REQUIRED_FIELDS = {'sku', 'name', 'description', 'price', 'stock'}
+CHUNK_SIZE = 1000
+EXPORT_CHUNK_SIZE = 2000
+# Rows with errors are all counted but only the first ones are kept for the report.
+MAX_REPORTED_ERRORS = 1000
+
+
+class ImportResult:
+    def __init__(self):
+        self.imported = 0
+        self.failed = 0
+        self.errors = []
+        # Line at which the file stopped being readable, e.g. not UTF-8; rows before it were imported.
+        self.unreadable_from = None
+
+    def add_error(self, line, message):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append((line, message))
+
+
+def read_rows(stream, fmt):
+    """Yield ``(line_number, row)`` from a text stream; ``row`` is None when unparseable."""
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row
+        return
+    for line_number, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            row = None
+        yield line_number, row if isinstance(row, dict) else None
+
+
+def clean_row(row):
+    """Validate one row with the model's own field rules; return (values, errors)."""
+    values, errors = {}, {}
+    for name in FIELDS:
+        raw = row.get(name)
+        if raw in (None, ''):
+            if name in REQUIRED_FIELDS:
+                errors[name] = "This field is required."
+            continue
+        try:
+            values[name] = Product._meta.get_field(name).clean(str(raw).strip(), None)
+        except ValidationError as e:
+            errors[name] = ' '.join(e.messages)
+    if values.get('stock', 0) < 0:
+        errors['stock'] = "Ensure this value is greater than or equal to 0."
+    return values, errors
+
+
+def _upsert(seller, chunk):
+    # A repeated SKU within one statement is an error on PostgreSQL; last row wins.
+    by_sku = {values['sku']: values for values in chunk}
+    update_fields = ['name', 'description', 'price', 'stock']
+    if any('image_url' in values for values in by_sku.values()):
+        update_fields.append('image_url')
+    with transaction.atomic():
+        Product.objects.bulk_create(
+            [Product(user=seller, **values) for values in by_sku.values()],
+            update_conflicts=True,
+            unique_fields=['user', 'sku'],
+            update_fields=update_fields,
+        )
+        # bulk_create skips save() and post_save, so invalidate cached cards and
+        # keep the search index in step here.
+        imported = Product.objects.filter(user=seller, sku__in=list(by_sku))
+        imported.update(version=F('version') + 1, updated_at=timezone.now())
+        search.index_products(list(imported))
+    return len(by_sku)
+
+
+def import_products(seller, rows, chunk_size=CHUNK_SIZE):
+    """Upsert ``seller``'s products by SKU from ``(line_number, row)`` pairs.
+
+    Rows are validated and written in chunks of ``chunk_size``, each in its
+    own transaction, so memory use is flat and a bad row only costs itself.
+    If the file cannot be read to the end (not UTF-8, malformed CSV) the rows
+    read so far are still imported and the result says where reading stopped.
+    """
+    result = ImportResult()
+    chunk = []
+    line_number = 0
+    try:
+        for line_number, row in rows:
+            if row is None:
+                result.add_error(line_number, "Could not parse row.")
+                continue
+            values, errors = clean_row(row)
+            if errors:
+                result.add_error(line_number, '; '.join(f"{name}: {message}" for name, message in errors.items()))
+                continue
+            chunk.append(values)
+            if len(chunk) >= chunk_size:
+                result.imported += _upsert(seller, chunk)
+                chunk = []
+    except (UnicodeDecodeError, csv.Error) as e:
+        result.unreadable_from = line_number + 1
+        reason = "not UTF-8 text" if isinstance(e, UnicodeDecodeError) else str(e)
+        result.add_error(result.unreadable_from, f"Could not read the file from here on: {reason}.")
+    if chunk:
+        result.imported += _upsert(seller, chunk)
+    if result.imported:
+        bump_catalog_version()
+        carts.bump_prices_version()
+    return result
+
+
+def export_rows(seller=None, chunk_size=EXPORT_CHUNK_SIZE):
+    """Stream product rows as tuples in FIELDS order without loading them all."""
+    queryset = Product.objects.all() if seller is None else Product.objects.filter(user=seller)
+    return queryset.order_by('name', 'id').values_list(*FIELDS).iterator(chunk_size=chunk_size)
+
+
+class _Echo:
+    """File-like object whose write() returns the value, for streaming csv.writer output."""
+
+    def write(self, value):
+        return value
+
+
+def csv_lines(rows):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(FIELDS)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def jsonl_lines(rows):
+    for row in rows:
+        values = dict(zip(FIELDS, row))
+        values['price'] = str(values['price'])
+        yield json.dumps(values) + '\n'
+
+
+def export_lines(rows, fmt):
+    return csv_lines(rows) if fmt == 'csv' else jsonl_lines(rows)
@@ -0,0 +1,209 @@
+import pickle
+import socket
+import threading
+from urllib.parse import urlparse
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+from django.core.cache.backends.locmem import LocMemCache as BaseLocMemCache
+
+
+class RespError(Exception):
+    pass
+
+
+class RespConnection:
+    """Minimal client for the Redis serialization protocol (RESP2)."""
+
+    def __init__(self, host, port, db=0, timeout=5):
+        self.sock = socket.create_connection((host, port), timeout=timeout)
+        self.reader = self.sock.makefile('rb')
+        if db:
+            self.execute('SELECT', db)
+
+    def close(self):
+        self.reader.close()
+        self.sock.close()
+
+    @staticmethod
+    def _encode(args):
+        out = [b'*%d\r\n' % len(args)]
+        for arg in args:
+            if not isinstance(arg, bytes):
+                arg = str(arg).encode()
+            out.append(b'$%d\r\n%s\r\n' % (len(arg), arg))
+        return b''.join(out)
+
+    def _read(self):
+        line = self.reader.readline()
+        if not line:
+            raise ConnectionError("Connection closed by server")
+        kind, body = line[:1], line[1:-2]
+        if kind == b'+':
+            return body.decode()
+        if kind == b'-':
+            raise RespError(body.decode())
+        if kind == b':':
+            return int(body)
+        if kind == b'$':
+            length = int(body)
+            if length == -1:
+                return None
+            data = self.reader.read(length + 2)
+            return data[:-2]
+        if kind == b'*':
+            length = int(body)
+            return None if length == -1 else [self._read() for _ in range(length)]
+        raise RespError(f"Unexpected reply: {line!r}")
+
+    def execute(self, *args):
+        self.sock.sendall(self._encode(args))
+        return self._read()
+
+
+class RespCache(BaseCache):
+    """Cache backend speaking the Redis protocol without third-party clients.
+
+    LOCATION is ``redis://host:port/db``. Each thread keeps one connection.
+    Integers are stored as plain numbers so INCRBY works; everything else is
+    pickled.
+    """
+
+    def __init__(self, server, params):
+        super().__init__(params)
+        url = urlparse(server if '://' in server else f'redis://{server}')
+        self._host = url.hostname or '127.0.0.1'
+        self._port = url.port or 6379
+        self._db = int(url.path.lstrip('/') or 0)
+        options = params.get('OPTIONS', {})
+        self._socket_timeout = options.get('SOCKET_TIMEOUT', 5)
+        self._close_connection = options.get('CLOSE_CONNECTION', False)
+        self._local = threading.local()
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = RespConnection(self._host, self._port, self._db, self._socket_timeout)
+        return conn
+
+    def _execute(self, *args):
+        try:
+            return self._connection().execute(*args)
+        except (ConnectionError, OSError):
+            # Reconnect once on a dropped connection.
+            self._disconnect()
+            return self._connection().execute(*args)
+
+    @staticmethod
+    def _dumps(value):
+        if type(value) is int:
+            return str(value).encode()
+        return pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def _loads(data):
+        try:
+            return int(data)
+        except ValueError:
+            return pickle.loads(data)
+
+    def get_backend_timeout(self, timeout=DEFAULT_TIMEOUT):
+        # Relative seconds (None = no expiry) rather than BaseCache's absolute time.
+        if timeout == DEFAULT_TIMEOUT:
+            timeout = self.default_timeout
+        return None if timeout is None else max(0, timeout)
+
+    @staticmethod
+    def _expiry_args(timeout):
+        return [] if timeout is None else ['PX', max(int(timeout * 1000), 1)]
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        timeout = self.get_backend_timeout(timeout)
+        if timeout == 0:
+            return False
+        return self._execute('SET', key, self._dumps(value), 'NX', *self._expiry_args(timeout)) == 'OK'
+
+    def get(self, key, default=None, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        data = self._execute('GET', key)
+        return default if data is None else self._loads(data)
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        timeout = self.get_backend_timeout(timeout)
+        if timeout == 0:
+            self._execute('DEL', key)
+            return
+        self._execute('SET', key, self._dumps(value), *self._expiry_args(timeout))
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        timeout = self.get_backend_timeout(timeout)
+        if timeout is None:
+            return bool(self._execute('PERSIST', key)) or bool(self._execute('EXISTS', key))
+        return bool(self._execute('PEXPIRE', key, *self._expiry_args(timeout)[1:]))
+
+    def delete(self, key, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        return bool(self._execute('DEL', key))
+
+    def has_key(self, key, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        return bool(self._execute('EXISTS', key))
+
+    def incr(self, key, delta=1, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        if not self._execute('EXISTS', key):
+            raise ValueError("Key '%s' not found." % key)
+        return self._execute('INCRBY', key, delta)
+
+    def get_many(self, keys, version=None):
+        if not keys:
+            return {}
+        mapped = {self.make_and_validate_key(key, version=version): key for key in keys}
+        values = self._execute('MGET', *mapped)
+        return {mapped[k]: self._loads(v) for k, v in zip(mapped, values) if v is not None}
+
+    def clear(self):
+        self._execute('FLUSHDB')
+
+    def _disconnect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def close(self, **kwargs):
+        # Django calls close() after every request; keep the connection open
+        # unless OPTIONS['CLOSE_CONNECTION'] asks otherwise.
+        if self._close_connection:
+            self._disconnect()
+
+
+class LocMemCache(BaseLocMemCache):
+    """LocMemCache whose async methods run inline instead of in a worker thread.
+
+    Operations are an in-process dict lookup under a lock and never block on
+    I/O, so the thread hop BaseCache's async methods make is pure overhead.
+    """
+
+    async def aget(self, key, default=None, version=None):
+        return self.get(key, default, version)
+
+    async def aset(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self.set(key, value, timeout, version)
+
+    async def aadd(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        return self.add(key, value, timeout, version)
+
+    async def adelete(self, key, version=None):
+        return self.delete(key, version)
+
+    async def ahas_key(self, key, version=None):
+        return self.has_key(key, version)
+
+    async def aincr(self, key, delta=1, version=None):
+        return self.incr(key, delta, version)
+
+    async def aget_many(self, keys, version=None):
+        return self.get_many(keys, version)
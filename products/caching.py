@@ -0,0 +1,146 @@
+import asyncio
+import threading
+import time
+from collections import defaultdict
+
+from django.core.cache import cache
+
+# How long one caller may hold the recompute lock for a key.
+LOCK_TIMEOUT = 10
+# How long callers without the lock wait for a missing value before computing it themselves.
+LOCK_WAIT = 2.0
+LOCK_POLL_INTERVAL = 0.01
+# Extra lifetime of an entry past its freshness so stale values can be served during a refresh.
+STALE_GRACE = 60
+
+_stats_lock = threading.Lock()
+_stats = defaultdict(lambda: {'hits': 0, 'stale_hits': 0, 'misses': 0})
+
+
+def _record(namespace, outcome):
+    with _stats_lock:
+        _stats[namespace][outcome] += 1
+
+
+def stats():
+    """Hit/miss counters per namespace for this process."""
+    with _stats_lock:
+        return {namespace: dict(counters) for namespace, counters in _stats.items()}
+
+
+def reset_stats():
+    with _stats_lock:
+        _stats.clear()
+
+
+def namespace_version(namespace):
+    key = f'ns:{namespace}'
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, 1, None)
+        version = cache.get(key, 1)
+    return version
+
+
+async def anamespace_version(namespace):
+    key = f'ns:{namespace}'
+    version = await cache.aget(key)
+    if version is None:
+        await cache.aadd(key, 1, None)
+        version = await cache.aget(key, 1)
+    return version
+
+
+def bump_namespace(namespace):
+    """Invalidate every key built with make_key(namespace, ...) at once."""
+    key = f'ns:{namespace}'
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, 2, None)
+
+
+def make_key(namespace, *parts):
+    return ':'.join([namespace, str(namespace_version(namespace)), *map(str, parts)])
+
+
+async def amake_key(namespace, *parts):
+    return ':'.join([namespace, str(await anamespace_version(namespace)), *map(str, parts)])
+
+
+def get_or_set(namespace, key, producer, timeout):
+    """Return the cached value for ``key`` or compute it with ``producer``.
+
+    Guards against stampedes: only the caller holding the per-key lock runs
+    ``producer``. While a value is being refreshed other callers are served
+    the stale copy; on a cold miss they wait up to LOCK_WAIT for it.
+    """
+    lock_key = f'lock:{key}'
+    entry = cache.get(key)
+    if entry is not None:
+        value, fresh_until = entry
+        if time.time() < fresh_until:
+            _record(namespace, 'hits')
+            return value
+        if not cache.add(lock_key, 1, LOCK_TIMEOUT):
+            _record(namespace, 'stale_hits')
+            return value
+        have_lock = True
+    else:
+        have_lock = cache.add(lock_key, 1, LOCK_TIMEOUT)
+        deadline = time.monotonic() + LOCK_WAIT
+        while not have_lock and time.monotonic() < deadline:
+            time.sleep(LOCK_POLL_INTERVAL)
+            entry = cache.get(key)
+            if entry is not None:
+                _record(namespace, 'hits')
+                return entry[0]
+            # The holder may have failed without storing a value; take over.
+            have_lock = cache.add(lock_key, 1, LOCK_TIMEOUT)
+
+    _record(namespace, 'misses')
+    try:
+        value = producer()
+        cache.set(key, (value, time.time() + timeout), timeout + STALE_GRACE)
+    finally:
+        if have_lock:
+            cache.delete(lock_key)
+    return value
+
+
+async def aget_or_set(namespace, key, producer, timeout):
+    """Async counterpart of get_or_set; ``producer`` is a coroutine function.
+
+    Uses the cache's async API and waits with asyncio.sleep, so a caller
+    waiting on another's refresh never blocks the event loop.
+    """
+    lock_key = f'lock:{key}'
+    entry = await cache.aget(key)
+    if entry is not None:
+        value, fresh_until = entry
+        if time.time() < fresh_until:
+            _record(namespace, 'hits')
+            return value
+        if not await cache.aadd(lock_key, 1, LOCK_TIMEOUT):
+            _record(namespace, 'stale_hits')
+            return value
+        have_lock = True
+    else:
+        have_lock = await cache.aadd(lock_key, 1, LOCK_TIMEOUT)
+        deadline = time.monotonic() + LOCK_WAIT
+        while not have_lock and time.monotonic() < deadline:
+            await asyncio.sleep(LOCK_POLL_INTERVAL)
+            entry = await cache.aget(key)
+            if entry is not None:
+                _record(namespace, 'hits')
+                return entry[0]
+            have_lock = await cache.aadd(lock_key, 1, LOCK_TIMEOUT)
+
+    _record(namespace, 'misses')
+    try:
+        value = await producer()
+        await cache.aset(key, (value, time.time() + timeout), timeout + STALE_GRACE)
+    finally:
+        if have_lock:
+            await cache.adelete(lock_key)
+    return value
@@ -0,0 +1,338 @@
+from decimal import Decimal
+
+from django.core import signing
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import DecimalField, ExpressionWrapper, F, Sum, Window
+
+from . import caching, routers
+from .models import CartItem, Product
+
+SUMMARY_TIMEOUT = 3600
+# Bumped when prices change or products are deleted; see bump_prices_version.
+PRICES_NAMESPACE = 'cart_prices'
+
+GUEST_COOKIE = 'guest_cart'
+GUEST_COOKIE_SALT = 'products.carts.guest'
+GUEST_MAX_AGE = 30 * 24 * 3600
+# Keeps the cookie well under the 4KB browsers accept.
+GUEST_MAX_LINES = 100
+
+LINE_TOTAL = ExpressionWrapper(F('quantity') * F('product__price'), output_field=DecimalField(max_digits=12, decimal_places=2))
+
+
+class OutOfStockError(Exception):
+    def __init__(self, product, in_cart, requested):
+        self.product = product
+        self.in_cart = in_cart
+        self.requested = requested
+        super().__init__(f"Not enough stock for {product.name}. Only {product.stock} available.")
+
+
+class CartFullError(Exception):
+    pass
+
+
+class CartUpdateError(Exception):
+    """Lines asked for more than is in stock; ``failed_lines`` holds ``(item, requested, available)``."""
+
+    def __init__(self, failed_lines):
+        self.failed_lines = failed_lines
+        super().__init__("Not enough stock for " + ", ".join(item.product.name for item, _, _ in failed_lines) + ".")
+
+
+def lines(user):
+    """Cart lines with ``line_total`` and the cart-wide ``cart_total`` computed in one query."""
+    return (
+        CartItem.objects.filter(user=user)
+        .select_related('product')
+        .annotate(line_total=LINE_TOTAL, cart_total=Window(Sum(LINE_TOTAL)))
+        .order_by('id')
+    )
+
+
+async def alines(user):
+    return [item async for item in lines(user)]
+
+
+def grand_total(cart_lines):
+    return cart_lines[0].cart_total if cart_lines else Decimal('0.00')
+
+
+def _summary_key(user_id, prices_version):
+    # Per user, so orders and stock changes elsewhere leave it alone; the
+    # prices version picks up price changes without a fan-out.
+    return f'cart:summary:{prices_version}:{user_id}'
+
+
+def bump_prices_version():
+    """Invalidate every cached cart summary, after prices changed or products were deleted."""
+    caching.bump_namespace(PRICES_NAMESPACE)
+
+
+def summary_queryset(user_id):
+    """The navbar totals as one grouped row; no row for an empty cart."""
+    return (
+        CartItem.objects.filter(user_id=user_id).order_by()
+        .values('user_id').annotate(count=Sum('quantity'), total=Sum(LINE_TOTAL)).values('count', 'total')
+    )
+
+
+def _summary(rows):
+    totals = rows[0] if rows else {}
+    return {'count': totals.get('count') or 0, 'total': totals.get('total') or Decimal('0.00')}
+
+
+def get_summary(user_id):
+    """Item count and total for the navbar, served from cache when possible."""
+    key = _summary_key(user_id, caching.namespace_version(PRICES_NAMESPACE))
+    summary = cache.get(key)
+    if summary is None:
+        summary = _summary(list(summary_queryset(user_id)))
+        cache.set(key, summary, SUMMARY_TIMEOUT)
+    return summary
+
+
+async def aget_summary(user_id):
+    key = _summary_key(user_id, await caching.anamespace_version(PRICES_NAMESPACE))
+    summary = await cache.aget(key)
+    if summary is None:
+        summary = _summary([row async for row in summary_queryset(user_id)])
+        await cache.aset(key, summary, SUMMARY_TIMEOUT)
+    return summary
+
+
+def invalidate_summary(user_id):
+    cache.delete(_summary_key(user_id, caching.namespace_version(PRICES_NAMESPACE)))
+
+
+def _changed(user_id):
+    invalidate_summary(user_id)
+    # The next page shows the cart; a lagging replica would show the old one.
+    routers.pin_to_primary()
+
+
+def add_item(user, product, quantity=1):
+    """Add ``quantity`` of ``product`` to the cart, merging with an existing line."""
+    if quantity > product.stock:
+        raise OutOfStockError(product, 0, quantity)
+    with transaction.atomic():
+        item, created = CartItem.objects.get_or_create(user=user, product=product, defaults={'quantity': quantity})
+        if not created:
+            if item.quantity + quantity > product.stock:
+                raise OutOfStockError(product, item.quantity, quantity)
+            item.quantity = F('quantity') + quantity
+            item.save(update_fields=['quantity'])
+            item.refresh_from_db(fields=['quantity'])
+    _changed(user.pk)
+    return item
+
+
+def set_quantity(item, quantity):
+    """Set a line's quantity; zero or less removes the line."""
+    if quantity <= 0:
+        remove_item(item)
+        return None
+    if item.product.stock < quantity:
+        raise OutOfStockError(item.product, item.quantity, quantity)
+    item.quantity = quantity
+    item.save(update_fields=['quantity'])
+    _changed(item.user_id)
+    return item
+
+
+def remove_item(item):
+    item.delete()
+    _changed(item.user_id)
+
+
+def _short_lines(items, quantities):
+    return [
+        (item, quantities[key], item.product.stock)
+        for key, item in items if quantities[key] > item.product.stock
+    ]
+
+
+def update_quantities(user, quantities):
+    """Set many lines' quantities at once; zero or less removes a line.
+
+    ``quantities`` maps CartItem ids to quantities; ids no longer in the
+    user's cart are skipped. The lines and their stock are read in one
+    query, and if any line is short nothing changes and CartUpdateError is
+    raised. Otherwise one bulk_update and one DELETE apply the rest.
+    """
+    with transaction.atomic():
+        items = list(CartItem.objects.filter(user=user, pk__in=quantities).select_related('product'))
+        failed = _short_lines([(item.pk, item) for item in items], quantities)
+        if failed:
+            raise CartUpdateError(failed)
+        removed = [item.pk for item in items if quantities[item.pk] <= 0]
+        changed = [item for item in items if 0 < quantities[item.pk] != item.quantity]
+        for item in changed:
+            item.quantity = quantities[item.pk]
+        if removed:
+            CartItem.objects.filter(pk__in=removed).delete()
+        if changed:
+            CartItem.objects.bulk_update(changed, ['quantity'])
+    if removed or changed:
+        _changed(user.pk)
+
+
+class GuestCart:
+    """The cart of a visitor who has not logged in, kept in a signed cookie.
+
+    Nothing is written to the database until ``merge_into`` moves the lines
+    to the user's CartItems at login. The cookie holds ``product-quantity``
+    pairs in the order they were added; ``GuestCartMiddleware`` writes it
+    back when the cart changes. Products deleted since are dropped when the
+    cart is read.
+    """
+
+    def __init__(self, quantities=None):
+        self.quantities = dict(quantities or {})
+        self.modified = False
+
+    @classmethod
+    def from_request(cls, request):
+        value = request.get_signed_cookie(GUEST_COOKIE, None, salt=GUEST_COOKIE_SALT, max_age=GUEST_MAX_AGE)
+        try:
+            pairs = [pair.split('-') for pair in value.split('.')] if value else []
+            return cls({int(pk): int(quantity) for pk, quantity in pairs})
+        except ValueError:
+            return cls()
+
+    def dumps(self):
+        return '.'.join(f'{pk}-{quantity}' for pk, quantity in self.quantities.items())
+
+    def save(self, response):
+        if self.quantities:
+            response.set_signed_cookie(
+                GUEST_COOKIE, self.dumps(), salt=GUEST_COOKIE_SALT, max_age=GUEST_MAX_AGE, httponly=True, samesite='Lax',
+            )
+        else:
+            response.delete_cookie(GUEST_COOKIE, samesite='Lax')
+        return response
+
+    @property
+    def count(self):
+        return sum(self.quantities.values())
+
+    def summary(self):
+        # The navbar only shows the count, which needs no query.
+        return {'count': self.count}
+
+    def add(self, product, quantity=1):
+        in_cart = self.quantities.get(product.pk, 0)
+        if in_cart + quantity > product.stock:
+            raise OutOfStockError(product, in_cart, quantity)
+        if not in_cart and len(self.quantities) >= GUEST_MAX_LINES:
+            raise CartFullError(f"Your cart is full. Log in to add more than {GUEST_MAX_LINES} products.")
+        self.quantities[product.pk] = in_cart + quantity
+        self.modified = True
+
+    def set_quantity(self, product, quantity):
+        """Set a line's quantity; zero or less removes the line. Returns the quantity, or None if removed."""
+        if quantity <= 0:
+            self.remove(product.pk)
+            return None
+        if product.stock < quantity:
+            raise OutOfStockError(product, self.quantities.get(product.pk, 0), quantity)
+        self.quantities[product.pk] = quantity
+        self.modified = True
+        return quantity
+
+    def remove(self, product_id):
+        if self.quantities.pop(product_id, None) is not None:
+            self.modified = True
+
+    def update_quantities(self, quantities):
+        """``update_quantities()`` for a guest cart, whose lines are keyed by product id."""
+        pks = [pk for pk in quantities if pk in self.quantities]
+        products = Product.objects.only('name', 'stock').in_bulk(pks) if pks else {}
+        failed = _short_lines(
+            [(pk, CartItem(product=product, quantity=self.quantities[pk])) for pk, product in products.items()],
+            quantities,
+        )
+        if failed:
+            raise CartUpdateError(failed)
+        for pk in products:
+            if quantities[pk] <= 0:
+                del self.quantities[pk]
+            else:
+                self.quantities[pk] = quantities[pk]
+            self.modified = True
+
+    def _lines(self, products):
+        items = [
+            CartItem(product=products[pk], quantity=quantity)
+            for pk, quantity in self.quantities.items() if pk in products
+        ]
+        total = Decimal('0.00')
+        for item in items:
+            item.line_total = item.total_price()
+            total += item.line_total
+        for item in items:
+            item.cart_total = total
+        return items
+
+    def lines(self):
+        """Unsaved CartItems with ``line_total`` and ``cart_total``, like ``lines()``, in one query."""
+        return self._lines(Product.objects.in_bulk(self.quantities) if self.quantities else {})
+
+    async def alines(self):
+        return self._lines(await Product.objects.ain_bulk(self.quantities) if self.quantities else {})
+
+    def merge_into(self, user):
+        """Add the lines to ``user``'s cart, capped at stock, and empty this one; returns the lines merged.
+
+        One read of the lines the user already has and one upsert, whatever
+        the size of either cart.
+        """
+        if not self.quantities:
+            return 0
+        stock = dict(Product.objects.filter(pk__in=self.quantities).values_list('pk', 'stock'))
+        existing = dict(
+            CartItem.objects.filter(user=user, product_id__in=stock).values_list('product_id', 'quantity')
+        )
+        items = []
+        for pk, quantity in self.quantities.items():
+            in_cart = existing.get(pk, 0)
+            merged = max(min(in_cart + quantity, stock.get(pk, 0)), in_cart)
+            if merged > in_cart:
+                items.append(CartItem(user=user, product_id=pk, quantity=merged))
+        CartItem.objects.bulk_create(
+            items, update_conflicts=True, unique_fields=['user', 'product'], update_fields=['quantity'],
+        )
+        self.quantities.clear()
+        self.modified = True
+        _changed(user.pk)
+        return len(items)
+
+
+def guest_cart(request):
+    """The request's GuestCart, read from its cookie once per request."""
+    if not hasattr(request, '_guest_cart'):
+        request._guest_cart = GuestCart.from_request(request)
+    return request._guest_cart
+
+
+def save_guest_cart(request, response):
+    """Write the guest cart back to its cookie if it changed during the request."""
+    cart = getattr(request, '_guest_cart', None)
+    if cart is not None and cart.modified:
+        cart.save(response)
+    return response
+
+
+def request_summary(request):
+    """The navbar summary of the signed-in user's cart, or of the visitor's guest cart."""
+    if request.user.is_authenticated:
+        return get_summary(request.user.pk)
+    return guest_cart(request).summary()
+
+
+async def arequest_summary(request):
+    user = await request.auser()
+    if user.is_authenticated:
+        return await aget_summary(user.pk)
+    return guest_cart(request).summary()
@@ -0,0 +1,227 @@
+import base64
+import json
+
+from django.core.cache import cache
+from django.db.models import Count, Max, Q
+
+from . import caching, inventory
+from .models import Product
+
+PAGE_SIZE = 6
+PAGE_CACHE_TIMEOUT = 300
+PRODUCT_CACHE_TIMEOUT = 300
+COUNT_CACHE_TIMEOUT = 600
+
+NAMESPACE = 'catalog'
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def catalog_version():
+    return caching.namespace_version(NAMESPACE)
+
+
+async def acatalog_version():
+    return await caching.anamespace_version(NAMESPACE)
+
+
+def bump_catalog_version():
+    """Invalidate every cached catalog page and product by moving to a new version."""
+    caching.bump_namespace(NAMESPACE)
+
+
+def invalidate_products(pks):
+    """Drop the cached product and ``updated_at`` of ``pks`` only, leaving the rest of the catalog cached.
+
+    For frequent writes to a few products, such as checkout's stock UPDATE.
+    Catalog pages and the catalog state keep their copies until they expire,
+    so their stock may lag by up to PAGE_CACHE_TIMEOUT.
+    """
+    cache.delete_many([caching.make_key(NAMESPACE, part, pk) for pk in pks for part in ('product', 'modified')])
+
+
+def encode_cursor(product):
+    raw = json.dumps([product.name, product.pk], separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        name, pk = json.loads(raw)
+    except (ValueError, TypeError):
+        raise InvalidCursor(cursor)
+    if not isinstance(name, str) or not isinstance(pk, int):
+        raise InvalidCursor(cursor)
+    return name, pk
+
+
+class CatalogPage:
+    def __init__(self, products, has_next, has_previous):
+        self.products = products
+        self.has_next = has_next
+        self.has_previous = has_previous
+
+    @property
+    def next_cursor(self):
+        return encode_cursor(self.products[-1]) if self.has_next and self.products else None
+
+    @property
+    def previous_cursor(self):
+        return encode_cursor(self.products[0]) if self.has_previous and self.products else None
+
+    def __iter__(self):
+        return iter(self.products)
+
+    def __len__(self):
+        return len(self.products)
+
+
+def page_queryset(after=None, before=None, page_size=PAGE_SIZE):
+    """Queryset for one page plus one look-ahead row.
+
+    The redundant ``name >=``/``name <=`` bound lets the database start an
+    index range scan at the cursor instead of filtering from the first row.
+    """
+    queryset = Product.objects.all()
+    if before is not None:
+        name, pk = decode_cursor(before)
+        return (
+            queryset.filter(Q(name__lte=name), Q(name__lt=name) | Q(pk__lt=pk))
+            .order_by('-name', '-pk')[:page_size + 1]
+        )
+    if after is not None:
+        name, pk = decode_cursor(after)
+        queryset = queryset.filter(Q(name__gte=name), Q(name__gt=name) | Q(pk__gt=pk))
+    return queryset.order_by('name', 'pk')[:page_size + 1]
+
+
+def _build_page(rows, after, before, page_size):
+    if before is not None:
+        return CatalogPage(rows[:page_size][::-1], has_next=True, has_previous=len(rows) > page_size)
+    return CatalogPage(rows[:page_size], has_next=len(rows) > page_size, has_previous=after is not None)
+
+
+def _sharded(products):
+    return [product.pk for product in products if product.stock_shards]
+
+
+def _add_shard_stock(products, totals):
+    # Product.stock of a sharded product lags its shards; show the live stock.
+    for product in products:
+        if product.stock_shards:
+            product.stock += totals.get(product.pk, 0) - product.stock_at_rebalance
+    return products
+
+
+def with_shard_stock(products):
+    """``products`` with the live stock of sharded ones; one query if there are any."""
+    sharded = _sharded(products)
+    return _add_shard_stock(products, dict(inventory.shard_totals(sharded))) if sharded else products
+
+
+async def awith_shard_stock(products):
+    sharded = _sharded(products)
+    if not sharded:
+        return products
+    return _add_shard_stock(products, {pk: total async for pk, total in inventory.shard_totals(sharded)})
+
+
+def _fetch_page(after, before, page_size):
+    rows = with_shard_stock(list(page_queryset(after, before, page_size)))
+    return _build_page(rows, after, before, page_size)
+
+
+async def _afetch_page(after, before, page_size):
+    rows = await awith_shard_stock([product async for product in page_queryset(after, before, page_size)])
+    return _build_page(rows, after, before, page_size)
+
+
+def _fetch_product(pk):
+    return with_shard_stock([Product.objects.get(pk=pk)])[0]
+
+
+async def _afetch_product(pk):
+    return (await awith_shard_stock([await Product.objects.aget(pk=pk)]))[0]
+
+
+def get_page(after=None, before=None, page_size=PAGE_SIZE):
+    """Return one catalog page ordered by ``(name, id)`` using keyset pagination.
+
+    ``after``/``before`` are opaque cursors taken from a previous page. Each
+    page is a single indexed range scan regardless of how deep it is, and the
+    result is cached under the current catalog version.
+    """
+    key = caching.make_key(NAMESPACE, 'page', page_size, after or '', before or '')
+    return caching.get_or_set(NAMESPACE, key, lambda: _fetch_page(after, before, page_size), PAGE_CACHE_TIMEOUT)
+
+
+def get_product(pk):
+    """Cached single product; raises Product.DoesNotExist like ``objects.get``."""
+    key = caching.make_key(NAMESPACE, 'product', pk)
+    return caching.get_or_set(NAMESPACE, key, lambda: _fetch_product(pk), PRODUCT_CACHE_TIMEOUT)
+
+
+def approximate_count():
+    """Product count cached for COUNT_CACHE_TIMEOUT; may lag behind writes."""
+    return caching.get_or_set('catalog_count', 'catalog:count', Product.objects.count, COUNT_CACHE_TIMEOUT)
+
+
+def _state_aggregates():
+    return {'modified': Max('updated_at'), 'count': Count('pk')}
+
+
+def catalog_state():
+    """``{'modified', 'count'}`` of the whole catalog, for HTTP validators.
+
+    Deletes leave the newest ``updated_at`` alone but change the count. One
+    aggregate without loading any rows, cached under the catalog version.
+    """
+    key = caching.make_key(NAMESPACE, 'state')
+    return caching.get_or_set(
+        NAMESPACE, key, lambda: Product.objects.order_by().aggregate(**_state_aggregates()), PAGE_CACHE_TIMEOUT,
+    )
+
+
+def product_modified(pk):
+    """``updated_at`` of one product, or None if it does not exist; read without loading the row."""
+    key = caching.make_key(NAMESPACE, 'modified', pk)
+    return caching.get_or_set(
+        NAMESPACE, key, lambda: Product.objects.filter(pk=pk).values_list('updated_at', flat=True).first(),
+        PRODUCT_CACHE_TIMEOUT,
+    )
+
+
+async def aget_page(after=None, before=None, page_size=PAGE_SIZE):
+    """Async get_page(); shares its cache entries."""
+    key = await caching.amake_key(NAMESPACE, 'page', page_size, after or '', before or '')
+    return await caching.aget_or_set(
+        NAMESPACE, key, lambda: _afetch_page(after, before, page_size), PAGE_CACHE_TIMEOUT,
+    )
+
+
+async def aget_product(pk):
+    key = await caching.amake_key(NAMESPACE, 'product', pk)
+    return await caching.aget_or_set(NAMESPACE, key, lambda: _afetch_product(pk), PRODUCT_CACHE_TIMEOUT)
+
+
+async def aapproximate_count():
+    return await caching.aget_or_set('catalog_count', 'catalog:count', Product.objects.acount, COUNT_CACHE_TIMEOUT)
+
+
+async def acatalog_state():
+    key = await caching.amake_key(NAMESPACE, 'state')
+    return await caching.aget_or_set(
+        NAMESPACE, key, lambda: Product.objects.order_by().aaggregate(**_state_aggregates()),
+        PAGE_CACHE_TIMEOUT,
+    )
+
+
+async def aproduct_modified(pk):
+    key = await caching.amake_key(NAMESPACE, 'modified', pk)
+    return await caching.aget_or_set(
+        NAMESPACE, key, lambda: Product.objects.filter(pk=pk).values_list('updated_at', flat=True).afirst(),
+        PRODUCT_CACHE_TIMEOUT,
+    )
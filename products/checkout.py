@@ -0,0 +1,136 @@
+from collections import defaultdict
+from datetime import timedelta
+
+from django.db import transaction
+from django.utils import timezone
+from jobs.queue import enqueue
+
+from . import analytics, inventory, recommendations, routers
+from .carts import invalidate_summary
+from .catalog import invalidate_products
+from .models import CartItem, Order, OrderItem
+
+
+class CheckoutError(Exception):
+    pass
+
+
+class EmptyCartError(CheckoutError):
+    pass
+
+
+class InsufficientStockError(CheckoutError):
+    """Raised when one or more cart lines cannot be fulfilled.
+
+    ``failed_lines`` is a list of ``(cart_item, available_stock)`` tuples.
+    """
+
+    def __init__(self, failed_lines):
+        self.failed_lines = failed_lines
+        names = ", ".join(item.product.name for item, _ in failed_lines)
+        super().__init__(f"Not enough stock for: {names}")
+
+
+def _quantities_by_product(items):
+    quantities = defaultdict(int)
+    for item in items:
+        quantities[item.product_id] += item.quantity
+    return quantities
+
+
+def _shards(items):
+    # Hot products whose stock is spread over StockShard counters; see products.inventory.
+    return {item.product_id: item.product.stock_shards for item in items if item.product.stock_shards}
+
+
+def _find_failed_lines(items, quantities, held):
+    # What the user could have: stock nobody else holds, plus their own hold.
+    available = inventory.available(quantities)
+    for product_id, quantity in held.items():
+        available[product_id] = available.get(product_id, 0) + quantity
+    return [
+        (item, max(available.get(item.product_id, 0), 0))
+        for item in items
+        if available.get(item.product_id, 0) < quantities[item.product_id]
+    ]
+
+
+def cart_queryset(user):
+    return CartItem.objects.filter(user=user).select_related('product').order_by('product_id')
+
+
+def _cart_lines(user):
+    items = list(cart_queryset(user))
+    if not items:
+        raise EmptyCartError("Your cart is empty.")
+    return items
+
+
+def reserve_cart(user):
+    """Hold the user's cart quantities for the rest of checkout; returns when the hold expires.
+
+    Called on entering checkout so that buyers who cannot be served learn
+    it before filling in their details. Raises InsufficientStockError, and
+    leaves any earlier holds as they were, when a line is short.
+    """
+    items = _cart_lines(user)
+    quantities = _quantities_by_product(items)
+    if inventory.hold(user, quantities, shards=_shards(items)):
+        raise InsufficientStockError(_find_failed_lines(items, quantities, inventory.held_by(user)))
+    return timezone.now() + timedelta(seconds=inventory.HOLD_SECONDS)
+
+
+def _invalidate_cached_products(product_ids):
+    invalidate_products(product_ids)
+    recommendations.invalidate_neighbours_modified(product_ids)
+
+
+def place_order(user, shipping_data, payment_data):
+    """Turn the user's cart into an Order in a single transaction.
+
+    inventory.consume() takes the stock, the lines are written with one
+    ``bulk_create``, the sales rollups and "customers also bought" lists are
+    updated, the cart is cleared and an ``order_placed`` job is queued. If
+    any line is short the transaction rolls back and InsufficientStockError
+    lists the failing lines, so concurrent checkouts can never oversell.
+    """
+    with transaction.atomic():
+        items = _cart_lines(user)
+        quantities = _quantities_by_product(items)
+        if inventory.consume(user, quantities, shards=_shards(items)):
+            order = Order.objects.create(
+                user=user,
+                shipping_address=f"{shipping_data.get('address_line_1')}, {shipping_data.get('address_line_2', '')}",
+                shipping_city=shipping_data.get('city'),
+                shipping_state=shipping_data.get('state'),
+                shipping_postal_code=shipping_data.get('postal_code'),
+                shipping_country=shipping_data.get('country'),
+                payment_method=payment_data.get('payment_method'),
+                total_price=sum(item.total_price() for item in items),
+            )
+            OrderItem.objects.bulk_create([
+                OrderItem(
+                    order=order,
+                    product_id=item.product_id,
+                    product_name=item.product.name,
+                    quantity=item.quantity,
+                    price_at_purchase=item.product.price,
+                )
+                for item in items
+            ])
+            analytics.record_order(order, [(item.product, item.quantity, item.product.price) for item in items])
+            recommendations.record_order(order.pk, [item.product_id for item in items])
+            CartItem.objects.filter(pk__in=[item.pk for item in items]).delete()
+            # Committed with the order, so workers never see a job for a missing order.
+            enqueue('order_placed', {'order_id': order.pk})
+            # The stock UPDATE bypasses Product signals, so drop these products' cached entries here.
+            # Only theirs: bumping the catalog version on every order would keep the whole cache cold.
+            product_ids = list(quantities)
+            transaction.on_commit(lambda: _invalidate_cached_products(product_ids))
+            transaction.on_commit(lambda: invalidate_summary(user.pk))
+            # The buyer goes straight to their order history.
+            routers.pin_to_primary()
+            return order
+        transaction.set_rollback(True)
+
+    raise InsufficientStockError(_find_failed_lines(items, quantities, inventory.held_by(user)))
@@ -0,0 +1,141 @@
+"""Conditional GET for the storefront pages and the product API.
+
+The HTML pages greet the user, show their cart badge and flash messages and
+embed a CSRF token, so they are sent ``Cache-Control: private, no-cache``
+with ``Vary: Cookie``: the browser keeps its copy and revalidates it on every
+visit, and shared caches never store one user's page for another. Their
+ETags cover the product data and that per-viewer state together, so a 304 is
+only sent when the whole page would come out the same. Pages carrying flash
+messages get no validator, so a later 304 can never replay a message. They
+get no Last-Modified either: a date cannot describe a change to the cart.
+
+The product API responses are the same for every user and also carry
+Last-Modified.
+"""
+import hashlib
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.contrib.messages import get_messages
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import quote_etag
+
+from . import carts, catalog, recommendations
+
+
+def _etag(*parts):
+    return quote_etag(hashlib.blake2b('|'.join(map(str, parts)).encode(), digest_size=12).hexdigest())
+
+
+def _revalidatable(request):
+    return request.method in ('GET', 'HEAD') and not len(get_messages(request))
+
+
+def _viewer(user, cart_summary, request):
+    # Everything base.html renders for this user, plus the CSRF secret behind the page's tokens.
+    return (user.pk, user.get_username(), cart_summary['count'], request.COOKIES.get(settings.CSRF_COOKIE_NAME, ''))
+
+
+def viewer(request):
+    """The per-viewer part of a page's ETag, or None if the page must not be revalidated."""
+    if not _revalidatable(request):
+        return None
+    return _viewer(request.user, carts.request_summary(request), request)
+
+
+async def aviewer(request):
+    if not _revalidatable(request):
+        return None
+    return _viewer(await request.auser(), await carts.arequest_summary(request), request)
+
+
+def catalog_page_etag(request, *args, **kwargs):
+    """Catalog and search pages: the catalog state, the URL and the viewer."""
+    page_viewer = viewer(request)
+    if page_viewer is None:
+        return None
+    state = catalog.catalog_state()
+    return _etag('catalog', state['modified'], state['count'], request.get_full_path(), *page_viewer)
+
+
+async def acatalog_page_etag(request, *args, **kwargs):
+    page_viewer = await aviewer(request)
+    if page_viewer is None:
+        return None
+    state = await catalog.acatalog_state()
+    return _etag('catalog', state['modified'], state['count'], request.get_full_path(), *page_viewer)
+
+
+def product_page_etag(request, pk):
+    """Product pages: the product, the "customers also bought" cards below it and the viewer."""
+    page_viewer = viewer(request)
+    modified = catalog.product_modified(pk)
+    if page_viewer is None or modified is None:
+        return None
+    return _etag('product', pk, modified, recommendations.neighbours_modified(pk), *page_viewer)
+
+
+async def aproduct_page_etag(request, pk):
+    page_viewer = await aviewer(request)
+    modified = await catalog.aproduct_modified(pk)
+    if page_viewer is None or modified is None:
+        return None
+    return _etag('product', pk, modified, await recommendations.aneighbours_modified(pk), *page_viewer)
+
+
+def _finish(request, response, etag):
+    if request.method in ('GET', 'HEAD') and etag is not None:
+        response.headers.setdefault('ETag', etag)
+    patch_cache_control(response, private=True, no_cache=True)
+    patch_vary_headers(response, ('Cookie',))
+    return response
+
+
+def revalidated_page(etag_func):
+    """Serve a per-user page as ``private, no-cache`` and answer If-None-Match with 304.
+
+    Like ``django.views.decorators.http.condition``, except that async views
+    take an async ``etag_func`` (``acatalog_page_etag``, ...) so the check does
+    no blocking I/O. Replaces ``never_cache``, whose ``no-store`` stops
+    browsers from keeping anything to revalidate.
+    """
+    def decorator(view):
+        if iscoroutinefunction(view):
+            @wraps(view)
+            async def inner(request, *args, **kwargs):
+                etag = await etag_func(request, *args, **kwargs)
+                response = get_conditional_response(request, etag=etag) if etag else None
+                if response is None:
+                    response = await view(request, *args, **kwargs)
+                return _finish(request, response, etag)
+        else:
+            @wraps(view)
+            def inner(request, *args, **kwargs):
+                etag = etag_func(request, *args, **kwargs)
+                response = get_conditional_response(request, etag=etag) if etag else None
+                if response is None:
+                    response = view(request, *args, **kwargs)
+                return _finish(request, response, etag)
+        return inner
+    return decorator
+
+
+def catalog_api_etag(request, *args, **kwargs):
+    # Accept picks the renderer (JSON or the browsable API).
+    state = catalog.catalog_state()
+    return _etag('catalog-api', state['modified'], state['count'], request.get_full_path(), request.headers.get('Accept'))
+
+
+def catalog_api_last_modified(request, *args, **kwargs):
+    # Lags deletes, which only the ETag sees; clients sending both are judged by the ETag.
+    return catalog.catalog_state()['modified']
+
+
+def product_api_etag(request, pk):
+    modified = catalog.product_modified(pk)
+    return _etag('product-api', pk, modified, request.get_full_path(), request.headers.get('Accept')) if modified else None
+
+
+def product_api_last_modified(request, pk):
+    return catalog.product_modified(pk)
@@ -0,0 +1,9 @@
+from django.utils.functional import SimpleLazyObject
+
+from . import carts
+
+
+def cart_summary(request):
+    if not hasattr(request, 'user'):
+        return {}
+    return {'cart_summary': SimpleLazyObject(lambda: carts.request_summary(request))}
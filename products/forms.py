@@ -25,6 +25,25 @@ class AddToCartForm(forms.Form):
     widget=forms.NumberInput(attrs={'class': 'form-control', 'style': 'width: 80px;'}))
     
     
+class SearchForm(forms.Form):
+    q = forms.CharField(label='Search', max_length=200, required=False,
+    widget=forms.TextInput(attrs={'class': 'form-control', 'placeholder': 'Search products'}))
+    min_price = forms.DecimalField(label='Min price', min_value=0, required=False,
+    widget=forms.NumberInput(attrs={'class': 'form-control', 'step': '0.01'}))
+    max_price = forms.DecimalField(label='Max price', min_value=0, required=False,
+    widget=forms.NumberInput(attrs={'class': 'form-control', 'step': '0.01'}))
+    in_stock = forms.BooleanField(label='In stock only', required=False,
+    widget=forms.CheckboxInput(attrs={'class': 'form-check-input'}))
+    page = forms.IntegerField(min_value=1, required=False, widget=forms.HiddenInput)
+
+
+class ProductImportForm(forms.Form):
+    FORMAT_CHOICES = [('csv', 'CSV'), ('jsonl', 'JSON lines')]
+    file = forms.FileField(label='File', widget=forms.ClearableFileInput(attrs={'class': 'form-control'}),
+    help_text='Columns: sku, name, description, price, stock, image_url (optional). Rows are matched to your products by SKU.')
+    format = forms.ChoiceField(label='Format', choices=FORMAT_CHOICES, initial='csv', widget=forms.Select(attrs={'class': 'form-select'}))
+
+
 class ShippingAddressForm(forms.Form):
     full_name = forms.CharField(label='Full Name', max_length=100, widget=forms.TextInput(attrs={'class': 'form-control'}))
     address_line_1 = forms.CharField(label='Address Line 1', max_length=255, widget=forms.TextInput(attrs={'class': 'form-control'}))
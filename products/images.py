@@ -0,0 +1,134 @@
+"""Product image storage and responsive variants.
+
+Uploads are stored once per distinct content, named by their SHA-256, so
+re-uploading the same picture for many products costs no extra disk and
+shares one set of variants. Variants are resized WebP and JPEG copies made
+by the ``product_image_variants`` job; until it has run, pages fall back to
+the original upload.
+"""
+import hashlib
+import io
+import os
+import posixpath
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from PIL import Image, ImageOps
+
+VARIANT_WIDTHS = (160, 320, 480, 640, 960, 1280)
+# Pillow format and save() options, keyed by variant file extension.
+VARIANT_FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+# Width of the JPEG used as <img src> by browsers that ignore srcset.
+FALLBACK_WIDTH = 640
+HASH_CHUNK_SIZE = 64 * 1024
+EXIF_ORIENTATION = 0x0112
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """File storage where a name is derived from the content, so an existing name is the same file."""
+
+    def get_available_name(self, name, max_length=None):
+        return name
+
+    def _save(self, name, content):
+        if self.exists(name):
+            return name
+        try:
+            return super()._save(name, content)
+        except FileExistsError:
+            # Another upload of the same content won the race.
+            return name
+
+
+storage = ContentAddressedStorage()
+
+
+def content_hash(file):
+    digest = hashlib.sha256()
+    file.seek(0)
+    for chunk in iter(lambda: file.read(HASH_CHUNK_SIZE), b''):
+        digest.update(chunk)
+    file.seek(0)
+    return digest.hexdigest()
+
+
+def upload_to(instance, filename):
+    digest = content_hash(instance.image.file)
+    extension = os.path.splitext(filename)[1].lower() or '.jpg'
+    return f'products/{digest[:2]}/{digest}{extension}'
+
+
+def variant_name(name, width, fmt):
+    digest = posixpath.splitext(posixpath.basename(name))[0]
+    return f'products/variants/{digest[:2]}/{digest}-{width}.{fmt}'
+
+
+def _flatten(image):
+    # JPEG has no alpha channel; composite transparent images onto white.
+    if image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, 'white')
+        background.paste(image, mask=image.getchannel('A'))
+        return background
+    return image.convert('RGB')
+
+
+def generate_variants(name):
+    """Write any missing variants of the stored image ``name`` and describe them.
+
+    Returns ``{'width', 'height', 'widths'}``: the original's size and the
+    widths that now exist in every format. Images are never upscaled; one
+    narrower than the largest variant width gets a variant at its own width.
+    """
+    with storage.open(name) as f:
+        image = Image.open(f)
+        # Orientations 5-8 are stored rotated by 90 degrees.
+        rotated = image.getexif().get(EXIF_ORIENTATION, 1) in (5, 6, 7, 8)
+        width, height = image.size[::-1] if rotated else image.size
+        widths = [w for w in VARIANT_WIDTHS if w < width]
+        if width <= VARIANT_WIDTHS[-1]:
+            widths.append(width)
+        missing = [
+            (w, fmt) for w in widths for fmt in VARIANT_FORMATS
+            if not storage.exists(variant_name(name, w, fmt))
+        ]
+        if missing:
+            # Let the JPEG decoder scale down by a power of two on load when
+            # even the largest variant needs far fewer pixels than the original.
+            largest = max(w for w, _ in missing)
+            target = (largest, max(1, height * largest // width))
+            image.draft('RGB', target[::-1] if rotated else target)
+            image = _flatten(ImageOps.exif_transpose(image))
+
+    # Widest first, each resized from the previous one rather than the original.
+    for w in sorted({w for w, _ in missing}, reverse=True):
+        image = image.resize((w, max(1, round(height * w / width))), Image.LANCZOS, reducing_gap=3.0)
+        for fmt in VARIANT_FORMATS:
+            if (w, fmt) in missing:
+                out = io.BytesIO()
+                pil_format, options = VARIANT_FORMATS[fmt]
+                image.save(out, pil_format, **options)
+                storage.save(variant_name(name, w, fmt), ContentFile(out.getvalue()))
+    return {'width': width, 'height': height, 'widths': widths}
+
+
+def srcset(name, widths, fmt):
+    return ', '.join(f'{storage.url(variant_name(name, w, fmt))} {w}w' for w in widths)
+
+
+def sources(name, variants):
+    """Template data for a <picture> element, or None until variants exist."""
+    widths = variants.get('widths') if variants else None
+    if not name or not widths:
+        return None
+    fallback = max([w for w in widths if w <= FALLBACK_WIDTH] or widths[:1])
+    return {
+        'src': storage.url(variant_name(name, fallback, 'jpg')),
+        'webp': srcset(name, widths, 'webp'),
+        'jpg': srcset(name, widths, 'jpg'),
+        'width': variants['width'],
+        'height': variants['height'],
+    }
@@ -0,0 +1,345 @@
+"""Checkout holds on stock.
+
+A buyer entering checkout holds their cart quantities for HOLD_SECONDS, so
+later buyers are turned away at the first step instead of after filling in
+the whole checkout. ``Product.reserved`` is kept equal to the sum of the
+product's Reservation rows by updating both in the same transaction; it is
+never recomputed on the request path. Available to sell is
+``stock - reserved``.
+
+Expired holds keep counting until they are released, either by the
+``release_expired_reservations`` job or on demand when a buyer would
+otherwise be short.
+
+A hot product can instead have its stock spread over ``stock_shards``
+StockShard counters, so that concurrent checkouts update different rows
+rather than queueing on the product's. Checkouts take from a random
+shard, falling back to its siblings; they do not hold sharded products, as
+holding would write the product row again. ``Product.stock`` then lags:
+it is the total at the last rebalance, recorded in ``stock_at_rebalance``,
+plus whatever restocks and edits changed since, which checkouts can also
+draw on. So the live stock is ``stock - stock_at_rebalance`` plus the sum
+of the shards. The ``rebalance_stock_shards`` job spreads those changes
+over the shards, evens them out and brings ``stock`` up to date every
+REBALANCE_SECONDS.
+"""
+import random
+from collections import defaultdict
+from datetime import timedelta
+
+from django.db import connection, transaction
+from django.db.models import Case, F, IntegerField, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from jobs.queue import enqueue_unique
+
+from .models import Product, Reservation, StockShard
+
+HOLD_SECONDS = 600
+RELEASE_BATCH_SIZE = 1000
+REBALANCE_SECONDS = 30
+MAX_SHARDS = 64
+
+
+def quantity_case(quantities):
+    """A per-row ``{product_id: quantity}`` lookup usable inside one UPDATE."""
+    return Case(
+        *[When(pk=product_id, then=Value(quantity)) for product_id, quantity in quantities.items()],
+        default=Value(0),
+        output_field=IntegerField(),
+    )
+
+
+def shard_totals(product_ids):
+    """``(product_id, units in its shards)`` pairs, from one grouped query."""
+    return (
+        StockShard.objects.filter(product_id__in=list(product_ids)).order_by()
+        .values('product_id').annotate(total=Sum('stock')).values_list('product_id', 'total')
+    )
+
+
+def available_queryset(product_ids):
+    """``(product_id, available to sell)`` pairs, shards included, from one query."""
+    sharded = Coalesce(
+        Subquery(
+            StockShard.objects.filter(product=OuterRef('pk')).order_by()
+            .values('product').annotate(total=Sum('stock')).values('total')
+        ),
+        Value(0),
+    )
+    return (
+        Product.objects.filter(pk__in=list(product_ids))
+        .annotate(available=F('stock') - F('stock_at_rebalance') + sharded - F('reserved'))
+        .values_list('pk', 'available')
+    )
+
+
+def available(product_ids):
+    return dict(available_queryset(product_ids))
+
+
+def holds(user):
+    return Reservation.objects.filter(user=user)
+
+
+def held_by(user, lock=False):
+    reservations = holds(user)
+    if lock and connection.features.has_select_for_update:
+        reservations = reservations.select_for_update()
+    return dict(reservations.values_list('product_id', 'quantity'))
+
+
+def _short(quantities):
+    now_available = available(quantities)
+    return [pk for pk, quantity in quantities.items() if now_available.get(pk, 0) < quantity]
+
+
+def _increase(quantities):
+    # All or nothing; returns the ids of products without enough available.
+    if not quantities:
+        return []
+    # Sold-out products turn buyers away with a read, without queueing for the write lock.
+    short = _short(quantities)
+    if short:
+        return short
+    case = quantity_case(quantities)
+    with transaction.atomic():
+        updated = Product.objects.filter(pk__in=list(quantities), stock__gte=F('reserved') + case).update(
+            reserved=F('reserved') + case,
+        )
+        if updated == len(quantities):
+            return []
+        transaction.set_rollback(True)
+    return _short(quantities)
+
+
+def _decrease(quantities):
+    if quantities:
+        case = quantity_case(quantities)
+        Product.objects.filter(pk__in=list(quantities)).update(reserved=F('reserved') - case)
+
+
+def hold(user, quantities, seconds=HOLD_SECONDS, shards=None):
+    """Make ``user``'s holds exactly ``{product_id: quantity}`` for the next ``seconds``.
+
+    Returns the ids of products that could not be held, in which case
+    nothing changed. Holding the same quantities again only extends the
+    expiry and does not touch the Product rows other buyers contend on.
+    Products in ``shards``, ``{product_id: stock_shards}``, are only checked
+    for enough stock, not held.
+    """
+    if shards:
+        short = _short({pk: q for pk, q in quantities.items() if pk in shards})
+        if short:
+            return short
+        quantities = {pk: q for pk, q in quantities.items() if pk not in shards}
+    expires_at = timezone.now() + timedelta(seconds=seconds)
+    with transaction.atomic():
+        held = held_by(user, lock=True)
+        if held == quantities:
+            Reservation.objects.filter(user=user).update(expires_at=expires_at)
+            return []
+
+        more = {pk: q - held.get(pk, 0) for pk, q in quantities.items() if q > held.get(pk, 0)}
+        less = {pk: q - quantities.get(pk, 0) for pk, q in held.items() if q > quantities.get(pk, 0)}
+        short = _increase(more)
+        if short and release_expired(product_ids=short):
+            short = _increase(more)
+        if short:
+            transaction.set_rollback(True)
+            return short
+        _decrease(less)
+        Reservation.objects.filter(user=user).delete()
+        Reservation.objects.bulk_create([
+            Reservation(user=user, product_id=pk, quantity=q, expires_at=expires_at) for pk, q in quantities.items()
+        ])
+        enqueue_unique('release_expired_reservations', delay=seconds)
+    return []
+
+
+def shard_update(product_id, index, quantity):
+    """Queryset and values of the conditional UPDATE taking ``quantity`` from one shard."""
+    return (
+        StockShard.objects.filter(product_id=product_id, index=index, stock__gte=quantity),
+        {'stock': F('stock') - quantity},
+    )
+
+
+def nonempty_shards(product_id):
+    """``(index, stock)`` of a product's shards with stock left, in the order checkouts lock them."""
+    return StockShard.objects.filter(product_id=product_id, stock__gt=0).order_by('index').values_list('index', 'stock')
+
+
+def _take(update):
+    queryset, values = update
+    return queryset.update(**values)
+
+
+def _take_from_shards(product_id, shards, quantity):
+    # Usually one UPDATE of a random shard, which concurrent buyers rarely share.
+    if _take(shard_update(product_id, random.randrange(shards), quantity)):
+        return True
+    # That shard is short: take what the others have, then any restock since the last rebalance.
+    # Always in index order, so two buyers never lock the same rows in opposite orders.
+    remaining = quantity
+    for index, stock in nonempty_shards(product_id):
+        take = min(stock, remaining)
+        if _take(shard_update(product_id, index, take)):
+            remaining -= take
+            if not remaining:
+                return True
+    restocked = Product.objects.filter(pk=product_id, stock__gte=F('stock_at_rebalance') + F('reserved') + remaining)
+    return bool(restocked.update(stock=F('stock') - remaining, updated_at=timezone.now()))
+
+
+def stock_update(quantities, from_hold=None):
+    """Queryset and values of consume()'s conditional stock UPDATE.
+
+    A product qualifies when its stock covers the other buyers' holds plus
+    what this order needs beyond its own hold, ``from_hold``.
+    """
+    need = quantity_case(quantities)
+    if from_hold:
+        used = quantity_case(from_hold)
+        return (
+            Product.objects.filter(pk__in=list(quantities), stock__gte=F('reserved') - used + need),
+            {'stock': F('stock') - need, 'reserved': F('reserved') - used, 'updated_at': timezone.now()},
+        )
+    return (
+        Product.objects.filter(pk__in=list(quantities), stock__gte=F('reserved') + need),
+        {'stock': F('stock') - need, 'updated_at': timezone.now()},
+    )
+
+
+def consume(user, quantities, shards=None):
+    """Take ``{product_id: quantity}`` out of stock, drawing on ``user``'s holds first.
+
+    Plain products share one conditional UPDATE, see stock_update(); those
+    in ``shards``, ``{product_id: stock_shards}``, usually take one UPDATE
+    of a shard each. Returns False if any product is short and the caller
+    must roll back; on success the user's holds are released.
+    """
+    shards = shards or {}
+    for product_id, count in shards.items():
+        if not _take_from_shards(product_id, count, quantities[product_id]):
+            return False
+    quantities = {pk: q for pk, q in quantities.items() if pk not in shards}
+    held = held_by(user, lock=True)
+    from_hold = {pk: min(q, held.get(pk, 0)) for pk, q in quantities.items() if pk in held}
+    if quantities and _take(stock_update(quantities, from_hold)) != len(quantities):
+        return False
+    if held:
+        _decrease({pk: q - from_hold.get(pk, 0) for pk, q in held.items() if q > from_hold.get(pk, 0)})
+        holds(user).delete()
+    return True
+
+
+def expired_holds(product_ids=None):
+    expired = Reservation.objects.filter(expires_at__lte=timezone.now())
+    if product_ids is not None:
+        expired = expired.filter(product_id__in=list(product_ids))
+    return expired
+
+
+def release_expired(product_ids=None, batch_size=RELEASE_BATCH_SIZE):
+    """Release up to ``batch_size`` expired holds, optionally only on ``product_ids``; returns how many."""
+    expired = expired_holds(product_ids)
+    with transaction.atomic():
+        if connection.features.has_select_for_update_skip_locked:
+            # Concurrent sweeps take disjoint rows. On SQLite the write lock serialises them.
+            expired = expired.select_for_update(skip_locked=True)
+        rows = list(expired.values_list('pk', 'product_id', 'quantity')[:batch_size])
+        if not rows:
+            return 0
+        Reservation.objects.filter(pk__in=[pk for pk, _, _ in rows]).delete()
+        released = defaultdict(int)
+        for _, product_id, quantity in rows:
+            released[product_id] += quantity
+        _decrease(released)
+    return len(rows)
+
+
+def reconcile():
+    """Recompute every Product.reserved from the Reservation rows; returns how many were wrong.
+
+    Only needed if holds were deleted behind this module's back, e.g. by
+    cascading from a deleted user.
+    """
+    total = Coalesce(
+        Subquery(
+            Reservation.objects.filter(product=OuterRef('pk')).order_by()
+            .values('product').annotate(total=Sum('quantity')).values('total')
+        ),
+        Value(0),
+    )
+    with transaction.atomic():
+        return Product.objects.annotate(total=total).exclude(reserved=F('total')).update(reserved=total)
+
+
+def _spread(total, shards):
+    if not shards:
+        return []
+    share, extra = divmod(total, shards)
+    return [share + (index < extra) for index in range(shards)]
+
+
+def _locked(product_id):
+    # Shards before the product, in index order: the order checkouts lock them in.
+    shards = list(StockShard.objects.select_for_update().filter(product_id=product_id).order_by('index'))
+    product = Product.objects.select_for_update().only('stock', 'reserved', 'stock_at_rebalance').get(pk=product_id)
+    return shards, product
+
+
+def shard_stock(product_id, shards):
+    """Spread a product's stock over ``shards`` counters, or gather it back into the product with 0.
+
+    Units covering checkout holds taken before sharding are left out of the shards.
+    """
+    with transaction.atomic():
+        rows, product = _locked(product_id)
+        stock = product.stock - product.stock_at_rebalance + sum(row.stock for row in rows)
+        spread = max(stock - product.reserved, 0) if shards else 0
+        StockShard.objects.filter(product_id=product_id).delete()
+        StockShard.objects.bulk_create([
+            StockShard(product_id=product_id, index=index, stock=units)
+            for index, units in enumerate(_spread(spread, shards))
+        ])
+        Product.objects.filter(pk=product_id).update(
+            stock=stock, stock_at_rebalance=spread, stock_shards=shards, updated_at=timezone.now(),
+        )
+    if shards:
+        enqueue_unique('rebalance_stock_shards', delay=REBALANCE_SECONDS)
+
+
+def rebalance(product_ids=None):
+    """Bring sharded products' stock up to date and even out their shards; returns how many changed.
+
+    Changes made to ``Product.stock`` since the last rebalance are spread
+    over the shards, except for units covering holds taken before sharding.
+    Moves ``updated_at`` too, which sharded checkouts leave alone, so page
+    validators see the new stock. Products unchanged since the last run are
+    left alone.
+    """
+    products = Product.objects.filter(stock_shards__gt=0)
+    if product_ids is not None:
+        products = products.filter(pk__in=list(product_ids))
+    rebalanced = 0
+    for product_id in products.values_list('pk', flat=True):
+        with transaction.atomic():
+            rows, product = _locked(product_id)
+            change = product.stock - product.stock_at_rebalance
+            in_shards = [row.stock for row in rows]
+            # Nothing sold, restocked or edited since the last run, and nothing to even out.
+            if not change and sum(in_shards) == product.stock_at_rebalance and max(in_shards) - min(in_shards) <= 1:
+                continue
+            kept = min(max(change, 0), product.reserved)
+            spread = max(sum(in_shards) + change - kept, 0)
+            for row, units in zip(rows, _spread(spread, len(rows))):
+                row.stock = units
+            StockShard.objects.bulk_update(rows, ['stock'])
+            Product.objects.filter(pk=product_id).update(
+                stock=spread + kept, stock_at_rebalance=spread, updated_at=timezone.now(),
+            )
+        rebalanced += 1
+    return rebalanced
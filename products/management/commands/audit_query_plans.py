@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from products import query_audit
+
+
+class Command(BaseCommand):
+    help = "EXPLAIN every query the storefront views run and fail on full table scans."
+
+    def handle(self, *args, **options):
+        failures = []
+        for name, query in query_audit.audited_querysets().items():
+            plan = query_audit.explain(query)
+            scans = query_audit.full_scans(plan)
+            sorts = query_audit.temp_sorts(plan)
+            if scans:
+                failures.append(name)
+                self.stdout.write(self.style.ERROR(f"FULL SCAN  {name}"))
+            elif sorts:
+                self.stdout.write(self.style.WARNING(f"TEMP SORT  {name}"))
+            else:
+                self.stdout.write(self.style.SUCCESS(f"OK         {name}"))
+            if options['verbosity'] > 1 or scans:
+                for line in plan:
+                    self.stdout.write(f"    {line}")
+        if failures:
+            raise CommandError(f"Full table scans in: {', '.join(failures)}")
@@ -0,0 +1,24 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from products import analytics
+
+
+class Command(BaseCommand):
+    help = "Rebuild the daily sales rollups behind the seller reports from the order history."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=analytics.BACKFILL_BATCH_SIZE, help="Orders per batch.")
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+
+        def progress(done, total):
+            if options['verbosity'] > 1:
+                self.stdout.write(f"  orders up to #{done} of #{total}")
+
+        covered = analytics.backfill(batch_size=options['batch_size'], progress=progress)
+        self.stdout.write(self.style.SUCCESS(
+            f"Rolled up orders up to #{covered} in {time.perf_counter() - started:.2f}s."
+        ))
@@ -0,0 +1,46 @@
+import importlib
+import json
+import subprocess
+
+from django.conf import settings
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from products.benchmarks import BENCHMARKS
+from products.benchmarks.utils import benchmark_database
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], cwd=settings.BASE_DIR, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = "Run a storefront benchmark against a throwaway test database."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', help="Write the results as JSON to this file.")
+        subparsers = parser.add_subparsers(dest='benchmark', required=True)
+        for name in BENCHMARKS:
+            module = importlib.import_module(f'products.benchmarks.{name}')
+            module.add_arguments(subparsers.add_parser(name, help=module.__doc__))
+
+    def handle(self, *args, **options):
+        module = importlib.import_module(f"products.benchmarks.{options['benchmark']}")
+        with benchmark_database():
+            results = module.run(options, self.stdout)
+        if options['output']:
+            with open(options['output'], 'w') as fh:
+                json.dump({
+                    'benchmark': options['benchmark'],
+                    'commit': git_commit(),
+                    'timestamp': timezone.now().isoformat(),
+                    'options': {k: v for k, v in options.items() if k not in ('stdout', 'stderr')},
+                    'results': results,
+                }, fh, indent=2, default=str)
+            self.stdout.write(self.style.SUCCESS(f"Results written to {options['output']}"))
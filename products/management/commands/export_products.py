@@ -0,0 +1,31 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from products import bulk
+
+
+class Command(BaseCommand):
+    help = "Stream products, optionally one seller's, as CSV or JSON lines."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seller', help="Only export this user's products.")
+        parser.add_argument('--format', choices=bulk.FORMATS, default='csv')
+        parser.add_argument('--output', help="File to write; defaults to stdout.")
+        parser.add_argument('--chunk-size', type=int, default=bulk.EXPORT_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        seller = None
+        if options['seller']:
+            try:
+                seller = User.objects.get(username=options['seller'])
+            except User.DoesNotExist:
+                raise CommandError(f"No user named {options['seller']!r}.")
+
+        lines = bulk.export_lines(bulk.export_rows(seller, chunk_size=options['chunk_size']), options['format'])
+        if not options['output']:
+            for line in lines:
+                self.stdout.write(line, ending='')
+            return
+        with open(options['output'], 'w', encoding='utf-8', newline='') as out:
+            out.writelines(lines)
+        self.stderr.write(f"Wrote {options['output']}")
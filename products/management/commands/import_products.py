@@ -0,0 +1,39 @@
+import os
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from products import bulk
+
+
+class Command(BaseCommand):
+    help = "Upsert a seller's products by SKU from a CSV or JSON-lines file."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--seller', required=True, help="Username that will own the products.")
+        parser.add_argument('--format', choices=bulk.FORMATS, help="Defaults to the file extension.")
+        parser.add_argument('--chunk-size', type=int, default=bulk.CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        fmt = options['format'] or os.path.splitext(options['path'])[1].lstrip('.').lower()
+        if fmt not in bulk.FORMATS:
+            raise CommandError(f"Cannot tell the format of {options['path']}; pass --format.")
+        try:
+            seller = User.objects.get(username=options['seller'])
+        except User.DoesNotExist:
+            raise CommandError(f"No user named {options['seller']!r}.")
+
+        started = time.perf_counter()
+        with open(options['path'], encoding='utf-8-sig', newline='') as stream:
+            result = bulk.import_products(seller, bulk.read_rows(stream, fmt), chunk_size=options['chunk_size'])
+        elapsed = time.perf_counter() - started
+
+        for line, message in result.errors:
+            self.stderr.write(f"line {line}: {message}")
+        if result.failed > len(result.errors):
+            self.stderr.write(f"... and {result.failed - len(result.errors)} more")
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {result.imported} products, {result.failed} rows failed, in {elapsed:.2f}s."
+        ))
@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from products import recommendations
+
+
+class Command(BaseCommand):
+    help = "Recompute the \"customers also bought\" lists from the order history; run nightly."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=recommendations.REBUILD_BATCH_SIZE, help="Products per batch.",
+        )
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+
+        def progress(done, total):
+            if options['verbosity'] > 1:
+                self.stdout.write(f"  products up to #{done} of #{total}")
+
+        changed = recommendations.rebuild(batch_size=options['batch_size'], progress=progress)
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebuilt recommendations in {time.perf_counter() - started:.2f}s; {changed} products changed."
+        ))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from products import inventory
+
+
+class Command(BaseCommand):
+    help = "Recompute Product.reserved from the checkout holds, e.g. after users were deleted."
+
+    def handle(self, *args, **options):
+        fixed = inventory.reconcile()
+        self.stdout.write(self.style.SUCCESS(f"Corrected reserved stock on {fixed} products."))
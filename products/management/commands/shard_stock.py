@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from products import inventory
+from products.catalog import bump_catalog_version
+from products.models import Product
+
+
+class Command(BaseCommand):
+    help = "Spread hot products' stock over several counters so concurrent checkouts do not queue on one row."
+
+    def add_arguments(self, parser):
+        parser.add_argument('product_ids', nargs='+', type=int)
+        parser.add_argument(
+            '--shards', type=int, required=True, help="Counters per product; 0 gathers the stock back.",
+        )
+
+    def handle(self, *args, **options):
+        if not 0 <= options['shards'] <= inventory.MAX_SHARDS:
+            raise CommandError(f"--shards must be between 0 and {inventory.MAX_SHARDS}.")
+        for product_id in options['product_ids']:
+            try:
+                inventory.shard_stock(product_id, options['shards'])
+            except Product.DoesNotExist:
+                raise CommandError(f"Product {product_id} does not exist.")
+        bump_catalog_version()
+        self.stdout.write(self.style.SUCCESS(
+            f"Sharded the stock of {len(options['product_ids'])} products over {options['shards']} counters."
+        ))
@@ -0,0 +1,131 @@
+import bisect
+import logging
+import threading
+import time
+from collections import Counter
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds (ms) of the latency histogram buckets; the last bucket is open-ended.
+BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+# An identical SQL statement run this many times in one request is reported as a likely N+1.
+DUPLICATE_QUERY_THRESHOLD = 5
+# Weight of each request's mean query time in the moving average of DB latency.
+DB_LATENCY_WEIGHT = 0.05
+# The average halves every this many seconds without requests, so it recovers after a lull.
+DB_LATENCY_HALF_LIFE = 5.0
+
+_stats_lock = threading.Lock()
+_stats = {}
+_db_latency_ms = 0.0
+_db_latency_at = 0.0
+
+
+class QueryTracker:
+    """``execute_wrapper`` that counts queries, DB time and repeated SQL for one request."""
+
+    def __init__(self):
+        self.count = 0
+        self.db_time = 0.0
+        self.statements = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - started
+            self.count += 1
+            self.statements[sql] += 1
+
+    def duplicates(self):
+        """SQL statements executed more than once, with their counts."""
+        return {sql: n for sql, n in self.statements.items() if n > 1}
+
+
+def _empty():
+    return {
+        'requests': 0,
+        'total_ms': 0.0,
+        'max_ms': 0.0,
+        'queries': 0,
+        'db_ms': 0.0,
+        'requests_with_duplicates': 0,
+        'buckets': [0] * (len(BUCKETS_MS) + 1),
+    }
+
+
+def _decayed(now):
+    return _db_latency_ms * 0.5 ** ((now - _db_latency_at) / DB_LATENCY_HALF_LIFE)
+
+
+def record(name, elapsed, tracker, db_latency=True):
+    """Add a request to the stats of ``name``; with ``db_latency`` its queries feed ``db_latency_ms``."""
+    global _db_latency_ms, _db_latency_at
+    duplicates = tracker.duplicates()
+    elapsed_ms = elapsed * 1000
+    with _stats_lock:
+        if db_latency and tracker.count:
+            now = time.monotonic()
+            query_ms = tracker.db_time * 1000 / tracker.count
+            latency = _decayed(now)
+            _db_latency_ms, _db_latency_at = latency + DB_LATENCY_WEIGHT * (query_ms - latency), now
+        entry = _stats.get(name)
+        if entry is None:
+            entry = _stats[name] = _empty()
+        entry['requests'] += 1
+        entry['total_ms'] += elapsed_ms
+        entry['max_ms'] = max(entry['max_ms'], elapsed_ms)
+        entry['queries'] += tracker.count
+        entry['db_ms'] += tracker.db_time * 1000
+        entry['requests_with_duplicates'] += bool(duplicates)
+        entry['buckets'][bisect.bisect_left(BUCKETS_MS, elapsed_ms)] += 1
+    for sql, n in duplicates.items():
+        if n >= DUPLICATE_QUERY_THRESHOLD:
+            logger.warning("%s ran the same query %d times: %s", name, n, sql)
+
+
+def _percentile(buckets, total, pct):
+    """Upper bound of the bucket holding the pct-th percentile (None past the last bound)."""
+    threshold = total * pct / 100
+    seen = 0
+    for bound, n in zip(BUCKETS_MS + (None,), buckets):
+        seen += n
+        if seen >= threshold:
+            return bound
+    return None
+
+
+def stats():
+    """Latency, query and duplicate-SQL aggregates per URL name for this process."""
+    with _stats_lock:
+        snapshot = {name: dict(entry, buckets=list(entry['buckets'])) for name, entry in _stats.items()}
+    result = {}
+    for name, entry in snapshot.items():
+        n = entry['requests']
+        result[name] = {
+            'requests': n,
+            'mean_ms': round(entry['total_ms'] / n, 2),
+            'p50_ms': _percentile(entry['buckets'], n, 50),
+            'p95_ms': _percentile(entry['buckets'], n, 95),
+            'p99_ms': _percentile(entry['buckets'], n, 99),
+            'max_ms': round(entry['max_ms'], 2),
+            'queries_per_request': round(entry['queries'] / n, 2),
+            'db_ms_per_request': round(entry['db_ms'] / n, 2),
+            'requests_with_duplicates': entry['requests_with_duplicates'],
+            'histogram': dict(zip([f'<={b}ms' for b in BUCKETS_MS] + [f'>{BUCKETS_MS[-1]}ms'], entry['buckets'])),
+        }
+    return result
+
+
+def db_latency_ms():
+    """Moving average of the mean query time of this process's recent requests, decaying while idle."""
+    with _stats_lock:
+        return _decayed(time.monotonic())
+
+
+def reset_stats():
+    global _db_latency_ms, _db_latency_at
+    with _stats_lock:
+        _stats.clear()
+        _db_latency_ms, _db_latency_at = 0.0, 0.0
@@ -0,0 +1,221 @@
+import math
+import random
+import threading
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connections
+from django.http import HttpResponse
+from rest_framework.views import APIView
+
+from . import carts, metrics, routers, throttling
+
+
+def _attach(tracker):
+    # Every alias, so queries sent to a replica are counted too.
+    for conn in connections.all():
+        conn.execute_wrappers.append(tracker)
+
+
+def _detach(tracker):
+    for conn in connections.all():
+        conn.execute_wrappers.remove(tracker)
+
+
+def _refuse(status, message, retry_after):
+    response = HttpResponse(message, status=status, content_type='text/plain; charset=utf-8')
+    response['Retry-After'] = str(max(1, math.ceil(retry_after)))
+    return response
+
+
+class AdmissionControlMiddleware:
+    """Refuse requests with a 503 before they do any work while this process is overloaded.
+
+    Overloaded means ADMISSION_MAX_IN_FLIGHT requests already in progress,
+    or queries averaging more than ADMISSION_MAX_DB_MS (``metrics.db_latency_ms``).
+    Past the latency threshold requests are refused at random, in proportion
+    to the excess, so a few still get through and bring the average back
+    down once the database recovers. Paths under ADMISSION_EXEMPT_PATHS are
+    always admitted, so the ops endpoints keep working during an incident.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def _admit(self):
+        limit = settings.ADMISSION_MAX_DB_MS
+        latency = metrics.db_latency_ms()
+        with self._lock:
+            if self.in_flight >= settings.ADMISSION_MAX_IN_FLIGHT:
+                return False
+            if latency > limit and random.random() > limit / latency:
+                return False
+            self.in_flight += 1
+            return True
+
+    def _leave(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if request.path.startswith(tuple(settings.ADMISSION_EXEMPT_PATHS)):
+            return self.get_response(request)
+        if not self._admit():
+            return _refuse(503, "The site is busy; please try again in a moment.", 1)
+        try:
+            return self.get_response(request)
+        finally:
+            self._leave()
+
+    async def __acall__(self, request):
+        if request.path.startswith(tuple(settings.ADMISSION_EXEMPT_PATHS)):
+            return await self.get_response(request)
+        if not self._admit():
+            return _refuse(503, "The site is busy; please try again in a moment.", 1)
+        try:
+            return await self.get_response(request)
+        finally:
+            self._leave()
+
+
+class RequestMetricsMiddleware:
+    """Time each request, count its queries and report both per URL name.
+
+    Adds a ``Server-Timing`` header so the numbers show up in browser dev
+    tools. Aggregates are served by the ``request_stats`` view.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        tracker = metrics.QueryTracker()
+        started = time.perf_counter()
+        _attach(tracker)
+        try:
+            response = self.get_response(request)
+        finally:
+            _detach(tracker)
+        return self._finish(request, response, tracker, time.perf_counter() - started)
+
+    async def __acall__(self, request):
+        tracker = metrics.QueryTracker()
+        started = time.perf_counter()
+        # Async ORM calls run on the request's thread-sensitive worker thread,
+        # whose connection is not the event loop's; attach the tracker there.
+        await sync_to_async(_attach)(tracker)
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(_detach)(tracker)
+        return self._finish(request, response, tracker, time.perf_counter() - started)
+
+    def _finish(self, request, response, tracker, elapsed):
+        match = request.resolver_match
+        name = match.view_name if match else '<unresolved>'
+        # Slow admin and ops pages must not make the storefront shed load.
+        exempt = request.path.startswith(tuple(settings.ADMISSION_EXEMPT_PATHS))
+        metrics.record(name, elapsed, tracker, db_latency=not exempt)
+        response['Server-Timing'] = (
+            f'db;dur={tracker.db_time * 1000:.2f};desc="{tracker.count} queries", '
+            f'total;dur={elapsed * 1000:.2f}'
+        )
+        return response
+
+
+class PrimaryPinMiddleware:
+    """Keep a client's reads on the primary for a few seconds after it writes.
+
+    See ``products.routers``: cart changes call ``routers.pin_to_primary()``
+    and this middleware carries the pin over to the client's next requests.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = routers.start_request(request)
+        return routers.finish_request(token, self.get_response(request))
+
+    async def __acall__(self, request):
+        token = routers.start_request(request)
+        return routers.finish_request(token, await self.get_response(request))
+
+
+class GuestCartMiddleware:
+    """Write a visitor's guest cart back to its cookie when a view changed it.
+
+    See ``carts.GuestCart``; views change it through ``carts.guest_cart(request)``.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return carts.save_guest_cart(request, self.get_response(request))
+
+    async def __acall__(self, request):
+        return carts.save_guest_cart(request, await self.get_response(request))
+
+
+class RateLimitMiddleware:
+    """Answer 429 to requests over their URL name's ``settings.RATE_LIMITS``.
+
+    See ``products.throttling``; API views are left to its DRF throttle.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        return await self.get_response(request)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        view_class = getattr(view_func, 'cls', None)
+        if isinstance(view_class, type) and issubclass(view_class, APIView):
+            return None
+        wait = throttling.check(request, request.resolver_match.view_name, request.user, request.POST)
+        if wait:
+            return _refuse(429, "Too many requests; please slow down.", wait)
+        return None
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.3 on 2026-10-18 05:12
+
+import products.images
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0008_product_sku'),
+    ]
+
+    operations = [
+        # Existing remote URLs are kept as image_url; image becomes the upload.
+        migrations.RenameField(
+            model_name='product',
+            old_name='image',
+            new_name='image_url',
+        ),
+        migrations.AlterField(
+            model_name='product',
+            name='image_url',
+            field=models.CharField(blank=True, default='https://t3.ftcdn.net/jpg/04/60/01/36/360_F_460013622_6xF8uN6ubMvLx0tAJECBHfKPoNOR5cRa.jpg', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='image',
+            field=models.ImageField(blank=True, max_length=255, storage=products.images.ContentAddressedStorage(), upload_to=products.images.upload_to),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='image_variants',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+    ]
@@ -2,22 +2,82 @@ from django.db import models
 from django.conf import settings # Import settings
 from django.contrib.auth.models import User
 
+from . import images
+
 class Product(models.Model):
-    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    # Lookups by user are served by product_user_name_idx.
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, db_index=False)
+    # Seller's own stock-keeping code; bulk imports upsert on (user, sku).
+    sku = models.CharField(max_length=64, null=True, blank=True)
     name = models.CharField(max_length=100)
     description = models.TextField()
     price = models.DecimalField(max_digits=10, decimal_places=2)
     stock = models.IntegerField()
-    image = models.CharField(max_length=255, default="https://t3.ftcdn.net/jpg/04/60/01/36/360_F_460013622_6xF8uN6ubMvLx0tAJECBHfKPoNOR5cRa.jpg")
+    # Units held by checkout reservations; available to sell is stock - reserved.
+    reserved = models.PositiveIntegerField(default=0, editable=False)
+    # With N > 0 the stock is spread over N StockShard rows, and ``stock`` is
+    # its total at the last rebalance plus any change made since, such as a
+    # restock; ``stock_at_rebalance`` is that total. See products.inventory.
+    stock_shards = models.PositiveSmallIntegerField(default=0, editable=False)
+    stock_at_rebalance = models.PositiveIntegerField(default=0, editable=False)
+    # Uploaded picture, stored by content hash; see products.images.
+    image = models.ImageField(upload_to=images.upload_to, storage=images.storage, max_length=255, blank=True)
+    # {'width', 'height', 'widths'} once the product_image_variants job has resized the upload.
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
+    # Remote picture for products without an upload.
+    image_url = models.CharField(max_length=255, blank=True, default="https://t3.ftcdn.net/jpg/04/60/01/36/360_F_460013622_6xF8uN6ubMvLx0tAJECBHfKPoNOR5cRa.jpg")
+    # Bumped on every save; keys the cached product card fragment.
+    version = models.PositiveIntegerField(default=1, editable=False)
+    # Last change to anything a product page shows, stock included; see products.conditional.
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    class Meta:
+        indexes = [
+            # Backs keyset pagination of the catalog on (name, id).
+            models.Index(fields=['name', 'id'], name='product_name_id_idx'),
+            # Seller's product list in admin_products, ordered by name.
+            models.Index(fields=['user', 'name'], name='product_user_name_idx'),
+        ]
+        constraints = [
+            # NULLs never conflict, so products without a SKU are unaffected.
+            models.UniqueConstraint(fields=['user', 'sku'], name='unique_product_sku_per_seller'),
+        ]
 
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        # Queryset update()s that change what a card shows bump version themselves.
+        if not self._state.adding:
+            self.version += 1
+            if kwargs.get('update_fields') is not None:
+                kwargs['update_fields'] = {*kwargs['update_fields'], 'version'}
+        super().save(*args, **kwargs)
+
+    @property
+    def image_src(self):
+        """URL of the full-size picture: the upload if there is one, else the remote URL."""
+        return self.image.url if self.image else self.image_url
+
+    @property
+    def image_sources(self):
+        return images.sources(self.image.name, self.image_variants)
+
+    @property
+    def available(self):
+        return self.stock - self.reserved
+
 class CartItem(models.Model):
-    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    # Lookups by user are served by the unique (user, product) index.
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, db_index=False)
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     quantity = models.PositiveIntegerField(default=1)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'product'], name='unique_cart_item_per_user_product'),
+        ]
+
     def total_price(self):
         return self.product.price * self.quantity
 
@@ -25,8 +85,54 @@ class CartItem(models.Model):
         return f"{self.quantity} x {self.product.name} for {self.user.username}"
 
 
+class Reservation(models.Model):
+    """Stock held for a buyer between entering checkout and placing the order.
+
+    Product.reserved is the sum of quantity over a product's reservations;
+    see products.inventory, the only code that should write either.
+    """
+    # Lookups by user are served by the unique (user, product) index.
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, db_index=False)
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, db_index=False)
+    quantity = models.PositiveIntegerField()
+    expires_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'product'], name='unique_reservation_per_user_product'),
+        ]
+        indexes = [
+            # Expiry sweeps, across all products or only the contended ones.
+            models.Index(fields=['expires_at'], name='reservation_expires_idx'),
+            models.Index(fields=['product', 'expires_at'], name='reservation_product_exp_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.quantity} x {self.product_id} held for {self.user_id} until {self.expires_at:%H:%M:%S}"
+
+
+class StockShard(models.Model):
+    """One of a hot product's stock counters, so concurrent checkouts update different rows.
+
+    See products.inventory, the only code that should write these.
+    """
+    # Lookups by product are served by the unique (product, index) index.
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, db_index=False, related_name='+')
+    index = models.PositiveSmallIntegerField()
+    stock = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'index'], name='unique_stock_shard_per_product'),
+        ]
+
+    def __str__(self):
+        return f"{self.stock} of {self.product_id} in shard {self.index}"
+
+
 class Order(models.Model):
-    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    # Lookups by user are served by order_user_created_idx.
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, db_index=False)
     created_at = models.DateTimeField(auto_now_add=True)
     total_price = models.DecimalField(max_digits=10, decimal_places=2, default=0.00)
     
@@ -38,12 +144,20 @@ class Order(models.Model):
     shipping_country = models.CharField(max_length=100, null=True, blank=True)
     payment_method = models.CharField(max_length=50, null=True, blank=True)
 
+    class Meta:
+        indexes = [
+            # Trailing -id matches order_history's tiebreaker, avoiding a sort step.
+            models.Index(fields=['user', '-created_at', '-id'], name='order_user_created_id_idx'),
+        ]
+
     def __str__(self):
         return f"Order {self.id} by {self.user.username} on {self.created_at.strftime('%Y-%m-%d %H:%M')}"
 
 class OrderItem(models.Model):
     order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='items')
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
+    # Snapshot of Product.name at checkout so order history never joins Product.
+    product_name = models.CharField(max_length=100, blank=True, default='')
     quantity = models.PositiveIntegerField()
     price_at_purchase = models.DecimalField(max_digits=10, decimal_places=2)
 
@@ -51,4 +165,53 @@ class OrderItem(models.Model):
         return self.quantity * self.price_at_purchase
 
     def __str__(self):
-        return f"{self.quantity} x {self.product.name} in Order {self.order.id}"
\ No newline at end of file
+        return f"{self.quantity} x {self.product_name} in Order {self.order_id}"
+
+class DailyProductSales(models.Model):
+    """One product's sales on one day, kept current by checkout.
+
+    Reports aggregate these rows instead of OrderItem; see products.analytics,
+    the only code that should write them.
+    """
+    day = models.DateField()
+    # Lookups by product are served by the unique (product, day) index.
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, db_index=False)
+    # Product.user at the time of sale, so per-seller reports never join Product.
+    seller = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, db_index=False)
+    orders = models.PositiveIntegerField(default=0)
+    units = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'day'], name='unique_daily_sales_per_product_day'),
+        ]
+        indexes = [
+            # A seller's dashboard over a date range.
+            models.Index(fields=['seller', 'day'], name='daily_sales_seller_day_idx'),
+            # Store-wide reports over a date range.
+            models.Index(fields=['day'], name='daily_sales_day_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.units} x {self.product_id} on {self.day}"
+
+
+class ProductRecommendation(models.Model):
+    """A product bought together with ``product``: one of its top neighbours.
+
+    ``score`` is the number of orders containing both. See
+    products.recommendations, the only code that should write these.
+    """
+    # Lookups by product are served by the unique (product, recommended) index.
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, db_index=False, related_name='+')
+    recommended = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+')
+    score = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'recommended'], name='unique_recommendation_per_pair'),
+        ]
+
+    def __str__(self):
+        return f"{self.recommended_id} for {self.product_id} ({self.score})"
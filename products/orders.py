@@ -0,0 +1,43 @@
+from django.core.paginator import Paginator
+from django.db.models import Prefetch
+
+from .models import Order, OrderItem
+
+ORDERS_PER_PAGE = 10
+# Page links shown either side of the current page, and at each end, before eliding the rest.
+PAGE_LINKS_AROUND = 2
+PAGE_LINKS_AT_ENDS = 1
+
+
+def history_items():
+    return OrderItem.objects.only('order_id', 'product_name', 'quantity', 'price_at_purchase')
+
+
+def history(user):
+    """The user's orders, newest first, with their items prefetched in one query."""
+    return (
+        Order.objects.filter(user=user)
+        .order_by('-created_at', '-id')
+        .prefetch_related(Prefetch('items', queryset=history_items()))
+    )
+
+
+def _with_page_links(page):
+    # A fixed-size window such as 1 … 4 5 [6] 7 8 … 40, however many pages there are.
+    page.page_links = list(page.paginator.get_elided_page_range(
+        page.number, on_each_side=PAGE_LINKS_AROUND, on_ends=PAGE_LINKS_AT_ENDS,
+    ))
+    return page
+
+
+def history_page(user, number):
+    return _with_page_links(Paginator(history(user), ORDERS_PER_PAGE).get_page(number))
+
+
+async def ahistory_page(user, number):
+    paginator = Paginator(history(user), ORDERS_PER_PAGE)
+    # Prime the cached count so get_page() does not run a blocking COUNT.
+    paginator.count = await paginator.object_list.acount()
+    page = paginator.get_page(number)
+    page.object_list = [order async for order in page.object_list]
+    return _with_page_links(page)
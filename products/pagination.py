@@ -0,0 +1,13 @@
+from rest_framework.pagination import CursorPagination
+
+
+class IdCursorPagination(CursorPagination):
+    ordering = '-id'
+
+
+class ProductCursorPagination(CursorPagination):
+    ordering = ('name', 'id')
+
+
+class OrderCursorPagination(CursorPagination):
+    ordering = ('-created_at', '-id')
@@ -0,0 +1,91 @@
+from django.contrib.auth.models import User
+from django.db import DEFAULT_DB_ALIAS, connection
+from django.db.models.sql import UpdateQuery
+
+from . import analytics, carts, catalog, checkout, inventory, orders, recommendations, search
+from .models import Product, CartItem
+from .orders import ORDERS_PER_PAGE
+
+
+def update_sql(update):
+    """``(sql, params)`` of a ``(queryset, values)`` UPDATE as the inventory builders return it."""
+    queryset, values = update
+    query = queryset.query.chain(UpdateQuery)
+    query.add_update_values(values)
+    return query.get_compiler(DEFAULT_DB_ALIAS).as_sql()
+
+
+def audited_querysets(user=None, product=None):
+    """The queries the storefront views run, keyed by a descriptive name.
+
+    Each is a queryset or, for raw SQL and UPDATEs, an ``(sql, params)``
+    pair, built by the same functions the views call. Unsaved placeholder
+    instances are fine: only the SQL is inspected.
+    """
+    user = user or User(pk=1, username='audit')
+    product = product or Product(pk=1, name='audit', user=user)
+    cursor = catalog.encode_cursor(product)
+    queries = {
+        'catalog first page': catalog.page_queryset(),
+        'catalog next page': catalog.page_queryset(after=cursor),
+        'catalog previous page': catalog.page_queryset(before=cursor),
+        'product detail': Product.objects.filter(pk=product.pk),
+        'product recommendations': recommendations.neighbours(product.pk),
+        'stock shard totals': inventory.shard_totals([product.pk]),
+        'add to cart lookup': CartItem.objects.filter(user=user, product=product),
+        'cart lines': carts.lines(user),
+        'cart summary': carts.summary_queryset(user.pk),
+        'stock available': inventory.available_queryset([product.pk]),
+        'held stock': inventory.holds(user),
+        'reservation release': inventory.expired_holds([product.pk]),
+        'checkout cart fetch': checkout.cart_queryset(user),
+        'checkout stock update': update_sql(inventory.stock_update({product.pk: 1})),
+        'checkout stock update from hold': update_sql(inventory.stock_update({product.pk: 2}, {product.pk: 1})),
+        'checkout shard update': update_sql(inventory.shard_update(product.pk, 0, 1)),
+        'checkout sibling shards': inventory.nonempty_shards(product.pk),
+        'order history page': orders.history(user)[:ORDERS_PER_PAGE],
+        'order history items': orders.history_items().filter(order_id__in=[1, 2, 3]),
+        'seller products': Product.objects.filter(user=user).order_by('name'),
+        'seller sales report': analytics.rollups(user, *analytics.period(30)),
+        'store sales report': analytics.rollups(None, *analytics.period(30)),
+    }
+    if search.fts5_available():
+        queries['search'] = search.FTS5Backend().query(search.tokenize('audit'), {'price__gte': 1, 'stock__gt': 0})
+    return queries
+
+
+def explain(query):
+    """Return the query plan lines for a queryset or ``(sql, params)`` on the default database."""
+    if not isinstance(query, tuple):
+        return query.explain().splitlines()
+    sql, params = query
+    with connection.cursor() as cursor:
+        cursor.execute(f'{connection.ops.explain_query_prefix()} {sql}', params)
+        rows = cursor.fetchall()
+    if connection.vendor == 'sqlite':
+        # Same rendering as QuerySet.explain(): one "id parent notused detail" row per step.
+        return [' '.join(str(column) for column in row) for row in rows]
+    return [row[0] for row in rows]
+
+
+def full_scans(plan):
+    """Plan lines that read a whole table rather than seeking an index."""
+    if connection.vendor == 'sqlite':
+        scans = []
+        for line in plan:
+            _, found, target = line.partition('SCAN ')
+            # "SCAN (subquery-N)" walks an intermediate result, not a table, and an
+            # FTS5 MATCH shows as a VIRTUAL TABLE INDEX scan of its own index.
+            if (
+                found and 'USING' not in target and 'VIRTUAL TABLE INDEX' not in target
+                and not target.startswith(('(', 'CONSTANT ROW'))
+            ):
+                scans.append(line)
+        return scans
+    if connection.vendor == 'postgresql':
+        return [line for line in plan if 'Seq Scan' in line]
+    return []
+
+
+def temp_sorts(plan):
+    return [line for line in plan if 'TEMP B-TREE' in line or 'Sort  (' in line]
@@ -0,0 +1,172 @@
+"""Customers also bought: the products most often ordered together.
+
+For each product, ProductRecommendation keeps its TOP_K neighbours, scored
+by the number of orders containing both, so the product page reads them
+with one lookup on the (product, recommended) index.
+
+``rebuild`` recomputes every list from OrderItem: a self-join on order
+counts each pair of products and a window function keeps each product's
+best TOP_K, batch by batch of products, all inside the database. Between
+rebuilds checkout calls ``record_order``, which raises the scores of pairs
+already listed and fills lists with room to spare; a pair that would have
+to push a listed neighbour out waits for the next rebuild, as its full
+count is not stored anywhere else.
+
+Recommendations are part of the product page, so changing a product's list
+also moves its ``updated_at``; checkout's stock UPDATE already does that
+for the products in the order.
+"""
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import F, Max, Window
+from django.db.models.functions import RowNumber
+from django.utils import timezone
+
+from . import caching, catalog
+from .catalog import bump_catalog_version
+from .models import OrderItem, Product, ProductRecommendation
+
+TOP_K = 8
+# Shown on the product page; one row of cards.
+SHOWN = 3
+REBUILD_BATCH_SIZE = 1000
+
+_NEIGHBOURS_SQL = """
+    SELECT product_id, recommended_id, score FROM (
+        SELECT a.product_id, b.product_id AS recommended_id, COUNT(*) AS score,
+               ROW_NUMBER() OVER (PARTITION BY a.product_id ORDER BY COUNT(*) DESC, b.product_id) AS position
+        FROM {items} a JOIN {items} b ON b.order_id = a.order_id AND b.product_id <> a.product_id
+        WHERE a.product_id > %s AND a.product_id <= %s
+        GROUP BY a.product_id, b.product_id
+    ) ranked
+    WHERE position <= %s
+"""
+
+# Every ordered pair of distinct products in one order, at score 0.
+_PAIRS_SQL = """
+    INSERT INTO {table} (product_id, recommended_id, score)
+    SELECT a.product_id, b.product_id, 0
+    FROM {items} a JOIN {items} b ON b.order_id = a.order_id AND b.product_id <> a.product_id
+    WHERE a.order_id = %s
+    ON CONFLICT DO NOTHING
+"""
+
+
+def _ranked(product_ids):
+    # Ties go to the older row: pairs new in this order score 1, and must not
+    # push out a listed neighbour on 1.
+    return ProductRecommendation.objects.filter(product_id__in=product_ids).annotate(position=Window(
+        RowNumber(), partition_by=F('product_id'), order_by=(F('score').desc(), F('pk').asc()),
+    ))
+
+
+def record_order(order_id, product_ids):
+    """Count the products of an order as bought together; call in its transaction, after its lines are written.
+
+    Three statements for any number of lines: the new pairs are inserted by
+    one INSERT ... SELECT over the order's own lines.
+    """
+    if len(set(product_ids)) < 2:
+        return
+    items = OrderItem._meta.db_table
+    with connection.cursor() as cursor:
+        cursor.execute(_PAIRS_SQL.format(table=ProductRecommendation._meta.db_table, items=items), [order_id])
+    ProductRecommendation.objects.filter(product_id__in=product_ids, recommended_id__in=product_ids).update(
+        score=F('score') + 1,
+    )
+    ProductRecommendation.objects.filter(
+        pk__in=_ranked(product_ids).filter(position__gt=TOP_K).values('pk'),
+    ).delete()
+
+
+def _neighbours(start, end):
+    """``{product_id: [(recommended_id, score)]}`` for products ``start < pk <= end``, best first."""
+    sql = _NEIGHBOURS_SQL.format(items=OrderItem._meta.db_table)
+    lists = {}
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [start, end, TOP_K])
+        for product_id, recommended_id, score in cursor.fetchall():
+            lists.setdefault(product_id, []).append((recommended_id, score))
+    for neighbours in lists.values():
+        neighbours.sort(key=lambda pair: (-pair[1], pair[0]))
+    return lists
+
+
+def rebuild(batch_size=REBUILD_BATCH_SIZE, progress=None):
+    """Recompute every product's list from the order history; returns how many lists changed.
+
+    Each batch of ``batch_size`` product ids is computed and replaced in
+    one transaction, so checkouts never see a half-written list.
+    """
+    last_id = Product.objects.aggregate(last=Max('pk'))['last'] or 0
+    changed = 0
+    for start in range(0, last_id, batch_size):
+        end = start + batch_size
+        with transaction.atomic():
+            stored = {}
+            for product_id, recommended_id, score in (
+                ProductRecommendation.objects.filter(product_id__gt=start, product_id__lte=end)
+                .order_by('product_id', '-score', 'recommended_id')
+                .values_list('product_id', 'recommended_id', 'score')
+            ):
+                stored.setdefault(product_id, []).append((recommended_id, score))
+            lists = _neighbours(start, end)
+            stale = [pk for pk in stored.keys() | lists.keys() if stored.get(pk) != lists.get(pk)]
+            if stale:
+                ProductRecommendation.objects.filter(product_id__in=stale).delete()
+                ProductRecommendation.objects.bulk_create([
+                    ProductRecommendation(product_id=pk, recommended_id=recommended_id, score=score)
+                    for pk in stale for recommended_id, score in lists.get(pk, ())
+                ])
+                Product.objects.filter(pk__in=stale).update(updated_at=timezone.now())
+                changed += len(stale)
+        if progress:
+            progress(min(end, last_id), last_id)
+    if changed:
+        bump_catalog_version()
+    return changed
+
+
+def neighbours(pk, limit=SHOWN):
+    """ProductRecommendation rows of product ``pk`` with their products, best first."""
+    return (
+        ProductRecommendation.objects.filter(product_id=pk)
+        .select_related('recommended')
+        .order_by('-score', 'recommended_id')[:limit]
+    )
+
+
+def for_product(pk, limit=SHOWN):
+    """Up to ``limit`` products most often bought with product ``pk``, best first."""
+    return [recommendation.recommended for recommendation in neighbours(pk, limit)]
+
+
+async def afor_product(pk, limit=SHOWN):
+    return [recommendation.recommended async for recommendation in neighbours(pk, limit)]
+
+
+def neighbours_modified(pk, limit=SHOWN):
+    """Newest ``updated_at`` of the products ``for_product`` shows, or None; for the page's validators.
+
+    One aggregate, cached under the catalog version like ``catalog.product_modified``.
+    """
+    key = caching.make_key(catalog.NAMESPACE, 'neighbours_modified', pk, limit)
+    return caching.get_or_set(
+        catalog.NAMESPACE, key,
+        lambda: neighbours(pk, limit).aggregate(modified=Max('recommended__updated_at'))['modified'],
+        catalog.PRODUCT_CACHE_TIMEOUT,
+    )
+
+
+async def aneighbours_modified(pk, limit=SHOWN):
+    key = await caching.amake_key(catalog.NAMESPACE, 'neighbours_modified', pk, limit)
+
+    async def modified():
+        return (await neighbours(pk, limit).aaggregate(modified=Max('recommended__updated_at')))['modified']
+
+    return await caching.aget_or_set(catalog.NAMESPACE, key, modified, catalog.PRODUCT_CACHE_TIMEOUT)
+
+
+def invalidate_neighbours_modified(pks):
+    """Drop the cached neighbours_modified() of ``pks``, as catalog.invalidate_products does for the products."""
+    cache.delete_many([caching.make_key(catalog.NAMESPACE, 'neighbours_modified', pk, SHOWN) for pk in pks])
@@ -0,0 +1,96 @@
+"""Send storefront reads to the replicas and everything else to the primary.
+
+Only the models listed in REPLICA_MODELS are read from a replica; sessions,
+users, reservations and the job queue always use the primary, where a
+moment of replication lag would log someone out or double-claim a job.
+Writes, migrations and anything read inside a transaction on the primary
+(checkout, stock reservation) go to the primary too, so a transaction
+always sees its own writes.
+
+A replica can lag the primary, so a client that has just changed its cart
+or placed an order is pinned to the primary for PIN_SECONDS: the
+``PrimaryPinMiddleware`` remembers the pin in a cookie and applies it to the
+client's following requests.
+"""
+import random
+import time
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+REPLICA_MODELS = frozenset({
+    'products.product',
+    'products.cartitem',
+    'products.order',
+    'products.orderitem',
+    'products.dailyproductsales',
+    'products.stockshard',
+})
+
+# Comfortably longer than normal replication lag.
+PIN_SECONDS = 5
+PIN_COOKIE = 'primary_until'
+
+
+class _Pin:
+    def __init__(self, until=0.0):
+        self.until = until
+        self.renewed = False
+
+
+_pin = ContextVar('primary_pin', default=None)
+
+
+def start_request(request):
+    """Set up pinning for a request from its cookie; returns the token for ``finish_request``."""
+    try:
+        until = float(request.COOKIES.get(PIN_COOKIE, 0))
+    except ValueError:
+        until = 0.0
+    return _pin.set(_Pin(until))
+
+
+def finish_request(token, response):
+    """Forget the request's pin, passing a renewed one on to the client."""
+    pin = _pin.get()
+    _pin.reset(token)
+    if pin.renewed:
+        response.set_cookie(PIN_COOKIE, f'{pin.until:.3f}', max_age=PIN_SECONDS, httponly=True, samesite='Lax')
+    return response
+
+
+def pin_to_primary():
+    """Read from the primary for the rest of this request and the client's next PIN_SECONDS."""
+    pin = _pin.get()
+    if pin is not None:
+        pin.until = time.time() + PIN_SECONDS
+        pin.renewed = True
+
+
+def pinned():
+    pin = _pin.get()
+    return pin is not None and pin.until > time.time()
+
+
+class PrimaryReplicaRouter:
+    def db_for_read(self, model, **hints):
+        replicas = settings.DATABASE_REPLICAS
+        if (
+            not replicas
+            or model._meta.label_lower not in REPLICA_MODELS
+            or connections[DEFAULT_DB_ALIAS].in_atomic_block
+            or pinned()
+        ):
+            return DEFAULT_DB_ALIAS
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary.
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
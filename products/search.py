@@ -0,0 +1,278 @@
+import bisect
+import math
+import re
+import threading
+from collections import defaultdict
+
+from django.db import connection, transaction
+
+from .models import Product
+
+PAGE_SIZE = 12
+REBUILD_BATCH_SIZE = 5000
+FTS_TABLE = 'products_product_fts'
+
+# Relative weight of a match in the name versus the description.
+NAME_WEIGHT = 10.0
+DESCRIPTION_WEIGHT = 1.0
+# Matches ranked per query, newest first after the filters, so a common word
+# costs no more than a rare one. Pages beyond this many results are empty.
+SEARCH_CANDIDATES = 500
+
+TOKEN_RE = re.compile(r'\w+')
+
+
+def tokenize(text):
+    return TOKEN_RE.findall(text.lower())
+
+
+def _rank(candidates, tokens):
+    # Every candidate matches every token in its name or its description.
+    def score(name):
+        words = tokenize(name)
+        return sum(
+            NAME_WEIGHT if any(word.startswith(token) for word in words) else DESCRIPTION_WEIGHT for token in tokens
+        )
+
+    scores = {pk: score(name) for pk, name in candidates}
+    return sorted(scores, key=lambda pk: (-scores[pk], pk))
+
+
+class SearchResults:
+    def __init__(self, products, page, has_next):
+        self.products = products
+        self.number = page
+        self.has_next = has_next
+        self.has_previous = page > 1
+
+    @property
+    def next_page_number(self):
+        return self.number + 1
+
+    @property
+    def previous_page_number(self):
+        return self.number - 1
+
+    def __iter__(self):
+        return iter(self.products)
+
+    def __len__(self):
+        return len(self.products)
+
+
+class FTS5Backend:
+    """Search backed by an SQLite FTS5 virtual table keyed by product id."""
+
+    def index(self, products):
+        rows = [(p.pk, p.name, p.description) for p in products]
+        if not rows:
+            return
+        with connection.cursor() as cursor:
+            cursor.executemany(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [(row[0],) for row in rows])
+            cursor.executemany(f'INSERT INTO {FTS_TABLE} (rowid, name, description) VALUES (%s, %s, %s)', rows)
+
+    def remove(self, pks):
+        with connection.cursor() as cursor:
+            cursor.executemany(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [(pk,) for pk in pks])
+
+    def rebuild(self, batch_size=REBUILD_BATCH_SIZE):
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE}')
+            batch = []
+            for row in Product.objects.values_list('pk', 'name', 'description').iterator(chunk_size=batch_size):
+                batch.append(row)
+                if len(batch) >= batch_size:
+                    cursor.executemany(f'INSERT INTO {FTS_TABLE} (rowid, name, description) VALUES (%s, %s, %s)', batch)
+                    batch = []
+            if batch:
+                cursor.executemany(f'INSERT INTO {FTS_TABLE} (rowid, name, description) VALUES (%s, %s, %s)', batch)
+            cursor.execute(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('optimize')")
+
+    def query(self, tokens, filters):
+        """The candidates query as ``(sql, params)``: ``(id, name)`` of the newest matches."""
+        table = Product._meta.db_table
+        sql = [
+            f'SELECT p.id, p.name FROM {FTS_TABLE} JOIN {table} p ON p.id = {FTS_TABLE}.rowid',
+            f'WHERE {FTS_TABLE} MATCH %s',
+        ]
+        # Tokens are \w+ only, so quoting them cannot break the MATCH syntax.
+        params = [' '.join(f'"{token}"*' for token in tokens)]
+        if 'price__gte' in filters:
+            sql.append('AND p.price >= %s')
+            params.append(filters['price__gte'])
+        if 'price__lte' in filters:
+            sql.append('AND p.price <= %s')
+            params.append(filters['price__lte'])
+        if 'stock__gt' in filters:
+            sql.append('AND p.stock > %s')
+            params.append(filters['stock__gt'])
+        # FTS5 walks rowids in either direction, so this stops at the cap
+        # instead of scoring and sorting every match as bm25() would.
+        sql.append(f'ORDER BY {FTS_TABLE}.rowid DESC LIMIT %s')
+        params.append(SEARCH_CANDIDATES)
+        return ' '.join(sql), params
+
+    def search(self, tokens, filters, offset, limit):
+        with connection.cursor() as cursor:
+            cursor.execute(*self.query(tokens, filters))
+            candidates = cursor.fetchall()
+        return _rank(candidates, tokens)[offset:offset + limit]
+
+
+class InvertedIndexBackend:
+    """In-process inverted index used when FTS5 is not available.
+
+    The index is built lazily on first use and kept current by the same
+    signals that maintain the FTS5 table; each process holds its own copy.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._postings = defaultdict(dict)
+        self._documents = {}
+        self._terms = []
+        self._terms_dirty = False
+        self._built = False
+
+    def _add(self, pk, name, description):
+        weights = defaultdict(float)
+        for token in tokenize(name):
+            weights[token] += NAME_WEIGHT
+        for token in tokenize(description):
+            weights[token] += DESCRIPTION_WEIGHT
+        for token, weight in weights.items():
+            if token not in self._postings:
+                self._terms_dirty = True
+            self._postings[token][pk] = weight
+        self._documents[pk] = list(weights)
+
+    def _discard(self, pk):
+        for token in self._documents.pop(pk, ()):
+            postings = self._postings[token]
+            postings.pop(pk, None)
+            if not postings:
+                del self._postings[token]
+                self._terms_dirty = True
+
+    def _ensure_built(self):
+        if not self._built:
+            self.rebuild()
+
+    def index(self, products):
+        with self._lock:
+            if not self._built:
+                return
+            for product in products:
+                self._discard(product.pk)
+                self._add(product.pk, product.name, product.description)
+
+    def remove(self, pks):
+        with self._lock:
+            for pk in pks:
+                self._discard(pk)
+
+    def rebuild(self, batch_size=REBUILD_BATCH_SIZE):
+        with self._lock:
+            self._postings.clear()
+            self._documents.clear()
+            for pk, name, description in Product.objects.values_list('pk', 'name', 'description').iterator(chunk_size=batch_size):
+                self._add(pk, name, description)
+            self._terms = sorted(self._postings)
+            self._terms_dirty = False
+            self._built = True
+
+    def _expand(self, prefix):
+        if self._terms_dirty:
+            self._terms = sorted(self._postings)
+            self._terms_dirty = False
+        start = bisect.bisect_left(self._terms, prefix)
+        end = bisect.bisect_left(self._terms, prefix + '\uffff')
+        return self._terms[start:end]
+
+    def search(self, tokens, filters, offset, limit):
+        with self._lock:
+            self._ensure_built()
+            total = len(self._documents) or 1
+            scores = None
+            for token in tokens:
+                matched = {}
+                for term in self._expand(token):
+                    postings = self._postings[term]
+                    idf = math.log(1 + total / len(postings))
+                    for pk, weight in postings.items():
+                        matched[pk] = max(matched.get(pk, 0.0), weight * idf)
+                if scores is None:
+                    scores = matched
+                else:
+                    scores = {pk: score + matched[pk] for pk, score in scores.items() if pk in matched}
+                if not scores:
+                    return []
+        # The same candidates as FTS5Backend: the newest matches that pass the
+        # filters, checked a batch at a time.
+        newest = sorted(scores, reverse=True)
+        candidates = []
+        for start in range(0, len(newest), SEARCH_CANDIDATES):
+            batch = newest[start:start + SEARCH_CANDIDATES]
+            if filters:
+                allowed = set(Product.objects.filter(pk__in=batch, **filters).values_list('pk', flat=True))
+                batch = [pk for pk in batch if pk in allowed]
+            candidates += batch[:SEARCH_CANDIDATES - len(candidates)]
+            if len(candidates) == SEARCH_CANDIDATES:
+                break
+        return sorted(candidates, key=lambda pk: (-scores[pk], pk))[offset:offset + limit]
+
+
+_fallback = InvertedIndexBackend()
+_fts5_tables = {}
+
+
+def fts5_available():
+    if connection.vendor != 'sqlite':
+        return False
+    key = (connection.alias, str(connection.settings_dict['NAME']))
+    if key not in _fts5_tables:
+        _fts5_tables[key] = FTS_TABLE in connection.introspection.table_names()
+    return _fts5_tables[key]
+
+
+def get_backend():
+    return FTS5Backend() if fts5_available() else _fallback
+
+
+def index_products(products):
+    get_backend().index(products)
+
+
+def remove_products(pks):
+    get_backend().remove(pks)
+
+
+def rebuild_index(batch_size=REBUILD_BATCH_SIZE):
+    get_backend().rebuild(batch_size=batch_size)
+
+
+def search(query, min_price=None, max_price=None, in_stock=False, page=1, page_size=PAGE_SIZE):
+    """Rank products matching every word of ``query`` (prefix match).
+
+    Name matches outrank description matches. Only the newest
+    SEARCH_CANDIDATES matches that pass the filters are ranked. Results are paginated by
+    page number; one extra id is fetched to know whether a next page exists.
+    """
+    tokens = tokenize(query)
+    if not tokens:
+        return SearchResults([], page=1, has_next=False)
+
+    filters = {}
+    if min_price is not None:
+        filters['price__gte'] = min_price
+    if max_price is not None:
+        filters['price__lte'] = max_price
+    if in_stock:
+        filters['stock__gt'] = 0
+
+    page = max(page, 1)
+    pks = get_backend().search(tokens, filters, offset=(page - 1) * page_size, limit=page_size + 1)
+    has_next = len(pks) > page_size
+    pks = pks[:page_size]
+    products = Product.objects.in_bulk(pks)
+    return SearchResults([products[pk] for pk in pks if pk in products], page=page, has_next=has_next)
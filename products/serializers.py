@@ -0,0 +1,91 @@
+from rest_framework import serializers
+
+from . import carts
+from .models import Product, CartItem, Order, OrderItem
+
+PRODUCT_LIST_FIELDS = ('id', 'name', 'price', 'stock', 'image')
+# Columns the list fields are computed from; ``image`` falls back to ``image_url``,
+# and ``stock`` of a sharded product is corrected by catalog.with_shard_stock.
+PRODUCT_LIST_COLUMNS = PRODUCT_LIST_FIELDS + ('image_url', 'stock_shards', 'stock_at_rebalance')
+
+
+class ProductListSerializer(serializers.ModelSerializer):
+    image = serializers.CharField(source='image_src', read_only=True)
+
+    class Meta:
+        model = Product
+        fields = PRODUCT_LIST_FIELDS
+        read_only_fields = fields
+
+
+class ProductDetailSerializer(serializers.ModelSerializer):
+    image = serializers.CharField(source='image_src', read_only=True)
+
+    class Meta:
+        model = Product
+        fields = PRODUCT_LIST_FIELDS + ('description',)
+        read_only_fields = fields
+
+
+class CartItemSerializer(serializers.ModelSerializer):
+    product = ProductListSerializer(read_only=True)
+    product_id = serializers.PrimaryKeyRelatedField(
+        source='product', write_only=True,
+        queryset=Product.objects.only(*PRODUCT_LIST_COLUMNS),
+    )
+    quantity = serializers.IntegerField(min_value=1, default=1)
+    line_total = serializers.SerializerMethodField()
+
+    class Meta:
+        model = CartItem
+        fields = ('id', 'product', 'product_id', 'quantity', 'line_total')
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if self.instance is not None:
+            # A line's product is fixed; PUT only needs the quantity.
+            self.fields['product_id'].required = False
+
+    def validate(self, attrs):
+        if self.instance is not None and 'product' in attrs and attrs['product'].pk != self.instance.product_id:
+            raise serializers.ValidationError(
+                {'product_id': "A cart line's product cannot be changed; remove the line and add the product."}
+            )
+        return attrs
+
+    def get_line_total(self, item):
+        return str(item.total_price())
+
+    def create(self, validated_data):
+        try:
+            return carts.add_item(self.context['request'].user, validated_data['product'], validated_data.get('quantity', 1))
+        except carts.OutOfStockError as e:
+            raise serializers.ValidationError({'quantity': str(e)})
+
+    def update(self, instance, validated_data):
+        try:
+            return carts.set_quantity(instance, validated_data.get('quantity', instance.quantity))
+        except carts.OutOfStockError as e:
+            raise serializers.ValidationError({'quantity': str(e)})
+
+
+class OrderItemSerializer(serializers.ModelSerializer):
+    product_id = serializers.IntegerField(read_only=True)
+    subtotal = serializers.DecimalField(max_digits=12, decimal_places=2, read_only=True)
+
+    class Meta:
+        model = OrderItem
+        fields = ('product_id', 'product_name', 'quantity', 'price_at_purchase', 'subtotal')
+        read_only_fields = fields
+
+
+class OrderSerializer(serializers.ModelSerializer):
+    items = OrderItemSerializer(many=True, read_only=True)
+
+    class Meta:
+        model = Order
+        fields = (
+            'id', 'created_at', 'total_price', 'shipping_address', 'shipping_city', 'shipping_state',
+            'shipping_postal_code', 'shipping_country', 'payment_method', 'items',
+        )
+        read_only_fields = fields
@@ -0,0 +1,40 @@
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from jobs.queue import enqueue
+
+from . import carts, search
+from .catalog import bump_catalog_version
+from .models import Product
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def invalidate_catalog(sender, **kwargs):
+    bump_catalog_version()
+    # The navbar cart totals use the price; deletes drop cart lines.
+    carts.bump_prices_version()
+
+
+@receiver(post_save, sender=Product)
+def index_product(sender, instance, **kwargs):
+    search.index_products([instance])
+
+
+@receiver(post_delete, sender=Product)
+def unindex_product(sender, instance, **kwargs):
+    search.remove_products([instance.pk])
+
+
+@receiver(pre_save, sender=Product)
+def reset_image_variants(sender, instance, **kwargs):
+    # A new upload is still uncommitted here; it is written to storage during save().
+    instance._image_uploaded = bool(instance.image) and not instance.image._committed
+    if instance._image_uploaded or not instance.image:
+        instance.image_variants = {}
+
+
+@receiver(post_save, sender=Product)
+def queue_image_variants(sender, instance, **kwargs):
+    if instance.__dict__.pop('_image_uploaded', False):
+        enqueue('product_image_variants', {'name': instance.image.name})
@@ -0,0 +1,57 @@
+from django.core.mail import send_mail
+from django.db.models import F
+from django.utils import timezone
+
+from jobs.queue import enqueue_unique, task
+
+from . import images, inventory
+from .catalog import bump_catalog_version
+from .models import Order, Product, Reservation
+
+
+@task('order_placed')
+def order_placed(order_id):
+    """Email the buyer a confirmation of their order."""
+    order = Order.objects.select_related('user').prefetch_related('items').get(pk=order_id)
+    if not order.user.email:
+        return
+    lines = [f"{item.quantity} x {item.product_name} @ {item.price_at_purchase}" for item in order.items.all()]
+    send_mail(
+        f"Order #{order.pk} confirmed",
+        "\n".join([f"Thanks for your order, {order.user.username}!", "", *lines, "", f"Total: {order.total_price}"]),
+        None,
+        [order.user.email],
+    )
+
+
+@task('product_image_variants')
+def product_image_variants(name):
+    """Resize an uploaded image and let every product using it serve the variants."""
+    variants = images.generate_variants(name)
+    if Product.objects.filter(image=name).update(
+        image_variants=variants, version=F('version') + 1, updated_at=timezone.now(),
+    ):
+        # update() skips post_save, so invalidate cached catalog pages here.
+        bump_catalog_version()
+
+
+@task('release_expired_reservations')
+def release_expired_reservations():
+    """Return expired checkout holds to available stock, then schedule the next sweep."""
+    while inventory.release_expired():
+        pass
+    next_expiry = Reservation.objects.order_by('expires_at').values_list('expires_at', flat=True).first()
+    if next_expiry is not None:
+        enqueue_unique(
+            'release_expired_reservations', delay=max(0, (next_expiry - timezone.now()).total_seconds()),
+        )
+
+
+@task('rebalance_stock_shards')
+def rebalance_stock_shards():
+    """Even out sharded products' stock counters, then schedule the next run while any are sharded."""
+    if inventory.rebalance():
+        # update() skips post_save, so invalidate cached catalog pages here.
+        bump_catalog_version()
+    if Product.objects.filter(stock_shards__gt=0).exists():
+        enqueue_unique('rebalance_stock_shards', delay=inventory.REBALANCE_SECONDS)
@@ -1,3 +1,1974 @@
-from django.test import TestCase
+import glob
+import os
+import random
+import socketserver
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from decimal import Decimal
+from io import BytesIO, StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.cache.utils import make_template_fragment_key
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import IntegrityError, OperationalError, connection, connections, transaction
+from django.db.models import F
+from django.template.loader import render_to_string
+from django.test import AsyncClient, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.http import http_date
+from PIL import Image
+from rest_framework.test import APIClient
+
+from jobs import queue
+from jobs.models import Job
+
+from . import (
+    analytics, bulk, caching, carts, catalog, images, inventory, metrics, query_audit, recommendations, routers,
+    search, throttling,
+)
+from .cache_backends import RespCache
+from .checkout import place_order, reserve_cart, EmptyCartError, InsufficientStockError
+from .models import (
+    Product, CartItem, DailyProductSales, Order, OrderItem, ProductRecommendation, Reservation, StockShard,
+)
+
+SHIPPING = {
+    'full_name': 'Test User',
+    'address_line_1': '1 Main St',
+    'address_line_2': '',
+    'city': 'Springfield',
+    'state': 'IL',
+    'postal_code': '62701',
+    'country': 'US',
+}
+PAYMENT = {'payment_method': 'cod'}
+
+
+def make_product(seller, name='Widget', price='10.00', stock=10):
+    return Product.objects.create(user=seller, name=name, description='desc', price=Decimal(price), stock=stock)
+
+
+class CheckoutServiceTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = User.objects.create_user('seller', password='pw')
+        cls.buyer = User.objects.create_user('buyer', password='pw')
+
+    def test_order_invalidates_only_its_own_cached_products(self):
+        cache.clear()
+        sold, other = make_product(self.seller, 'A', stock=5), make_product(self.seller, 'B', stock=5)
+        catalog.get_page(), catalog.get_product(sold.pk), catalog.get_product(other.pk)
+        version = catalog.catalog_version()
+        CartItem.objects.create(user=self.buyer, product=sold, quantity=2)
+        with self.captureOnCommitCallbacks(execute=True):
+            place_order(self.buyer, SHIPPING, PAYMENT)
+        self.assertEqual(catalog.catalog_version(), version)
+        with self.assertNumQueries(0):
+            catalog.get_page(), catalog.get_product(other.pk)
+        self.assertEqual(catalog.get_product(sold.pk).stock, 3)
+
+    def test_place_order_creates_order_and_decrements_stock(self):
+        a = make_product(self.seller, 'A', '2.50', stock=5)
+        b = make_product(self.seller, 'B', '4.00', stock=3)
+        CartItem.objects.create(user=self.buyer, product=a, quantity=2)
+        CartItem.objects.create(user=self.buyer, product=b, quantity=3)
+
+        order = place_order(self.buyer, SHIPPING, PAYMENT)
+
+        self.assertEqual(order.total_price, Decimal('17.00'))
+        self.assertEqual(order.items.count(), 2)
+        a.refresh_from_db()
+        b.refresh_from_db()
+        self.assertEqual((a.stock, b.stock), (3, 0))
+        self.assertFalse(CartItem.objects.filter(user=self.buyer).exists())
+
+    def test_query_count_is_independent_of_cart_size(self):
+        for i in range(40):
+            product = make_product(self.seller, f'P{i}', stock=5)
+            CartItem.objects.create(user=self.buyer, product=product, quantity=1)
+
+        # cart fetch, holds fetch, stock UPDATE, order INSERT, order items INSERT,
+        # sales rollup INSERT and UPDATE, recommendation INSERT, UPDATE and
+        # DELETE, cart DELETE, job INSERT plus the savepoint/transaction
+        # bookkeeping inside TestCase.
+        with self.assertNumQueries(14):
+            place_order(self.buyer, SHIPPING, PAYMENT)
+        self.assertEqual(OrderItem.objects.count(), 40)
+
+    def test_insufficient_stock_rolls_back_and_reports_lines(self):
+        a = make_product(self.seller, 'A', stock=5)
+        b = make_product(self.seller, 'B', stock=1)
+        CartItem.objects.create(user=self.buyer, product=a, quantity=2)
+        CartItem.objects.create(user=self.buyer, product=b, quantity=2)
+
+        with self.assertRaises(InsufficientStockError) as ctx:
+            place_order(self.buyer, SHIPPING, PAYMENT)
+
+        self.assertEqual([(item.product_id, available) for item, available in ctx.exception.failed_lines], [(b.pk, 1)])
+        a.refresh_from_db()
+        self.assertEqual(a.stock, 5)
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(CartItem.objects.filter(user=self.buyer).count(), 2)
+
+    def test_empty_cart(self):
+        with self.assertRaises(EmptyCartError):
+            place_order(self.buyer, SHIPPING, PAYMENT)
+
+    def test_checkout_summary_view(self):
+        product = make_product(self.seller, stock=1)
+        CartItem.objects.create(user=self.buyer, product=product, quantity=1)
+        self.client.force_login(self.buyer)
+        session = self.client.session
+        session['shipping_data'] = SHIPPING
+        session['payment_data'] = PAYMENT
+        session.save()
+
+        response = self.client.post(reverse('checkout_summary'))
+
+        self.assertRedirects(response, reverse('order_history'))
+        self.assertEqual(Order.objects.filter(user=self.buyer).count(), 1)
+        self.assertNotIn('shipping_data', self.client.session)
+
+
+class CheckoutConcurrencyTests(TransactionTestCase):
+    databases = {'default', 'replica'}
+    buyers = 24
+    stock = 5
+
+    def test_concurrent_checkouts_never_oversell(self):
+        seller = User.objects.create_user('seller', password='pw')
+        product = make_product(seller, 'Hot item', stock=self.stock)
+        users = [User(username=f'buyer{i}') for i in range(self.buyers)]
+        User.objects.bulk_create(users)
+        users = list(User.objects.filter(username__startswith='buyer'))
+        CartItem.objects.bulk_create([CartItem(user=user, product=product, quantity=1) for user in users])
+
+        barrier = threading.Barrier(len(users))
+        results = []
+
+        def buy(user):
+            barrier.wait()
+            try:
+                for attempt in range(200):
+                    try:
+                        place_order(user, SHIPPING, PAYMENT)
+                        results.append('ok')
+                    except OperationalError:
+                        # SQLite reports writer contention as "database is locked".
+                        time.sleep(random.uniform(0, 0.002 * (attempt + 1)))
+                        continue
+                    except InsufficientStockError:
+                        results.append('short')
+                    break
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=buy, args=(user,)) for user in users]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        product.refresh_from_db()
+        sold = sum(OrderItem.objects.filter(product=product).values_list('quantity', flat=True))
+        self.assertGreaterEqual(product.stock, 0)
+        self.assertEqual(sold + product.stock, self.stock)
+        self.assertEqual(results.count('ok'), sold)
+        self.assertEqual(sold, self.stock)
+        self.assertEqual(len(results), self.buyers)
+
+
+class ReservationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = User.objects.create_user('seller', password='pw')
+        cls.alice = User.objects.create_user('alice', password='pw')
+        cls.bob = User.objects.create_user('bob', password='pw')
+
+    def setUp(self):
+        self.product = make_product(self.seller, 'Hot item', stock=3)
+
+    def cart(self, user, quantity, product=None):
+        CartItem.objects.update_or_create(user=user, product=product or self.product, defaults={'quantity': quantity})
+
+    def reserved(self):
+        self.product.refresh_from_db()
+        return self.product.reserved
+
+    def test_hold_is_counted_against_other_buyers(self):
+        self.cart(self.alice, 2)
+        self.cart(self.bob, 2)
+        reserve_cart(self.alice)
+        self.assertEqual(self.reserved(), 2)
+        self.assertEqual(self.product.available, 1)
+        with self.assertRaises(InsufficientStockError) as ctx:
+            reserve_cart(self.bob)
+        self.assertEqual([available for _, available in ctx.exception.failed_lines], [1])
+        with self.assertRaises(InsufficientStockError):
+            place_order(self.bob, SHIPPING, PAYMENT)
+        self.assertEqual(self.reserved(), 2)
+
+    def test_reentering_checkout_extends_or_resizes_the_hold(self):
+        self.cart(self.alice, 2)
+        reserve_cart(self.alice)
+        Reservation.objects.update(expires_at=timezone.now())
+        # Unchanged cart: cart, holds, expiry UPDATE and the savepoint; the Product row is not written.
+        with self.assertNumQueries(5):
+            reserve_cart(self.alice)
+        self.assertGreater(Reservation.objects.get().expires_at, timezone.now() + timedelta(minutes=5))
+
+        self.cart(self.alice, 3)
+        reserve_cart(self.alice)
+        self.assertEqual(self.reserved(), 3)
+        self.cart(self.alice, 1)
+        reserve_cart(self.alice)
+        self.assertEqual(self.reserved(), 1)
+        self.assertEqual(Reservation.objects.get().quantity, 1)
+
+    def test_order_consumes_the_hold(self):
+        other = make_product(self.seller, 'Other', stock=5)
+        self.cart(self.alice, 3)
+        self.cart(self.alice, 1, product=other)
+        reserve_cart(self.alice)
+        CartItem.objects.filter(product=other).delete()
+        place_order(self.alice, SHIPPING, PAYMENT)
+        self.product.refresh_from_db()
+        other.refresh_from_db()
+        self.assertEqual((self.product.stock, self.product.reserved), (0, 0))
+        self.assertEqual((other.stock, other.reserved), (5, 0))
+        self.assertFalse(Reservation.objects.exists())
+
+    def test_expired_holds_are_released_on_demand_and_by_the_sweep(self):
+        self.cart(self.alice, 3)
+        reserve_cart(self.alice)
+        sweep = Job.objects.get(name='release_expired_reservations')
+        self.assertGreater(sweep.run_at, timezone.now() + timedelta(minutes=5))
+        Reservation.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+
+        self.cart(self.bob, 3)
+        reserve_cart(self.bob)
+        self.assertEqual(list(Reservation.objects.values_list('user__username', flat=True)), ['bob'])
+        self.assertEqual(self.reserved(), 3)
+
+        Reservation.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        Job.objects.update(run_at=timezone.now())
+        queue.run(queue.claim('test')[0])
+        self.assertEqual(self.reserved(), 0)
+        self.assertFalse(Reservation.objects.exists())
+        self.assertFalse(Job.objects.filter(status=Job.QUEUED).exists())
+
+    def test_reconcile_repairs_counters(self):
+        self.cart(self.alice, 2)
+        reserve_cart(self.alice)
+        Product.objects.update(reserved=0)
+        self.assertEqual(inventory.reconcile(), 1)
+        self.assertEqual(self.reserved(), 2)
+        self.assertEqual(inventory.reconcile(), 0)
+
+    def test_checkout_details_turns_away_buyers_who_cannot_be_served(self):
+        self.cart(self.alice, 3)
+        self.cart(self.bob, 1)
+        self.client.force_login(self.alice)
+        self.assertContains(self.client.get(reverse('checkout_details')), 'Your items are reserved until')
+        self.client.force_login(self.bob)
+        response = self.client.get(reverse('checkout_details'), follow=True)
+        self.assertRedirects(response, reverse('cart'))
+        self.assertContains(response, 'Only 0 available')
+
+
+class ReservationConcurrencyTests(TransactionTestCase):
+    databases = {'default', 'replica'}
+
+    def test_concurrent_holds_never_exceed_stock(self):
+        seller = User.objects.create_user('seller', password='pw')
+        product = make_product(seller, 'Hot item', stock=5)
+        User.objects.bulk_create([User(username=f'buyer{i}') for i in range(24)])
+        users = list(User.objects.filter(username__startswith='buyer'))
+        CartItem.objects.bulk_create([CartItem(user=user, product=product, quantity=1) for user in users])
+        barrier = threading.Barrier(len(users))
+        results = []
+
+        def reserve(user):
+            barrier.wait()
+            try:
+                for attempt in range(200):
+                    try:
+                        reserve_cart(user)
+                        results.append('held')
+                    except OperationalError:
+                        time.sleep(random.uniform(0, 0.002 * (attempt + 1)))
+                        continue
+                    except InsufficientStockError:
+                        results.append('short')
+                    break
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=reserve, args=(user,)) for user in users]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        product.refresh_from_db()
+        self.assertEqual((results.count('held'), results.count('short')), (5, 19))
+        self.assertEqual(product.reserved, 5)
+        self.assertEqual(Reservation.objects.count(), 5)
+
+
+class StockShardTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = User.objects.create_user('seller', password='pw')
+        cls.alice = User.objects.create_user('alice', password='pw')
+        cls.bob = User.objects.create_user('bob', password='pw')
+
+    def setUp(self):
+        cache.clear()
+        self.product = make_product(self.seller, 'Hot item', stock=10)
+        inventory.shard_stock(self.product.pk, 4)
+
+    def shards(self):
+        return list(StockShard.objects.filter(product=self.product).order_by('index').values_list('stock', flat=True))
+
+    def buy(self, user, quantity):
+        CartItem.objects.create(user=user, product=self.product, quantity=quantity)
+        return place_order(user, SHIPPING, PAYMENT)
+
+    def test_checkouts_take_from_the_shards_without_holds(self):
+        self.assertEqual(self.shards(), [3, 3, 2, 2])
+        CartItem.objects.create(user=self.alice, product=self.product, quantity=2)
+        reserve_cart(self.alice)
+        self.assertFalse(Reservation.objects.exists())
+        before = Product.objects.get(pk=self.product.pk)
+        # One shard UPDATE and the buyer's holds; the Product row is not written.
+        with self.assertNumQueries(2):
+            self.assertTrue(inventory.consume(self.bob, {self.product.pk: 1}, shards={self.product.pk: 4}))
+        place_order(self.alice, SHIPPING, PAYMENT)
+        self.assertEqual(sum(self.shards()), 7)
+        after = Product.objects.get(pk=self.product.pk)
+        self.assertEqual((after.stock, after.updated_at), (before.stock, before.updated_at))
+        self.assertEqual(inventory.available([self.product.pk]), {self.product.pk: 7})
+
+    def test_short_shard_falls_back_to_siblings_then_restocks(self):
+        self.buy(self.alice, 5)
+        self.assertEqual(sum(self.shards()), 5)
+        Product.objects.filter(pk=self.product.pk).update(stock=F('stock') + 4)
+        self.buy(self.bob, 8)
+        self.assertEqual(sum(self.shards()), 0)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock - self.product.stock_at_rebalance, 1)
+        with self.assertRaises(InsufficientStockError) as ctx:
+            self.buy(self.alice, 2)
+        self.assertEqual([available for _, available in ctx.exception.failed_lines], [1])
+        self.assertEqual(Order.objects.count(), 2)
+
+    def test_rebalance_spreads_changes_and_evens_out_the_shards(self):
+        StockShard.objects.filter(product=self.product, index=0).update(stock=0)
+        Product.objects.filter(pk=self.product.pk).update(stock=F('stock') + 5)
+        self.assertEqual(inventory.available([self.product.pk]), {self.product.pk: 12})
+        Job.objects.update(run_at=timezone.now())
+        queue.run(queue.claim('test')[0])
+        self.assertEqual(self.shards(), [3, 3, 3, 3])
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.stock, self.product.stock_at_rebalance), (12, 12))
+        self.assertTrue(Job.objects.filter(name='rebalance_stock_shards', status=Job.QUEUED).exists())
+
+    def test_rebalance_leaves_unchanged_products_alone(self):
+        modified = Product.objects.get(pk=self.product.pk).updated_at
+        version = catalog.catalog_version()
+        Job.objects.update(run_at=timezone.now())
+        queue.run(queue.claim('test')[0])
+        self.assertEqual(Product.objects.get(pk=self.product.pk).updated_at, modified)
+        self.assertEqual(catalog.catalog_version(), version)
+        self.assertTrue(Job.objects.filter(name='rebalance_stock_shards', status=Job.QUEUED).exists())
+
+        # Sales that leave the shards even still change the stock shown.
+        StockShard.objects.filter(product=self.product, index__lt=2).update(stock=F('stock') - 1)
+        self.assertEqual(inventory.rebalance(), 1)
+        self.assertEqual(Product.objects.get(pk=self.product.pk).stock, 8)
+
+    def test_catalog_shows_the_live_stock(self):
+        self.buy(self.alice, 3)
+        plain = make_product(self.seller, 'Plain item', stock=4)
+        with self.assertNumQueries(2):
+            page = catalog.get_page()
+        self.assertEqual({product.name: product.stock for product in page}, {'Hot item': 7, 'Plain item': 4})
+        self.assertEqual(catalog.get_product(self.product.pk).stock, 7)
+        with self.assertNumQueries(1):
+            self.assertEqual(catalog._fetch_product(plain.pk).stock, 4)
+        self.assertContains(self.client.get(reverse('product_detail', args=[self.product.pk])), '7 in Stock')
+
+    def test_unsharding_gathers_the_stock_back(self):
+        self.buy(self.alice, 3)
+        call_command('shard_stock', self.product.pk, shards=0, stdout=StringIO())
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.stock, self.product.stock_shards, self.product.stock_at_rebalance), (7, 0, 0))
+        self.assertFalse(StockShard.objects.exists())
+        self.buy(self.bob, 7)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 0)
+
+
+class CatalogTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = User.objects.create_user('seller', password='pw')
+        # Duplicate names exercise the id tiebreaker of the (name, id) cursor.
+        for i in range(14):
+            make_product(cls.seller, f'Item {i // 2:02d}')
+
+    def setUp(self):
+        cache.clear()
+
+    def walk_forward(self, page_size=4):
+        pages = [catalog.get_page(page_size=page_size)]
+        while pages[-1].has_next:
+            pages.append(catalog.get_page(after=pages[-1].next_cursor, page_size=page_size))
+        return pages
+
+    def test_keyset_pages_cover_catalog_in_order(self):
+        pages = self.walk_forward()
+        seen = [p.pk for page in pages for p in page]
+        expected = list(Product.objects.order_by('name', 'pk').values_list('pk', flat=True))
+        self.assertEqual(seen, expected)
+        self.assertEqual([len(page) for page in pages], [4, 4, 4, 2])
+        self.assertFalse(pages[0].has_previous)
+
+    def test_previous_cursor_returns_prior_page(self):
+        pages = self.walk_forward()
+        back = catalog.get_page(before=pages[2].previous_cursor, page_size=4)
+        self.assertEqual([p.pk for p in back], [p.pk for p in pages[1]])
+        self.assertTrue(back.has_previous)
+
+    def test_page_query_uses_no_offset_and_no_count(self):
+        first = catalog.get_page(page_size=4)
+        with self.assertNumQueries(1) as ctx:
+            catalog.get_page(after=first.next_cursor, page_size=4)
+        sql = ctx.captured_queries[0]['sql'].upper()
+        self.assertNotIn('OFFSET', sql)
+        self.assertNotIn('COUNT(', sql)
+
+    def test_pages_are_cached_until_product_changes(self):
+        catalog.get_page()
+        with self.assertNumQueries(0):
+            catalog.get_page()
+        make_product(self.seller, 'AAA first')
+        self.assertEqual(catalog.get_page().products[0].name, 'AAA first')
+
+    def test_invalid_cursor_falls_back_to_first_page(self):
+        self.client.force_login(self.seller)
+        response = self.client.get(reverse('products'), {'after': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, '14 products')
+
+
+class ProductCardCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = User.objects.create_user('seller', password='pw')
+        cls.buyer = User.objects.create_user('buyer', password='pw')
+        cls.product = Product.objects.create(
+            user=cls.seller, sku='W1', name='Widget', description='desc', price=Decimal('10.00'), stock=5,
+        )
+
+    def setUp(self):
+        cache.clear()
+
+    def render(self, product):
+        return render_to_string('product_card.html', {'product': product, 'add_to_cart': True})
+
+    def test_card_is_cached_until_the_product_is_saved(self):
+        self.render(self.product)
+        self.product.name = 'Renamed'
+        self.assertIn('Widget', self.render(self.product))
+        self.product.save()
+        self.assertEqual(self.product.version, 2)
+        self.assertIn('Renamed', self.render(self.product))
+
+    def test_saves_with_update_fields_and_bulk_writes_bump_the_version(self):
+        self.product.save(update_fields=['name'])
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.version, 2)
+        rows = bulk.read_rows(StringIO("sku,name,description,price,stock\nW1,Widget,desc,9.00,5\n"), 'csv')
+        bulk.import_products(self.seller, rows)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.version, 3)
+
+    def test_stock_and_csrf_token_stay_outside_the_cached_fragment(self):
+        self.client.force_login(self.buyer)
+        self.assertContains(self.client.get(reverse('products')), 'Add to Cart')
+        fragment = cache.get(make_template_fragment_key('product_card', [self.product.pk, self.product.version]))
+        self.assertIn('Widget', fragment)
+        self.assertNotIn('csrfmiddlewaretoken', fragment)
+        self.assertNotIn('Add to Cart', fragment)
+
+        Product.objects.filter(pk=self.product.pk).update(stock=0)
+        catalog.bump_catalog_version()
+        response = self.client.get(reverse('products'))
+        self.assertContains(response, 'Out of Stock')
+        self.assertNotContains(response, 'csrfmiddlewaretoken')
+
+
+class ConditionalGetTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = User.objects.create_user('seller', password='pw')
+        cls.buyer = User.objects.create_user('buyer', password='pw')
+        cls.product = make_product(cls.seller)
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.buyer)
+        # force_login sets no CSRF cookie; a real login form would have.
+        self.client.get(reverse('products'))
+
+    def revalidate(self, url, client=None):
+        """GET ``url`` twice, the second time with the first response's ETag; returns both."""
+        client = client or self.client
+        first = client.get(url)
+        return first, client.get(url, HTTP_IF_NONE_MATCH=first.get('ETag', ''))
+
+    def test_unchanged_pages_are_not_modified(self):
+        for url in (reverse('products'), reverse('product_detail', args=[self.product.pk]), reverse('search') + '?q=widget'):
+            first, second = self.revalidate(url)
+            self.assertEqual((first.status_code, second.status_code), (200, 304), url)
+            self.assertEqual(set(first['Cache-Control'].split(', ')), {'private', 'no-cache'})
+            self.assertIn('Cookie', first['Vary'])
+            self.assertEqual(second['ETag'], first['ETag'])
+
+    def test_product_changes_invalidate_the_page(self):
+        url = reverse('product_detail', args=[self.product.pk])
+        first = self.client.get(url)
+        CartItem.objects.create(user=self.seller, product=self.product, quantity=1)
+        with self.captureOnCommitCallbacks(execute=True):
+            place_order(self.seller, SHIPPING, PAYMENT)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertContains(response, '9 in Stock')
+
+    def test_recommended_product_changes_invalidate_the_page(self):
+        other = make_product(self.seller, 'Gadget', '5.00')
+        ProductRecommendation.objects.create(product=self.product, recommended=other, score=1)
+        url = reverse('product_detail', args=[self.product.pk])
+        first, second = self.revalidate(url)
+        self.assertEqual(second.status_code, 304)
+        other.price = Decimal('99.00')
+        other.save()
+        self.assertContains(self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag']), '$99.00')
+
+    def test_etag_covers_the_viewers_navbar(self):
+        url = reverse('products')
+        first = self.client.get(url)
+        other = self.client_class()
+        other.force_login(self.seller)
+        other.cookies['csrftoken'] = self.client.cookies['csrftoken'].value
+        self.assertEqual(other.get(url, HTTP_IF_NONE_MATCH=first['ETag']).status_code, 200)
+
+        carts.add_item(self.buyer, self.product, 1)
+        self.assertContains(self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag']), '>1</span>')
+
+    def test_pages_with_flash_messages_are_never_revalidated(self):
+        first = self.client.get(reverse('products'))
+        response = self.client.post(reverse('add_to_cart', args=[self.product.pk]), follow=True)
+        self.assertContains(response, 'added to cart')
+        self.assertNotIn('ETag', response)
+        # With the cart badge unchanged the same ETag would match again.
+        CartItem.objects.filter(user=self.buyer).delete()
+        carts.invalidate_summary(self.buyer.pk)
+        self.assertEqual(self.client.get(reverse('products'), HTTP_IF_NONE_MATCH=first['ETag']).status_code, 304)
+
+    def test_missing_product_is_still_a_404(self):
+        self.assertEqual(self.client.get(reverse('product_detail', args=[0]), HTTP_IF_NONE_MATCH='*').status_code, 404)
+
+
+class SearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = User.objects.create_user('seller', password='pw')
+        cls.lamp = make_product(cls.seller, 'Desk lamp', '25.00', stock=3)
+        cls.cable = Product.objects.create(
+            user=cls.seller, name='USB cable', description='Charges your desk lamp', price=Decimal('5.00'), stock=0,
+        )
+        cls.chair = make_product(cls.seller, 'Office chair', '120.00', stock=2)
+
+    def setUp(self):
+        cache.clear()
+
+    def pks(self, results):
+        return [p.pk for p in results]
+
+    def test_uses_fts5_on_sqlite(self):
+        self.assertIsInstance(search.get_backend(), search.FTS5Backend)
+
+    def test_prefix_match_and_name_ranks_above_description(self):
+        self.assertEqual(self.pks(search.search('lam')), [self.lamp.pk, self.cable.pk])
+
+    def test_all_words_must_match(self):
+        self.assertEqual(self.pks(search.search('desk cab')), [self.cable.pk])
+
+    def test_price_and_stock_filters(self):
+        self.assertEqual(self.pks(search.search('lamp', in_stock=True)), [self.lamp.pk])
+        self.assertEqual(self.pks(search.search('lamp', max_price=Decimal('10'))), [self.cable.pk])
+        self.assertEqual(self.pks(search.search('lamp', min_price=Decimal('10'))), [self.lamp.pk])
+
+    def test_pagination(self):
+        first = search.search('lamp', page_size=1)
+        second = search.search('lamp', page=2, page_size=1)
+        self.assertTrue(first.has_next)
+        self.assertFalse(second.has_next)
+        self.assertEqual(self.pks(first) + self.pks(second), [self.lamp.pk, self.cable.pk])
+
+    def test_index_follows_saves_and_deletes(self):
+        self.chair.name = 'Gaming chair'
+        self.chair.save()
+        self.assertEqual(self.pks(search.search('gaming')), [self.chair.pk])
+        self.assertEqual(self.pks(search.search('office')), [])
+        self.chair.delete()
+        self.assertEqual(self.pks(search.search('chair')), [])
+
+    def test_inverted_index_fallback_matches_fts5(self):
+        backend = search.InvertedIndexBackend()
+        self.assertEqual(backend.search(['lam'], {}, 0, 10), [self.lamp.pk, self.cable.pk])
+        self.assertEqual(backend.search(['desk', 'cab'], {}, 0, 10), [self.cable.pk])
+        self.assertEqual(backend.search(['lamp'], {'stock__gt': 0}, 0, 10), [self.lamp.pk])
+
+    def test_only_the_newest_matches_are_ranked(self):
+        fan = make_product(self.seller, 'Desk fan', '30.00', stock=0)
+        backends = [search.FTS5Backend(), search.InvertedIndexBackend()]
+        with mock.patch.object(search, 'SEARCH_CANDIDATES', 2):
+            for backend in backends:
+                # The lamp is the oldest of three desk matches, so it is not ranked.
+                self.assertEqual(backend.search(['desk'], {}, 0, 10), [fan.pk, self.cable.pk])
+                # Filters apply before the cap.
+                self.assertEqual(backend.search(['desk'], {'stock__gt': 0}, 0, 10), [self.lamp.pk])
+
+    def test_rebuild_command(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {search.FTS_TABLE}')
+        self.assertEqual(self.pks(search.search('chair')), [])
+        call_command('rebuild_search_index', batch_size=2, stdout=StringIO())
+        self.assertEqual(self.pks(search.search('chair')), [self.chair.pk])
+
+    def test_search_view(self):
+        self.client.force_login(self.seller)
+        response = self.client.get(reverse('search'), {'q': 'lamp', 'in_stock': 'on'})
+        self.assertContains(response, 'Desk lamp')
+        self.assertNotContains(response, 'USB cable')
+
+
+class APITests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = User.objects.create_user('seller', password='pw')
+        cls.buyer = User.objects.create_user('buyer', password='pw')
+        cls.products = [make_product(cls.seller, f'Item {i:02d}', stock=10) for i in range(12)]
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.buyer)
+
+    def fill_cart(self, count):
+        CartItem.objects.bulk_create([CartItem(user=self.buyer, product=p, quantity=1) for p in self.products[:count]])
+
+    def place_orders(self, count, lines=3):
+        for _ in range(count):
+            self.fill_cart(lines)
+            place_order(self.buyer, SHIPPING, PAYMENT)
+
+    def test_product_list_is_one_query_and_cursor_paginated(self):
+        # The catalog state behind the ETag is one aggregate, then cached.
+        with self.assertNumQueries(2):
+            self.client.get(reverse('api_product_list'))
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('api_product_list'))
+        self.assertEqual(len(response.data['results']), 5)
+        self.assertNotIn('description', response.data['results'][0])
+        self.assertIn('cursor=', response.data['next'])
+
+    def test_product_list_conditional_get(self):
+        response = self.client.get(reverse('api_product_list'))
+        with self.assertNumQueries(0):
+            cached = self.client.get(reverse('api_product_list'), HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(cached.status_code, 304)
+        self.products[0].save()
+        self.assertEqual(self.client.get(reverse('api_product_list'), HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+
+    def test_sharded_product_stock_matches_the_storefront(self):
+        product = self.products[0]
+        inventory.shard_stock(product.pk, 4)
+        self.assertTrue(inventory.consume(self.buyer, {product.pk: 3}, shards={product.pk: 4}))
+        listed = self.client.get(reverse('api_product_list')).data['results'][0]
+        detail = self.client.get(reverse('api_product_detail', args=[product.pk])).data
+        self.assertEqual((listed['id'], listed['stock'], detail['stock']), (product.pk, 7, 7))
+        self.assertEqual(catalog.get_product(product.pk).stock, 7)
+
+    def test_product_detail(self):
+        url = reverse('api_product_detail', args=[self.products[0].pk])
+        # updated_at for the validators, then the product.
+        with self.assertNumQueries(2):
+            response = self.client.get(url)
+        self.assertEqual(response.data['description'], 'desc')
+        self.assertEqual(response['Last-Modified'], http_date(self.products[0].updated_at.timestamp()))
+        with self.assertNumQueries(0):
+            cached = self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(cached.status_code, 304)
+        self.products[1].save()
+        # Another product's change leaves this one's validators alone.
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+    def test_cart_list_query_count_is_constant(self):
+        self.fill_cart(10)
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('api_cart'))
+        self.assertEqual(len(response.data), 10)
+        self.assertEqual(response.data[0]['line_total'], '10.00')
+
+    def test_cart_crud(self):
+        url = reverse('api_cart')
+        product = self.products[0]
+        self.assertEqual(self.client.post(url, {'product_id': product.pk, 'quantity': 2}).status_code, 201)
+        response = self.client.post(url, {'product_id': product.pk, 'quantity': 3})
+        self.assertEqual(response.data['quantity'], 5)
+        self.assertEqual(self.client.post(url, {'product_id': product.pk, 'quantity': 6}).status_code, 400)
+
+        item_url = reverse('api_cart_item', args=[response.data['id']])
+        self.assertEqual(self.client.patch(item_url, {'quantity': 1}).data['quantity'], 1)
+        self.assertEqual(self.client.put(item_url, {'quantity': 2}).data['quantity'], 2)
+        moved = self.client.patch(item_url, {'product_id': self.products[1].pk, 'quantity': 1})
+        self.assertEqual(moved.status_code, 400)
+        self.assertIn('product_id', moved.data)
+        self.assertEqual(CartItem.objects.get(pk=response.data['id']).product, product)
+        self.assertEqual(self.client.delete(item_url).status_code, 204)
+        self.assertFalse(CartItem.objects.filter(user=self.buyer).exists())
+
+    def test_cart_requires_authentication(self):
+        self.client.force_authenticate(None)
+        self.assertEqual(self.client.get(reverse('api_cart')).status_code, 401)
+
+    def test_checkout(self):
+        self.fill_cart(3)
+        response = self.client.post(reverse('api_checkout'), {**SHIPPING, **PAYMENT}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(response.data['items']), 3)
+
+        self.assertEqual(self.client.post(reverse('api_checkout'), {**SHIPPING, **PAYMENT}, format='json').status_code, 400)
+
+    def test_checkout_reports_short_lines(self):
+        CartItem.objects.create(user=self.buyer, product=self.products[0], quantity=11)
+        response = self.client.post(reverse('api_checkout'), {**SHIPPING, **PAYMENT}, format='json')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.data['failed_lines'][0]['available'], 10)
+
+    def test_order_list_query_count_is_constant(self):
+        self.place_orders(2)
+        with self.assertNumQueries(2):
+            self.client.get(reverse('api_order_list'))
+        self.place_orders(3, lines=5)
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('api_order_list'))
+        self.assertEqual(len(response.data['results']), 5)
+        self.assertEqual(response.data['results'][0]['items'][0]['product_name'], 'Item 00')
+
+    def test_order_detail_conditional_get(self):
+        self.place_orders(1)
+        url = reverse('api_order_detail', args=[Order.objects.get().pk])
+        response = self.client.get(url)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+
+class OrderHistoryTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = User.objects.create_user('seller', password='pw')
+        cls.buyer = User.objects.create_user('buyer', password='pw')
+        cls.product = make_product(cls.seller, 'Original name', stock=100)
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.buyer)
+
+    def order(self, lines=2):
+        CartItem.objects.create(user=self.buyer, product=self.product, quantity=lines)
+        return place_order(self.buyer, SHIPPING, PAYMENT)
+
+    def test_query_count_is_independent_of_order_count(self):
+        for _ in range(3):
+            self.order()
+        # Warm the navbar cart summary so only the page's own queries are counted.
+        self.client.get(reverse('order_history'))
+        # user, order count, orders, prefetched items (the session is cached).
+        with self.assertNumQueries(4):
+            self.client.get(reverse('order_history'))
+        for _ in range(12):
+            self.order()
+        self.client.get(reverse('order_history'))
+        with self.assertNumQueries(4):
+            response = self.client.get(reverse('order_history'))
+        self.assertEqual(len(response.context['orders']), 10)
+        self.assertContains(response, '<a class="page-link" href="?page=2">2</a>', html=True)
+
+    def test_page_links_are_a_window_around_the_current_page(self):
+        Order.objects.bulk_create([Order(user=self.buyer, total_price=0, payment_method='cod') for _ in range(200)])
+        response = self.client.get(reverse('order_history'), {'page': 10})
+        ellipsis = response.context['orders'].paginator.ELLIPSIS
+        self.assertEqual(response.context['orders'].page_links, [1, ellipsis, 8, 9, 10, 11, 12, ellipsis, 20])
+        # Six page links plus Newer and Older.
+        self.assertContains(response, 'href="?page=', count=8)
+
+    def test_order_items_keep_product_name_snapshot(self):
+        order = self.order()
+        self.product.name = 'Renamed'
+        self.product.save()
+        response = self.client.get(reverse('order_history'))
+        self.assertContains(response, 'Original name')
+        self.assertEqual(order.items.get().product_name, 'Original name')
+
+
+class SalesAnalyticsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = User.objects.create_user('seller', password='pw')
+        cls.other_seller = User.objects.create_user('other', password='pw')
+        cls.buyer = User.objects.create_user('buyer', password='pw')
+        cls.lamp = make_product(cls.seller, 'Lamp', '10.00', stock=100)
+        cls.desk = make_product(cls.seller, 'Desk', '99.00', stock=100)
+        cls.chair = make_product(cls.other_seller, 'Chair', '40.00', stock=100)
+
+    def order(self, *lines):
+        for product, quantity in lines:
+            CartItem.objects.create(user=self.buyer, product=product, quantity=quantity)
+        return place_order(self.buyer, SHIPPING, PAYMENT)
+
+    def rollup_rows(self):
+        return list(DailyProductSales.objects.order_by('day', 'product_id').values_list(
+            'day', 'product_id', 'seller_id', 'orders', 'units', 'revenue',
+        ))
+
+    def test_checkout_updates_the_rollups(self):
+        self.order((self.lamp, 2), (self.chair, 1))
+        self.order((self.lamp, 3), (self.desk, 1))
+        today = timezone.localdate()
+
+        self.assertEqual(analytics.totals(self.seller), {'units': 6, 'revenue': Decimal('149.00')})
+        self.assertEqual(analytics.revenue_by_day(self.seller), [{'day': today, 'units': 6, 'revenue': Decimal('149.00')}])
+        top = analytics.top_products(self.seller, by='units')
+        self.assertEqual([(row['product'].name, row['orders'], row['units']) for row in top], [('Lamp', 2, 5), ('Desk', 1, 1)])
+        self.assertEqual(
+            [(row['seller_id'], row['revenue']) for row in analytics.revenue_by_seller()],
+            [(self.seller.pk, Decimal('149.00')), (self.other_seller.pk, Decimal('40.00'))],
+        )
+
+    def test_reports_filter_by_day(self):
+        self.order((self.lamp, 1))
+        yesterday = timezone.localdate() - timedelta(days=1)
+        DailyProductSales.objects.update(day=yesterday)
+        self.order((self.lamp, 2))
+        self.assertEqual(analytics.totals(self.seller, *analytics.period(1))['units'], 2)
+        self.assertEqual(analytics.totals(self.seller, *analytics.period(2))['units'], 3)
+        self.assertEqual([row['day'] for row in analytics.revenue_by_day(self.seller)], [yesterday, timezone.localdate()])
+
+    def test_backfill_rebuilds_the_same_rollups_in_batches(self):
+        first = self.order((self.lamp, 2), (self.chair, 1))
+        self.order((self.lamp, 3), (self.desk, 1))
+        self.order((self.desk, 2))
+        Order.objects.filter(pk=first.pk).update(created_at=first.created_at - timedelta(days=3))
+        today = timezone.localdate()
+        earlier = today - timedelta(days=3)
+
+        DailyProductSales.objects.update(units=0)
+        call_command('backfill_sales_rollups', batch_size=1, stdout=StringIO())
+        self.assertEqual(self.rollup_rows(), [
+            (earlier, self.lamp.pk, self.seller.pk, 1, 2, Decimal('20.00')),
+            (earlier, self.chair.pk, self.other_seller.pk, 1, 1, Decimal('40.00')),
+            (today, self.lamp.pk, self.seller.pk, 1, 3, Decimal('30.00')),
+            (today, self.desk.pk, self.seller.pk, 2, 3, Decimal('297.00')),
+        ])
+
+    def test_sales_report_pages(self):
+        self.order((self.lamp, 2), (self.chair, 1))
+        self.client.force_login(self.seller)
+        response = self.client.get(reverse('sales_report'), {'days': 7})
+        self.assertContains(response, '$20.00')
+        self.assertNotContains(response, 'Chair')
+        self.assertEqual(response.context['days'], 7)
+        self.assertEqual(self.client.get(reverse('sales_report'), {'days': 'x'}).context['days'], 30)
+
+        self.assertEqual(self.client.get(reverse('seller_revenue')).status_code, 302)
+        staff = User.objects.create_user('staff', password='pw', is_staff=True)
+        self.client.force_login(staff)
+        sellers = self.client.get(reverse('seller_revenue')).json()['sellers']
+        self.assertEqual(sellers[0], {'seller_id': self.chair.user_id, 'units': 1, 'revenue': '40.00'})
+
+
+class RecommendationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = User.objects.create_user('seller', password='pw')
+        cls.buyer = User.objects.create_user('buyer', password='pw')
+        cls.lamp, cls.desk, cls.chair, cls.rug = [
+            make_product(cls.seller, name, stock=100) for name in ('Lamp', 'Desk', 'Chair', 'Rug')
+        ]
+
+    def order(self, *products):
+        for product in products:
+            CartItem.objects.create(user=self.buyer, product=product, quantity=1)
+        return place_order(self.buyer, SHIPPING, PAYMENT)
+
+    def lists(self):
+        return {
+            product.name: [(other.name, score) for other, score in self.scored(product)]
+            for product in (self.lamp, self.desk, self.chair, self.rug)
+        }
+
+    def scored(self, product):
+        return [(row.recommended, row.score) for row in recommendations.neighbours(product.pk, limit=10)]
+
+    def test_checkout_counts_products_bought_together(self):
+        self.order(self.lamp, self.desk, self.chair)
+        self.order(self.lamp, self.desk)
+        self.order(self.rug)
+        self.assertEqual(self.lists(), {
+            'Lamp': [('Desk', 2), ('Chair', 1)],
+            'Desk': [('Lamp', 2), ('Chair', 1)],
+            'Chair': [('Lamp', 1), ('Desk', 1)],
+            'Rug': [],
+        })
+        self.assertEqual(recommendations.for_product(self.lamp.pk, limit=1), [self.desk])
+
+    def test_lists_are_capped_and_rebuild_restores_exact_top_lists(self):
+        with mock.patch.object(recommendations, 'TOP_K', 1):
+            self.order(self.lamp, self.chair)
+            self.order(self.lamp, self.rug)
+            self.order(self.lamp, self.rug)
+            # Each Lamp-Rug order starts the pair from scratch, and it loses the tie with Chair.
+            self.assertEqual(self.lists()['Lamp'], [('Chair', 1)])
+            # A full list keeps its neighbour on a tie, even when the new product has the lower id.
+            self.order(self.desk, self.rug)
+            self.order(self.desk, self.chair)
+            self.assertEqual(self.lists()['Desk'], [('Rug', 1)])
+
+            self.assertGreater(recommendations.rebuild(batch_size=2), 0)
+            self.assertEqual(self.lists()['Lamp'], [('Rug', 2)])
+            self.assertEqual(recommendations.rebuild(batch_size=2), 0)
+
+    def test_rebuild_matches_checkout_and_touches_changed_products(self):
+        self.order(self.lamp, self.desk, self.chair)
+        self.order(self.desk, self.chair)
+        live = self.lists()
+        ProductRecommendation.objects.all().delete()
+        Product.objects.update(updated_at=timezone.now() - timedelta(days=1))
+
+        out = StringIO()
+        call_command('rebuild_recommendations', batch_size=1, stdout=out)
+        self.assertIn('3 products changed', out.getvalue())
+        self.assertEqual(self.lists(), live)
+        touched = set(Product.objects.filter(updated_at__gt=timezone.now() - timedelta(hours=1)).values_list('name', flat=True))
+        self.assertEqual(touched, {'Lamp', 'Desk', 'Chair'})
+
+    def test_product_page_shows_recommendations(self):
+        self.order(self.lamp, self.desk)
+        cache.clear()
+        self.client.force_login(self.buyer)
+        response = self.client.get(reverse('product_detail', args=[self.lamp.pk]))
+        self.assertContains(response, 'Customers also bought')
+        self.assertEqual(response.context['recommendations'], [self.desk])
+        response = self.client.get(reverse('product_detail', args=[self.rug.pk]))
+        self.assertNotContains(response, 'Customers also bought')
+
+
+class CartTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = User.objects.create_user('seller', password='pw')
+        cls.buyer = User.objects.create_user('buyer', password='pw')
+        cls.a = make_product(cls.seller, 'A', '2.50', stock=5)
+        cls.b = make_product(cls.seller, 'B', '4.00', stock=5)
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.buyer)
+
+    def test_lines_and_totals_in_one_query(self):
+        carts.add_item(self.buyer, self.a, 2)
+        carts.add_item(self.buyer, self.b, 3)
+        with self.assertNumQueries(1):
+            items = list(carts.lines(self.buyer))
+            total = carts.grand_total(items)
+        self.assertEqual([item.line_total for item in items], [Decimal('5.00'), Decimal('12.00')])
+        self.assertEqual(total, Decimal('17.00'))
+
+    def test_add_item_merges_and_checks_stock(self):
+        carts.add_item(self.buyer, self.a, 2)
+        item = carts.add_item(self.buyer, self.a, 3)
+        self.assertEqual(item.quantity, 5)
+        with self.assertRaises(carts.OutOfStockError) as ctx:
+            carts.add_item(self.buyer, self.a, 1)
+        self.assertEqual(ctx.exception.in_cart, 5)
+        self.assertEqual(CartItem.objects.filter(user=self.buyer).count(), 1)
+
+    def test_summary_is_cached_and_invalidated_on_mutation(self):
+        carts.add_item(self.buyer, self.a, 2)
+        self.assertEqual(carts.get_summary(self.buyer.pk), {'count': 2, 'total': Decimal('5.00')})
+        with self.assertNumQueries(0):
+            carts.get_summary(self.buyer.pk)
+
+        item = carts.add_item(self.buyer, self.b, 1)
+        self.assertEqual(carts.get_summary(self.buyer.pk)['count'], 3)
+        carts.remove_item(item)
+        self.assertEqual(carts.get_summary(self.buyer.pk)['count'], 2)
+
+    def test_summary_survives_other_buyers_orders_but_not_price_changes(self):
+        carts.add_item(self.buyer, self.a, 2)
+        carts.get_summary(self.buyer.pk)
+        other = User.objects.create_user('other')
+        carts.add_item(other, self.b, 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            place_order(other, SHIPPING, PAYMENT)
+        with self.assertNumQueries(0):
+            carts.get_summary(self.buyer.pk)
+
+        self.a.price = Decimal('3.00')
+        self.a.save()
+        self.assertEqual(carts.get_summary(self.buyer.pk), {'count': 2, 'total': Decimal('6.00')})
+
+    def test_navbar_badge(self):
+        self.client.post(reverse('add_to_cart', args=[self.a.pk]))
+        response = self.client.get(reverse('cart'))
+        self.assertContains(response, 'rounded-pill text-bg-success">1</span>')
+        self.assertContains(response, 'Total: <span class="fw-bold">$2.50</span>')
+
+    def test_cart_view_query_count_is_constant(self):
+        carts.add_item(self.buyer, self.a, 1)
+        self.client.get(reverse('cart'))
+        with self.assertNumQueries(2):
+            self.client.get(reverse('cart'))
+        carts.add_item(self.buyer, self.b, 1)
+        self.client.get(reverse('cart'))
+        with self.assertNumQueries(2):
+            self.client.get(reverse('cart'))
+
+    def test_update_cart_applies_every_line_at_once(self):
+        c = make_product(self.seller, 'C', '1.00', stock=5)
+        a, b, c = (carts.add_item(self.buyer, product) for product in (self.a, self.b, c))
+        self.client.get(reverse('cart'))
+
+        def update(**quantities):
+            return self.client.post(reverse('update_cart'), {f'quantity-{item.pk}': n for item, n in quantities.values()})
+
+        # The user, the lines with their stock, one DELETE, one UPDATE, the
+        # savepoint pair and the new lines; the same for any number of lines.
+        with self.assertNumQueries(7):
+            response = update(a=(a, 3), b=(b, 0), c=(c, 2))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Cart updated.')
+        self.assertContains(response, 'rounded-pill text-bg-success">5</span>')
+        self.assertEqual(dict(CartItem.objects.values_list('product__name', 'quantity')), {'A': 3, 'C': 2})
+
+        response = update(a=(a, 6), c=(c, 1))
+        self.assertContains(response, 'Not enough stock for A. Only 5 available.')
+        self.assertEqual(dict(CartItem.objects.values_list('product__name', 'quantity')), {'A': 3, 'C': 2})
+
+    def test_update_cart_json(self):
+        a, b = carts.add_item(self.buyer, self.a), carts.add_item(self.buyer, self.b)
+        url = reverse('update_cart')
+        response = self.client.post(url, {'quantities': {a.pk: 2, b.pk: 0}}, content_type='application/json')
+        self.assertEqual(response.json(), {
+            'count': 2,
+            'total': '5.00',
+            'lines': [{'line': a.pk, 'product_id': self.a.pk, 'quantity': 2, 'line_total': '5.00'}],
+        })
+        self.assertEqual(carts.get_summary(self.buyer.pk)['count'], 2)
+
+        response = self.client.post(url, {'quantities': {a.pk: 9}}, content_type='application/json')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['failed_lines'], [{'line': a.pk, 'product_id': self.a.pk, 'requested': 9, 'available': 5}])
+        self.assertEqual(self.client.post(url, {'quantities': [1]}, content_type='application/json').status_code, 400)
+
+        self.client.logout()
+        self.client.post(reverse('add_to_cart', args=[self.b.pk]))
+        response = self.client.post(url, {'quantities': {self.b.pk: 3}}, content_type='application/json')
+        self.assertEqual(response.json()['total'], '12.00')
+        self.assertEqual(carts.GuestCart.from_request(self.client.get(reverse('cart')).wsgi_request).quantities, {self.b.pk: 3})
+
+    def test_cart_item_is_unique_per_user_and_product(self):
+        CartItem.objects.create(user=self.buyer, product=self.a)
+        with self.assertRaises(IntegrityError):
+            CartItem.objects.create(user=self.buyer, product=self.a)
+
+
+class AdminTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser('admin', password='pw')
+        cls.seller = User.objects.create_user('seller', password='pw')
+        cls.products = [make_product(cls.seller, f'Lamp {i}', '10.00', stock=50) for i in range(6)]
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def changelist_queries(self, model):
+        url = reverse(f'admin:products_{model}_changelist')
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(url).status_code, 200)
+        return len(queries)
+
+    def test_changelists_do_not_query_per_row(self):
+        buyers = [User.objects.create_user(f'buyer{i}') for i in range(4)]
+        CartItem.objects.create(user=buyers[0], product=self.products[0])
+        CartItem.objects.create(user=self.seller, product=self.products[1])
+        OrderItem.objects.create(
+            order=Order.objects.create(user=buyers[0]), product=self.products[0], quantity=1, price_at_purchase=1,
+        )
+        few = {model: self.changelist_queries(model) for model in ('product', 'cartitem', 'order', 'orderitem')}
+
+        for buyer, product in zip(buyers, self.products[2:]):
+            CartItem.objects.create(user=buyer, product=product)
+            OrderItem.objects.create(
+                order=Order.objects.create(user=buyer), product=product, quantity=1, price_at_purchase=1,
+            )
+        many = {model: self.changelist_queries(model) for model in ('product', 'cartitem', 'order', 'orderitem')}
+        self.assertEqual(many, few)
+
+    def test_order_page_lists_its_items_without_a_query_each(self):
+        def page_queries(order):
+            url = reverse('admin:products_order_change', args=[order.pk])
+            self.client.get(url)
+            with CaptureQueriesContext(connection) as queries:
+                self.assertContains(self.client.get(url), 'Lamp 0')
+            return len(queries)
+
+        counts = []
+        for lines in (1, 6):
+            order = Order.objects.create(user=self.seller)
+            OrderItem.objects.bulk_create([
+                OrderItem(order=order, product=product, product_name=product.name, quantity=1, price_at_purchase=1)
+                for product in self.products[:lines]
+            ])
+            counts.append(page_queries(order))
+        self.assertEqual(counts[0], counts[1])
+
+    def run_action(self, action, products, **values):
+        return self.client.post(reverse('admin:products_product_changelist'), {
+            'action': action, '_selected_action': [product.pk for product in products], **values,
+        }, follow=True)
+
+    def test_restock_is_one_update(self):
+        version = catalog.catalog_version()
+        with CaptureQueriesContext(connection) as queries:
+            self.run_action('restock', self.products[:4], quantity=5)
+        self.assertEqual(sum(query['sql'].startswith('UPDATE "products_product"') for query in queries), 1)
+        self.assertEqual(
+            list(Product.objects.order_by('pk').values_list('stock', 'version')),
+            [(55, 2)] * 4 + [(50, 1)] * 2,
+        )
+        self.assertNotEqual(catalog.catalog_version(), version)
+
+    def test_price_update_rounds_to_cents(self):
+        response = self.run_action('update_prices', self.products[:2], percent='-12.5')
+        self.assertContains(response, 'Changed the price of 2 products')
+        self.assertEqual(
+            list(Product.objects.order_by('pk').values_list('price', flat=True)[:3]),
+            [Decimal('8.75'), Decimal('8.75'), Decimal('10.00')],
+        )
+
+    def test_action_without_a_value_changes_nothing(self):
+        response = self.run_action('restock', self.products[:1], quantity='')
+        self.assertContains(response, 'Enter a valid units for this action.')
+        self.assertEqual(Product.objects.get(pk=self.products[0].pk).stock, 50)
+
+    def test_product_search_uses_the_search_index_and_sku(self):
+        Product.objects.filter(pk=self.products[3].pk).update(sku='LMP-3')
+        url = reverse('admin:products_product_changelist')
+        response = self.client.get(url, {'q': 'lamp'})
+        self.assertEqual(response.context['cl'].result_count, 6)
+        response = self.client.get(url, {'q': 'LMP-3'})
+        self.assertEqual([product.pk for product in response.context['cl'].result_list], [self.products[3].pk])
+
+    def test_order_and_cart_searches_are_exact_index_lookups(self):
+        buyer = User.objects.create_user('alice')
+        order = Order.objects.create(user=buyer)
+        other = Order.objects.create(user=self.seller)
+        OrderItem.objects.create(order=order, product=self.products[0], quantity=1, price_at_purchase=1)
+        url = reverse('admin:products_order_changelist')
+        for term, expected in (('alice', [order.pk]), (str(other.pk), [other.pk]), ('ALICE', []), ('ali', [])):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url, {'q': term})
+            self.assertEqual([o.pk for o in response.context['cl'].result_list], expected, term)
+            self.assertFalse([query for query in queries if ' LIKE ' in query['sql']], term)
+        response = self.client.get(reverse('admin:products_orderitem_changelist'), {'q': str(order.pk)})
+        self.assertEqual(response.context['cl'].result_count, 1)
+
+    def test_paginator_estimates_big_unfiltered_tables(self):
+        from .admin import EstimatedCountPaginator
+
+        class SmallPaginator(EstimatedCountPaginator):
+            exact_below = 3
+
+        orders = [Order.objects.create(user=self.seller) for _ in range(5)]
+        self.assertEqual(SmallPaginator(Order.objects.order_by('pk'), 2).count, orders[-1].pk)
+        self.assertEqual(EstimatedCountPaginator(Order.objects.order_by('pk'), 2).count, 5)
+        self.assertEqual(SmallPaginator(Order.objects.filter(pk__gt=orders[1].pk).order_by('pk'), 2).count, 3)
+        # Cart lines and products are deleted, so MAX(pk) would overcount them; they get a capped exact count.
+        Product.objects.filter(pk__in=[product.pk for product in self.products[:4]]).delete()
+        self.assertEqual(SmallPaginator(Product.objects.order_by('pk'), 2).count, 2)
+
+
+class CachingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        caching.reset_stats()
+
+    def test_hit_miss_counters(self):
+        calls = []
+        for _ in range(3):
+            caching.get_or_set('demo', 'demo:key', lambda: calls.append(1) or 'value', 60)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(caching.stats()['demo'], {'hits': 2, 'stale_hits': 0, 'misses': 1})
+
+    def test_stale_value_served_while_another_caller_refreshes(self):
+        caching.get_or_set('demo', 'demo:key', lambda: 'old', 60)
+        cache.set('demo:key', ('old', time.time() - 1), 60)
+        cache.add('lock:demo:key', 1, 10)
+        self.assertEqual(caching.get_or_set('demo', 'demo:key', lambda: 'new', 60), 'old')
+        cache.delete('lock:demo:key')
+        self.assertEqual(caching.get_or_set('demo', 'demo:key', lambda: 'new', 60), 'new')
+        self.assertEqual(caching.stats()['demo']['stale_hits'], 1)
+
+    def test_concurrent_misses_compute_once(self):
+        calls = []
+        barrier = threading.Barrier(8)
+
+        def producer():
+            calls.append(1)
+            time.sleep(0.05)
+            return 'value'
+
+        def worker():
+            barrier.wait()
+            self.assertEqual(caching.get_or_set('demo', 'demo:hot', producer, 60), 'value')
+
+        threads = [threading.Thread(target=worker) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(calls), 1)
+
+    def test_bumping_namespace_changes_keys(self):
+        key = caching.make_key('demo', 'page', 1)
+        caching.bump_namespace('demo')
+        self.assertNotEqual(caching.make_key('demo', 'page', 1), key)
+
+    def test_product_detail_is_cached(self):
+        seller = User.objects.create_user('seller', password='pw')
+        product = make_product(seller)
+        self.client.force_login(seller)
+        self.client.get(reverse('product_detail', args=[product.pk]))
+        self.client.get(reverse('product_detail', args=[product.pk]))
+        # The product's and its recommendations' updated_at (for the ETag) and the product itself.
+        self.assertEqual(caching.stats()['catalog'], {'hits': 3, 'stale_hits': 0, 'misses': 3})
+        self.assertEqual(self.client.get(reverse('product_detail', args=[0])).status_code, 404)
+
+    def test_cache_stats_endpoint_is_staff_only(self):
+        user = User.objects.create_user('staff', password='pw')
+        self.client.force_login(user)
+        self.assertEqual(self.client.get(reverse('cache_stats')).status_code, 302)
+        user.is_staff = True
+        user.save()
+        caching.get_or_set('demo', 'demo:key', lambda: 1, 60)
+        self.assertEqual(self.client.get(reverse('cache_stats')).json()['demo']['misses'], 1)
+
+
+class FakeRespServer(socketserver.ThreadingTCPServer):
+    """In-process stand-in for a Redis server implementing the commands RespCache uses."""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        self.data = {}
+        self.expiry = {}
+        self.lock = threading.Lock()
+        super().__init__(('127.0.0.1', 0), FakeRespHandler)
+
+    def alive(self, key):
+        expires = self.expiry.get(key)
+        if expires is not None and expires <= time.time():
+            self.data.pop(key, None)
+            self.expiry.pop(key, None)
+        return key in self.data
+
+
+class FakeRespHandler(socketserver.StreamRequestHandler):
+    def read_command(self):
+        header = self.rfile.readline()
+        if not header:
+            return None
+        args = []
+        for _ in range(int(header[1:])):
+            length = int(self.rfile.readline()[1:])
+            args.append(self.rfile.read(length + 2)[:-2])
+        return args
+
+    def reply(self, value):
+        if value is None:
+            self.wfile.write(b'$-1\r\n')
+        elif isinstance(value, bool):
+            self.wfile.write(b':%d\r\n' % value)
+        elif isinstance(value, int):
+            self.wfile.write(b':%d\r\n' % value)
+        elif isinstance(value, str):
+            self.wfile.write(b'+%s\r\n' % value.encode())
+        elif isinstance(value, list):
+            self.wfile.write(b'*%d\r\n' % len(value))
+            for item in value:
+                self.reply(item)
+        else:
+            self.wfile.write(b'$%d\r\n%s\r\n' % (len(value), value))
+
+    def handle(self):
+        server = self.server
+        while (args := self.read_command()) is not None:
+            command, args = args[0].decode().upper(), args[1:]
+            with server.lock:
+                if command in ('PING', 'SELECT'):
+                    result = 'OK'
+                elif command == 'GET':
+                    result = server.data[args[0]] if server.alive(args[0]) else None
+                elif command == 'MGET':
+                    result = [server.data[k] if server.alive(k) else None for k in args]
+                elif command == 'SET':
+                    key, value, options = args[0], args[1], [a.decode().upper() for a in args[2:]]
+                    if 'NX' in options and server.alive(key):
+                        result = None
+                    else:
+                        server.data[key] = value
+                        server.expiry.pop(key, None)
+                        if 'PX' in options:
+                            server.expiry[key] = time.time() + int(options[options.index('PX') + 1]) / 1000
+                        result = 'OK'
+                elif command == 'DEL':
+                    result = sum(1 for k in args if server.alive(k) and server.data.pop(k) is not None)
+                elif command == 'EXISTS':
+                    result = sum(1 for k in args if server.alive(k))
+                elif command == 'INCRBY':
+                    value = int(server.data[args[0]]) + int(args[1]) if server.alive(args[0]) else int(args[1])
+                    server.data[args[0]] = str(value).encode()
+                    result = value
+                elif command == 'PEXPIRE':
+                    result = server.alive(args[0])
+                    if result:
+                        server.expiry[args[0]] = time.time() + int(args[1]) / 1000
+                elif command == 'PERSIST':
+                    result = server.expiry.pop(args[0], None) is not None
+                elif command == 'FLUSHDB':
+                    server.data.clear()
+                    server.expiry.clear()
+                    result = 'OK'
+                else:
+                    self.wfile.write(b'-ERR unknown command\r\n')
+                    continue
+            self.reply(result)
+
+
+class RespCacheTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = FakeRespServer()
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        host, port = self.server.server_address
+        self.cache = RespCache(f'redis://{host}:{port}/0', {'TIMEOUT': 60})
+        self.cache.clear()
+
+    def tearDown(self):
+        self.cache._disconnect()
+
+    def test_round_trips_values(self):
+        self.cache.set('page', {'products': [1, 2]})
+        self.assertEqual(self.cache.get('page'), {'products': [1, 2]})
+        self.assertEqual(self.cache.get_many(['page', 'missing']), {'page': {'products': [1, 2]}})
+        self.assertIsNone(self.cache.get('missing'))
+
+    def test_add_incr_delete(self):
+        self.assertTrue(self.cache.add('version', 1))
+        self.assertFalse(self.cache.add('version', 5))
+        self.assertEqual(self.cache.incr('version'), 2)
+        self.assertEqual(self.cache.get('version'), 2)
+        self.assertTrue(self.cache.delete('version'))
+        with self.assertRaises(ValueError):
+            self.cache.incr('version')
+
+    def test_timeouts(self):
+        self.cache.set('short', 'x', timeout=0.05)
+        self.assertTrue(self.cache.has_key('short'))
+        time.sleep(0.1)
+        self.assertFalse(self.cache.has_key('short'))
+        self.cache.set('gone', 'x', timeout=0)
+        self.assertIsNone(self.cache.get('gone'))
+
+    def test_caching_helpers_work_on_resp_backend(self):
+        location = '%s:%d' % self.server.server_address
+        with self.settings(CACHES={'default': {'BACKEND': 'products.cache_backends.RespCache', 'LOCATION': location}}):
+            caching.bump_namespace('demo')
+            key = caching.make_key('demo', 'x')
+            self.assertEqual(key, 'demo:2:x')
+            self.assertEqual(caching.get_or_set('demo', key, lambda: 'first', 60), 'first')
+            self.assertEqual(caching.get_or_set('demo', key, lambda: 'second', 60), 'first')
+            self.assertTrue(self.cache.has_key(key))
+
+
+class QueryPlanAuditTests(TestCase):
+    def test_no_view_queryset_does_a_full_table_scan(self):
+        out = StringIO()
+        call_command('audit_query_plans', stdout=out)
+        self.assertNotIn('FULL SCAN', out.getvalue())
+
+    def test_audit_covers_the_statements_checkout_runs(self):
+        queries = query_audit.audited_querysets()
+        for name in ('search', 'reservation release', 'checkout shard update', 'checkout sibling shards'):
+            self.assertIn(name, queries)
+        sql, _ = queries['checkout stock update from hold']
+        self.assertTrue(sql.startswith('UPDATE'))
+        self.assertIn('CASE', sql)
+        self.assertIn('"reserved"', sql)
+
+
+class BenchmarkSmokeTests(TransactionTestCase):
+    # Schema changes cannot run inside a TestCase transaction on SQLite.
+    databases = {'default', 'replica'}
+
+    def test_indexes_benchmark_runs(self):
+        from .benchmarks import indexes
+
+        options = {'products': 120, 'users': 3, 'sellers': 2, 'orders_per_user': 2, 'repeat': 1}
+        results = indexes.run(options, StringIO())
+        self.assertEqual(set(results['before']), set(query_audit.audited_querysets()))
+        self.assertFalse(results['after']['checkout stock update']['full_scan'])
+        # The hot-path indexes are back for the tests that follow.
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(cursor, Product._meta.db_table)
+        self.assertIn('product_name_id_idx', constraints)
+
+
+class GuestCartTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = User.objects.create_user('seller', password='pw')
+        cls.buyer = User.objects.create_user('buyer', password='pw')
+        cls.a = make_product(cls.seller, 'A', '2.50', stock=5)
+        cls.b = make_product(cls.seller, 'B', '4.00', stock=5)
+
+    def setUp(self):
+        cache.clear()
+
+    def writes(self, fn):
+        with CaptureQueriesContext(connection) as queries:
+            fn()
+        return [q['sql'] for q in queries if q['sql'].split(None, 1)[0].upper() in ('INSERT', 'UPDATE', 'DELETE')]
+
+    def test_visitors_browse_and_fill_a_cart_without_database_writes(self):
+        def browse():
+            self.assertEqual(self.client.get(reverse('products')).status_code, 200)
+            self.assertEqual(self.client.get(reverse('product_detail', args=[self.a.pk])).status_code, 200)
+            self.client.post(reverse('add_to_cart', args=[self.a.pk]))
+            self.client.post(reverse('product_detail', args=[self.b.pk]), {'quantity': 2})
+            self.client.post(reverse('update_cart_item', args=[self.a.pk]), {'quantity': 3})
+
+        self.assertEqual(self.writes(browse), [])
+        self.assertFalse(CartItem.objects.exists())
+        response = self.client.get(reverse('cart'))
+        self.assertContains(response, 'rounded-pill text-bg-success">5</span>')
+        self.assertContains(response, 'Total: <span class="fw-bold">$15.50</span>')
+        self.assertContains(response, reverse('remove_from_cart', args=[self.b.pk]))
+
+        self.client.get(reverse('remove_from_cart', args=[self.a.pk]))
+        self.assertEqual([item.product for item in self.client.get(reverse('cart')).context['items']], [self.b])
+
+    def test_stock_and_tampering(self):
+        self.client.post(reverse('product_detail', args=[self.a.pk]), {'quantity': 5})
+        self.client.post(reverse('add_to_cart', args=[self.a.pk]))
+        self.assertEqual(carts.GuestCart.from_request(self.client.get(reverse('cart')).wsgi_request).quantities, {self.a.pk: 5})
+        self.client.cookies[carts.GUEST_COOKIE] = f'{self.a.pk}-50:forged'
+        self.assertEqual(self.client.get(reverse('cart')).context['items'], [])
+
+    def test_login_merges_the_guest_cart_in_one_upsert(self):
+        CartItem.objects.create(user=self.buyer, product=self.a, quantity=4)
+        self.b.delete()
+        c = make_product(self.seller, 'C', stock=2)
+        guest = carts.GuestCart({self.a.pk: 3, self.b.pk: 1, c.pk: 5})
+        # Stock of the lines, the user's existing lines, then the upsert.
+        with self.assertNumQueries(3):
+            self.assertEqual(guest.merge_into(self.buyer), 2)
+        self.assertEqual(dict(CartItem.objects.filter(user=self.buyer).values_list('product_id', 'quantity')), {self.a.pk: 5, c.pk: 2})
+        self.assertEqual(guest.quantities, {})
+
+    def test_login_view_merges_and_follows_next(self):
+        self.client.post(reverse('add_to_cart', args=[self.a.pk]))
+        response = self.client.get(reverse('checkout_details'))
+        self.assertRedirects(response, f"{reverse('login')}?next={reverse('checkout_details')}", fetch_redirect_response=False)
+        self.assertContains(self.client.get(response.url), f'name="next" value="{reverse("checkout_details")}"')
+
+        response = self.client.post(reverse('login'), {'username': 'buyer', 'password': 'pw', 'next': reverse('checkout_details')})
+        self.assertRedirects(response, reverse('checkout_details'), fetch_redirect_response=False)
+        self.assertEqual(response.cookies[carts.GUEST_COOKIE].value, '')
+        self.assertEqual(CartItem.objects.get(user=self.buyer).product, self.a)
+
+        self.client.logout()
+        response = self.client.post(reverse('login'), {'username': 'buyer', 'password': 'pw', 'next': 'https://example.com/'})
+        self.assertRedirects(response, reverse('home'), fetch_redirect_response=False)
+
+
+class RequestMetricsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = User.objects.create_user('seller', password='pw')
+        cls.product = make_product(cls.seller)
+
+    def setUp(self):
+        cache.clear()
+        metrics.reset_stats()
+
+    def test_records_latency_and_queries_per_url_name(self):
+        self.client.force_login(self.seller)
+        response = self.client.get(reverse('product_detail', args=[self.product.pk]))
+        self.assertRegex(response['Server-Timing'], r'^db;dur=[\d.]+;desc="\d+ queries", total;dur=[\d.]+$')
+        self.client.get(reverse('product_detail', args=[self.product.pk]))
+        entry = metrics.stats()['product_detail']
+        self.assertEqual(entry['requests'], 2)
+        self.assertEqual(sum(entry['histogram'].values()), 2)
+        self.assertGreater(entry['queries_per_request'], 0)
+
+    def test_repeated_sql_is_reported(self):
+        tracker = metrics.QueryTracker()
+        with connection.execute_wrapper(tracker):
+            for product in Product.objects.all():
+                User.objects.get(pk=product.user_id)
+            User.objects.get(pk=self.seller.pk)
+        self.assertEqual(list(tracker.duplicates().values()), [2])
+        with self.assertLogs('products.metrics', 'WARNING'):
+            with connection.execute_wrapper(tracker):
+                for _ in range(metrics.DUPLICATE_QUERY_THRESHOLD):
+                    User.objects.get(pk=self.seller.pk)
+            metrics.record('demo', 0.001, tracker)
+        self.assertEqual(metrics.stats()['demo']['requests_with_duplicates'], 1)
+
+    def test_request_stats_endpoint_is_staff_only(self):
+        user = User.objects.create_user('staff', password='pw')
+        self.client.force_login(user)
+        self.assertEqual(self.client.get(reverse('request_stats')).status_code, 302)
+        user.is_staff = True
+        user.save()
+        self.client.get(reverse('products'))
+        self.assertEqual(self.client.get(reverse('request_stats')).json()['products']['requests'], 1)
+
+
+class ThrottlingTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = User.objects.create_user('seller', password='pw')
+        cls.buyer = User.objects.create_user('buyer', password='pw')
+        cls.product = make_product(cls.seller, stock=100)
+
+    def setUp(self):
+        cache.clear()
+        metrics.reset_stats()
+
+    def test_parse_rate(self):
+        self.assertEqual(throttling.parse_rate('20/min'), (20, 60))
+        self.assertEqual(throttling.parse_rate('10/15min'), (10, 900))
+        self.assertEqual(throttling.parse_rate('2/s'), (2, 1))
+        with self.assertRaises(ImproperlyConfigured):
+            throttling.parse_rate('often')
+
+    def test_sliding_window_weights_the_previous_window(self):
+        window = throttling.SlidingWindow(3, 60)
+        start = 6000.0
+        self.assertEqual([window.hit('k', start + i) for i in range(3)], [0, 0, 0])
+        self.assertGreater(window.hit('k', start + 3), 0)
+        # Half way through the next window, half of the previous one's 4 hits still count.
+        self.assertEqual(window.hit('k', start + 90), 0)
+        self.assertGreater(window.hit('k', start + 90), 0)
+        self.assertEqual(window.hit('k', start + 180), 0)
+
+    def test_token_bucket_allows_bursts_then_the_rate(self):
+        bucket = throttling.TokenBucket(1, 1, burst=3)
+        start = time.time()
+        self.assertEqual([bucket.hit('k', start) for _ in range(3)], [0, 0, 0])
+        self.assertAlmostEqual(bucket.hit('k', start), 1)
+        self.assertEqual(bucket.hit('k', start + 1), 0)
+        self.assertGreater(bucket.hit('k', start + 1), 0)
+
+    @override_settings(RATE_LIMITS={'login': [('username', '3/min')]})
+    def test_login_attempts_are_limited_per_username(self):
+        url = reverse('login')
+        for _ in range(3):
+            self.assertEqual(self.client.post(url, {'username': 'Buyer', 'password': 'wrong'}).status_code, 200)
+        with mock.patch('products.views.authenticate') as authenticate:
+            response = self.client.post(url, {'username': 'buyer ', 'password': 'pw'})
+        self.assertEqual(response.status_code, 429)
+        self.assertGreaterEqual(int(response['Retry-After']), 1)
+        authenticate.assert_not_called()
+        self.assertEqual(self.client.get(url).status_code, 200)
+        self.assertEqual(self.client.post(url, {'username': 'seller', 'password': 'pw'}).status_code, 302)
+
+    @override_settings(RATE_LIMITS={'add_to_cart': [('user', '1/min', 2)]})
+    def test_cart_writes_are_limited_per_user(self):
+        url = reverse('add_to_cart', args=[self.product.pk])
+        self.client.force_login(self.buyer)
+        self.assertEqual([self.client.post(url).status_code for _ in range(3)], [302, 302, 429])
+        self.assertEqual(CartItem.objects.get(user=self.buyer).quantity, 2)
+        self.client.force_login(self.seller)
+        self.assertEqual(self.client.post(url).status_code, 302)
+
+    @override_settings(RATE_LIMITS={'api_cart': [('ip', '2/min')]})
+    def test_api_uses_the_same_limits_once(self):
+        client = APIClient()
+        client.force_authenticate(self.buyer)
+        url = reverse('api_cart')
+        statuses = [client.post(url, {'product_id': self.product.pk}).status_code for _ in range(3)]
+        self.assertEqual(statuses, [201, 201, 429])
+        self.assertEqual(client.get(url).status_code, 200)
+
+    @override_settings(ADMISSION_MAX_IN_FLIGHT=0)
+    def test_sheds_load_over_the_in_flight_limit(self):
+        self.client.force_login(User.objects.create_user('staff', password='pw', is_staff=True))
+        response = self.client.get(reverse('products'))
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '1')
+        self.assertEqual(self.client.get(reverse('request_stats')).status_code, 200)
+
+    @override_settings(ADMISSION_MAX_DB_MS=50)
+    def test_sheds_a_share_of_requests_while_queries_are_slow(self):
+        tracker = metrics.QueryTracker()
+        tracker.count, tracker.db_time = 1, 4.0
+        metrics.record('demo', 4.0, tracker)
+        self.assertAlmostEqual(metrics.db_latency_ms(), 4000 * metrics.DB_LATENCY_WEIGHT, places=0)
+        # 200ms against a 50ms threshold: three requests in four are refused.
+        with mock.patch('products.middleware.random.random', return_value=0.3):
+            self.assertEqual(self.client.get(reverse('home')).status_code, 503)
+        with mock.patch('products.middleware.random.random', return_value=0.2):
+            self.assertEqual(self.client.get(reverse('home')).status_code, 200)
+
+
+    def test_db_latency_ignores_exempt_paths_and_decays_while_idle(self):
+        staff = User.objects.create_user('staff', password='pw', is_staff=True)
+        self.client.force_login(staff)
+        self.client.get(reverse('request_stats'))
+        self.assertEqual(metrics.stats()['request_stats']['requests'], 1)
+        self.assertEqual(metrics.db_latency_ms(), 0)
+        self.client.get(reverse('products'))
+        self.assertGreater(metrics.db_latency_ms(), 0)
+        metrics.reset_stats()
+
+        tracker = metrics.QueryTracker()
+        tracker.count, tracker.db_time = 1, 4.0
+        metrics.record('demo', 4.0, tracker)
+        later = time.monotonic() + 4 * metrics.DB_LATENCY_HALF_LIFE
+        with mock.patch('products.metrics.time.monotonic', return_value=later):
+            self.assertAlmostEqual(metrics.db_latency_ms(), 4000 * metrics.DB_LATENCY_WEIGHT / 16, places=0)
+
+
+class DatabaseRouterTests(TransactionTestCase):
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        cache.clear()
+        self.buyer = User.objects.create_user('buyer', password='pw')
+        self.product = make_product(User.objects.create_user('seller', password='pw'), stock=5)
+
+    def test_storefront_reads_use_the_replica_and_everything_else_the_primary(self):
+        self.assertEqual(Product.objects.all().db, 'replica')
+        self.assertEqual(CartItem.objects.all().db, 'replica')
+        self.assertEqual(User.objects.all().db, 'default')
+        self.assertEqual(Reservation.objects.all().db, 'default')
+        self.assertEqual(Product.objects.select_for_update().db, 'default')
+        with transaction.atomic():
+            self.assertEqual(Product.objects.all().db, 'default')
+
+        product = Product.objects.get(pk=self.product.pk)
+        self.assertEqual(product._state.db, 'replica')
+        product.name = 'Renamed'
+        product.save()
+        self.assertEqual(Product.objects.using('default').get(pk=product.pk).name, 'Renamed')
+
+    def test_replica_refuses_writes(self):
+        with self.assertRaises(OperationalError):
+            Product.objects.using('replica').update(stock=0)
+
+    def test_cart_changes_pin_the_client_to_the_primary(self):
+        self.client.force_login(self.buyer)
+        with CaptureQueriesContext(connections['replica']) as replica:
+            self.client.get(reverse('cart'))
+        self.assertTrue(replica.captured_queries)
+
+        response = self.client.get(reverse('add_to_cart', args=[self.product.pk]))
+        self.assertIn(routers.PIN_COOKIE, response.cookies)
+        self.assertEqual(response.cookies[routers.PIN_COOKIE]['max-age'], routers.PIN_SECONDS)
+        with CaptureQueriesContext(connections['replica']) as replica:
+            response = self.client.get(reverse('cart'))
+        self.assertEqual(replica.captured_queries, [])
+        self.assertContains(response, self.product.name)
+
+        self.client.cookies[routers.PIN_COOKIE] = str(time.time() - 1)
+        with CaptureQueriesContext(connections['replica']) as replica:
+            self.client.get(reverse('cart'))
+        self.assertTrue(replica.captured_queries)
+
+
+@override_settings(ROOT_URLCONF='ecommerce_site.asgi_urls')
+class AsyncViewTests(TransactionTestCase):
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        cache.clear()
+        self.seller = User.objects.create_user('seller', password='pw')
+        self.buyer = User.objects.create_user('buyer', password='pw')
+        self.products = [make_product(self.seller, f'Widget {i}') for i in range(8)]
+        CartItem.objects.create(user=self.buyer, product=self.products[0], quantity=2)
+        place_order(self.buyer, SHIPPING, PAYMENT)
+        CartItem.objects.create(user=self.buyer, product=self.products[1], quantity=3)
+        self.client.force_login(self.buyer)
+        self.async_client = AsyncClient()
+        self.async_client.cookies = self.client.cookies
+
+    async def test_pages_are_served_by_async_views(self):
+        from . import async_views
+        for name, view, args, expected in [
+            ('products', async_views.products, [], 'Widget 5'),
+            ('product_detail', async_views.product_detail, [self.products[1].pk], 'Widget 1'),
+            ('cart', async_views.cart, [], '30.00'),
+            ('order_history', async_views.order_history, [], 'Widget 0'),
+        ]:
+            response = await self.async_client.get(reverse(name, args=args))
+            self.assertEqual(response.resolver_match.func, view)
+            self.assertContains(response, expected)
+            self.assertIn('Server-Timing', response)
+            # Navbar badge: three items left in the cart.
+            self.assertContains(response, '>3</span>')
+
+    async def test_async_pages_answer_conditional_gets(self):
+        await self.async_client.get(reverse('products'))
+        for url in (reverse('products'), reverse('product_detail', args=[self.products[1].pk])):
+            first = await self.async_client.get(url)
+            second = await self.async_client.get(url, headers={'If-None-Match': first['ETag']})
+            self.assertEqual(second.status_code, 304)
+            self.assertEqual(second['Cache-Control'], 'private, no-cache')
+
+    async def test_metrics_middleware_counts_queries_of_async_views(self):
+        metrics.reset_stats()
+        await self.async_client.get(reverse('cart'))
+        self.assertGreater(metrics.stats()['cart']['queries_per_request'], 0)
+
+    async def test_add_to_cart_post_goes_through_sync_view(self):
+        response = await self.async_client.post(
+            reverse('product_detail', args=[self.products[2].pk]), {'quantity': 2},
+        )
+        self.assertRedirects(response, reverse('products'), fetch_redirect_response=False)
+        item = await CartItem.objects.aget(user=self.buyer, product=self.products[2])
+        self.assertEqual(item.quantity, 2)
+
+
+class BulkImportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = User.objects.create_user('seller', password='pw')
+        cls.other = User.objects.create_user('other', password='pw')
+
+    def import_csv(self, text, seller=None, chunk_size=bulk.CHUNK_SIZE):
+        return bulk.import_products(seller or self.seller, bulk.read_rows(StringIO(text), 'csv'), chunk_size)
+
+    def test_upserts_by_sku_per_seller(self):
+        Product.objects.create(user=self.other, sku='A1', name='Theirs', description='d', price=1, stock=1)
+        result = self.import_csv(
+            "sku,name,description,price,stock\nA1,Lamp,Bright,9.50,3\nB2,Chair,Comfy,40,1\nC3,Desk,Oak,99,2\n",
+            chunk_size=2,
+        )
+        self.assertEqual((result.imported, result.failed), (3, 0))
+        result = self.import_csv("sku,name,description,price,stock\nA1,Lamp v2,Brighter,12.00,5\n")
+        self.assertEqual(result.imported, 1)
+        lamp = Product.objects.get(user=self.seller, sku='A1')
+        self.assertEqual((lamp.name, lamp.price, lamp.stock), ('Lamp v2', Decimal('12.00'), 5))
+        self.assertEqual(Product.objects.filter(user=self.seller).count(), 3)
+        self.assertEqual(Product.objects.get(user=self.other, sku='A1').name, 'Theirs')
+
+    def test_bad_rows_are_reported_and_skipped(self):
+        result = self.import_csv(
+            "sku,name,description,price,stock\nA1,Lamp,Bright,cheap,3\nB2,,Comfy,40,1\nC3,Desk,Oak,99,2\n"
+        )
+        self.assertEqual((result.imported, result.failed), (1, 2))
+        self.assertEqual([line for line, _ in result.errors], [2, 3])
+        self.assertIn('price', result.errors[0][1])
+        self.assertIn('name: This field is required.', result.errors[1][1])
+        self.assertEqual(list(Product.objects.values_list('sku', flat=True)), ['C3'])
+
+    def test_jsonl_and_unparseable_lines(self):
+        text = '{"sku": "J1", "name": "Jug", "description": "d", "price": "3", "stock": 4}\nnot json\n\n'
+        result = bulk.import_products(self.seller, bulk.read_rows(StringIO(text), 'jsonl'))
+        self.assertEqual((result.imported, result.errors), (1, [(2, "Could not parse row.")]))
+
+    def test_import_updates_search_and_catalog_version(self):
+        version = catalog.catalog_version()
+        self.import_csv("sku,name,description,price,stock\nA1,Walnut lamp,d,9,1\n")
+        self.assertEqual([p.name for p in search.search('walnut')], ['Walnut lamp'])
+        self.assertNotEqual(catalog.catalog_version(), version)
+
+    def test_upload_view(self):
+        self.client.force_login(self.seller)
+        upload = SimpleUploadedFile('p.csv', b"\xef\xbb\xbfsku,name,description,price,stock\nA1,Lamp,d,9,1\nB2,,d,9,1\n")
+        response = self.client.post(reverse('import_products'), {'file': upload, 'format': 'csv'})
+        self.assertContains(response, 'Imported 1 products.')
+        self.assertContains(response, 'name: This field is required.')
+        self.assertTrue(Product.objects.filter(user=self.seller, sku='A1').exists())
+
+    def test_unreadable_upload_is_reported_not_a_500(self):
+        self.client.force_login(self.seller)
+        # More than the first 8KB the upload is decoded in, so some rows come before the bad byte.
+        rows = ''.join(f"A{i},Lamp {i},{'d' * 200},9,1\n" for i in range(60)).encode()
+        upload = SimpleUploadedFile('p.csv', b"sku,name,description,price,stock\n" + rows + b"B1,Caf\xe9,d,9,1\n")
+        response = self.client.post(reverse('import_products'), {'file': upload, 'format': 'csv'})
+        self.assertContains(response, 'Could not read the file from here on: not UTF-8 text.')
+        result = response.context['result']
+        self.assertEqual(Product.objects.filter(user=self.seller).count(), result.imported)
+        self.assertGreater(result.imported, 0)
+        self.assertContains(response, f"could not be read past line {result.unreadable_from - 1}")
+
+        # A field longer than csv.field_size_limit() is a csv.Error.
+        text = "sku,name,description,price,stock\nA1,Lamp,d,9,1\nB2,Desk," + 'd' * 200_000 + ",9,1\n"
+        result = self.import_csv(text)
+        self.assertEqual((result.imported, result.unreadable_from), (1, 3))
+        self.assertIn('Could not read the file from here on', result.errors[0][1])
+
+    def test_negative_stock_is_rejected(self):
+        result = self.import_csv("sku,name,description,price,stock\nA1,Lamp,d,9,-3\n")
+        self.assertEqual((result.imported, result.failed), (0, 1))
+        self.assertIn('stock: Ensure this value is greater than or equal to 0.', result.errors[0][1])
+
+    def test_streaming_export_round_trips(self):
+        self.import_csv("sku,name,description,price,stock,image_url\nA1,\"Lamp, desk\",d,9.50,1,\nB2,Chair,d,40,2,\n")
+        make_product(self.other, 'Not mine')
+        self.client.force_login(self.seller)
+        response = self.client.get(reverse('export_products'))
+        self.assertTrue(response.streaming)
+        body = b''.join(response.streaming_content).decode()
+        header, chair, lamp = body.splitlines()
+        self.assertEqual(header, 'sku,name,description,price,stock,image_url')
+        self.assertTrue(lamp.startswith('A1,"Lamp, desk",d,9.50,1,'))
+        self.assertNotIn('Not mine', body)
+
+        Product.objects.filter(user=self.seller).update(stock=0)
+        self.assertEqual(self.import_csv(body).imported, 2)
+        self.assertEqual(sorted(Product.objects.filter(user=self.seller).values_list('stock', flat=True)), [1, 2])
+        self.assertEqual(self.client.get(reverse('export_products'), {'format': 'xml'}).status_code, 404)
+
+    def test_commands(self):
+        Product.objects.create(user=self.seller, sku='E1', name='Exported', description='d', price=1, stock=1)
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'products.jsonl')
+            call_command('export_products', seller='seller', format='jsonl', output=path, stderr=StringIO())
+            Product.objects.all().delete()
+            out = StringIO()
+            call_command('import_products', path, seller='seller', stdout=out, stderr=StringIO())
+        self.assertIn('Imported 1 products, 0 rows failed', out.getvalue())
+        self.assertEqual(Product.objects.get().name, 'Exported')
+
+
+def image_file(name='photo.jpg', size=(2000, 1000), fmt='JPEG', color=(200, 30, 30)):
+    out = BytesIO()
+    Image.new('RGBA' if fmt == 'PNG' else 'RGB', size, color).save(out, fmt)
+    return SimpleUploadedFile(name, out.getvalue())
+
+
+class ProductImageTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = User.objects.create_user('seller', password='pw')
+
+    def setUp(self):
+        self.media_root = self.enterContext(tempfile.TemporaryDirectory())
+        self.enterContext(override_settings(MEDIA_ROOT=self.media_root))
+
+    def make(self, name='Lamp', **kwargs):
+        return Product.objects.create(user=self.seller, name=name, description='d', price=1, stock=1, **kwargs)
+
+    def run_jobs(self):
+        for job in queue.claim('test', limit=10):
+            queue.run(job)
+
+    def test_identical_uploads_are_stored_once(self):
+        a = self.make(image=image_file('a.JPG'))
+        b = self.make(image=image_file('b.jpg'))
+        c = self.make(image=image_file(color=(0, 0, 255)))
+        self.assertEqual(a.image.name, b.image.name)
+        self.assertRegex(a.image.name, r'^products/[0-9a-f]{2}/[0-9a-f]{64}\.jpg$')
+        self.assertNotEqual(a.image.name, c.image.name)
+        stored = {a.image.path, c.image.path}
+        self.assertEqual(set(glob.glob(os.path.join(self.media_root, 'products', '??', '*'))), stored)
+
+    def test_worker_builds_variants_for_every_product_sharing_the_image(self):
+        a = self.make(image=image_file())
+        b = self.make(image=image_file())
+        self.assertEqual(a.image_sources, None)
+        self.assertEqual(Job.objects.filter(name='product_image_variants').count(), 2)
+        self.run_jobs()
+
+        for product in (a, b):
+            product.refresh_from_db()
+            self.assertEqual(product.image_variants, {'width': 2000, 'height': 1000, 'widths': list(images.VARIANT_WIDTHS)})
+        with images.storage.open(images.variant_name(a.image.name, 320, 'webp')) as f:
+            variant = Image.open(f)
+            self.assertEqual((variant.format, variant.size), ('WEBP', (320, 160)))
+        sources = a.image_sources
+        self.assertTrue(sources['src'].endswith('-640.jpg'))
+        self.assertIn('-1280.webp 1280w', sources['webp'])
+
+    def test_small_transparent_images_are_not_upscaled(self):
+        product = self.make(image=image_file('logo.png', size=(200, 100), fmt='PNG', color=(0, 0, 0, 0)))
+        self.run_jobs()
+        product.refresh_from_db()
+        self.assertEqual(product.image_variants['widths'], [160, 200])
+        with images.storage.open(images.variant_name(product.image.name, 200, 'jpg')) as f:
+            self.assertEqual(Image.open(f).getpixel((0, 0)), (255, 255, 255))
+
+    def test_other_edits_keep_variants(self):
+        product = self.make(image=image_file())
+        self.run_jobs()
+        product.refresh_from_db()
+        product.stock = 5
+        product.save()
+        product.refresh_from_db()
+        self.assertTrue(product.image_variants)
+        self.assertEqual(Job.objects.filter(status=Job.QUEUED).count(), 0)
+        product.image = ''
+        product.save()
+        self.assertEqual(product.image_variants, {})
+
+    def test_catalog_renders_srcset_and_falls_back_to_remote_url(self):
+        uploaded = self.make('Uploaded', image=image_file())
+        self.make('Remote', image_url='https://example.com/remote.jpg')
+        self.run_jobs()
+        self.client.force_login(self.seller)
+        response = self.client.get(reverse('products'))
+        self.assertContains(response, '<source type="image/webp" srcset="/media/products/variants/', count=1)
+        self.assertContains(response, 'width="2000" height="1000"')
+        self.assertContains(response, 'src="https://example.com/remote.jpg"')
+
+        api = self.client.get(reverse('api_product_detail', args=[uploaded.pk])).json()
+        self.assertEqual(api['image'], uploaded.image.url)
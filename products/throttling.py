@@ -0,0 +1,164 @@
+"""Rate limits kept in the cache, shared by every worker that uses it.
+
+``settings.RATE_LIMITS`` maps URL names, namespaced as in ``admin:login``,
+to rules ``(scope, rate)`` or ``(scope, rate, burst)``:
+
+- the scope says who shares a limit: ``ip`` (the client address), ``user``
+  (the signed-in user; skipped for anonymous requests), ``username`` (the
+  username a login form or token request submits; skipped when absent) or
+  ``all`` (every client of that URL together);
+- a rate such as ``'20/min'`` or ``'10/15min'`` is a sliding window: about
+  that many requests in any period of that length;
+- with a ``burst`` the rule is a token bucket instead, allowing bursts of up
+  to ``burst`` requests refilled at the rate.
+
+Only unsafe methods are counted: showing the login form or the cart is
+never limited. Django views are checked by ``RateLimitMiddleware`` before
+they run and DRF views by ``RateLimitThrottle``, as DRF authenticates inside
+the view. Either way a check costs at most three cache operations per rule.
+"""
+import hashlib
+import math
+import re
+import time
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.throttling import BaseThrottle
+
+_PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+def parse_rate(rate):
+    """``'20/min'`` -> ``(20, 60)``; the period can have a multiplier, as in ``'10/15min'``."""
+    count, _, period = rate.partition('/')
+    match = re.fullmatch(r'(\d*)([smhd])[a-z]*', period.strip())
+    if not count.strip().isdigit() or not match:
+        raise ImproperlyConfigured(f"Invalid rate {rate!r}; expected e.g. '20/min' or '10/15min'.")
+    return int(count), int(match[1] or 1) * _PERIODS[match[2]]
+
+
+def _incr(key, timeout):
+    try:
+        return cache.incr(key)
+    except ValueError:
+        # First hit of the window; another request may create it first.
+        if cache.add(key, 1, timeout):
+            return 1
+        return cache.incr(key)
+
+
+class SlidingWindow:
+    """About ``limit`` hits in any ``period`` seconds.
+
+    Keeps one counter per fixed window and weights the previous window's by
+    how much of it the sliding window still covers. Refused hits are counted
+    too, so a client that keeps retrying stays refused.
+    """
+
+    def __init__(self, limit, period):
+        self.limit = limit
+        self.period = period
+
+    def hit(self, key, now=None):
+        """Count a hit; returns 0 if it is allowed, else about how many seconds until one would be."""
+        window, offset = divmod(time.time() if now is None else now, self.period)
+        count = _incr(f'{key}:{int(window)}', self.period * 2)
+        previous = cache.get(f'{key}:{int(window) - 1}', 0)
+        weight = 1 - offset / self.period
+        if previous * weight + count <= self.limit:
+            return 0
+        if count <= self.limit:
+            # Wait for the previous window to slide out far enough.
+            return max(self.period * (1 - (self.limit - count) / previous) - offset, 1)
+        return self.period - offset + self.period * (1 - self.limit / count)
+
+
+class TokenBucket:
+    """Bursts of up to ``burst`` hits, refilled at ``limit`` per ``period`` seconds.
+
+    Stored as a single timestamp per key, the time the bucket will be full
+    again (the generic cell rate algorithm). Checking is a read and a write,
+    so two requests racing for the last token can both get it.
+    """
+
+    def __init__(self, limit, period, burst):
+        self.interval = period / limit
+        self.tolerance = self.interval * (burst - 1)
+
+    def hit(self, key, now=None):
+        """Take a token; returns 0 if there was one, else the seconds until there will be."""
+        now = time.time() if now is None else now
+        full_at = max(cache.get(key, now), now)
+        wait = full_at - self.tolerance - now
+        if wait > 0:
+            return wait
+        full_at += self.interval
+        cache.set(key, full_at, math.ceil(full_at - now))
+        return 0
+
+
+@lru_cache(maxsize=None)
+def limiter(rule):
+    scope, rate, *burst = rule
+    limit, period = parse_rate(rate)
+    return TokenBucket(limit, period, *burst) if burst else SlidingWindow(limit, period)
+
+
+def client_ip(request):
+    """The client's address, read from X-Forwarded-For behind RATE_LIMIT_PROXY_COUNT trusted proxies."""
+    proxies = settings.RATE_LIMIT_PROXY_COUNT
+    if proxies:
+        forwarded = [addr.strip() for addr in request.META.get('HTTP_X_FORWARDED_FOR', '').split(',') if addr.strip()]
+        if len(forwarded) >= proxies:
+            return forwarded[-proxies]
+    return request.META.get('REMOTE_ADDR', '')
+
+
+def _identity(scope, request, user, data):
+    if scope == 'ip':
+        return client_ip(request)
+    if scope == 'user':
+        return user.pk if user.is_authenticated else None
+    if scope == 'username':
+        username = data.get('username') if hasattr(data, 'get') else None
+        if not isinstance(username, str):
+            return None
+        return username.strip().lower() or None
+    if scope == 'all':
+        return ''
+    raise ImproperlyConfigured(f"Unknown rate limit scope {scope!r}.")
+
+
+def check(request, view_name, user, data):
+    """Count a request against the limits of ``view_name``; returns 0 if allowed, else seconds to wait.
+
+    ``data`` is the submitted form or JSON, for the ``username`` scope.
+    """
+    if request.method in SAFE_METHODS:
+        return 0
+    for rule in settings.RATE_LIMITS.get(view_name, ()):
+        identity = _identity(rule[0], request, user, data)
+        if identity is None:
+            continue
+        # Submitted usernames can be anything; keys stay short and safe for any backend.
+        digest = hashlib.blake2b(str(identity).encode(), digest_size=8).hexdigest()
+        wait = limiter(tuple(rule)).hit(f'ratelimit:{view_name}:{rule[0]}:{digest}')
+        if wait:
+            return wait
+    return 0
+
+
+class RateLimitThrottle(BaseThrottle):
+    """DRF throttle applying ``settings.RATE_LIMITS`` by URL name, after authentication."""
+
+    def allow_request(self, request, view):
+        match = request.resolver_match
+        self._wait = check(request, match.view_name if match else None, request.user, request.data)
+        return not self._wait
+
+    def wait(self):
+        return self._wait
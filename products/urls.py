@@ -1,15 +1,15 @@
 from django.urls import path
 from . import views
-from django.conf import settings
-from django.conf.urls.static import static
 
 urlpatterns = [
     path('', views.home, name='home'),
     path('products/', views.products, name='products'),
+    path('search/', views.search_products, name='search'),
     path('product/<int:pk>/', views.product_detail, name='product_detail'),
     path('add-to-cart/<int:pk>/', views.add_to_cart, name='add_to_cart'),
     path('cart/', views.cart, name='cart'),
     path('update-cart/<int:pk>/', views.update_cart_item, name='update_cart_item'),
+    path('cart/update/', views.update_cart, name='update_cart'),
     path('remove/<int:pk>/', views.remove_from_cart, name='remove_from_cart'),
     path('checkout/details/', views.checkout_details, name='checkout_details'),
     path('checkout/summary/', views.checkout_summary, name='checkout_summary'),
@@ -21,6 +21,12 @@ urlpatterns = [
     path('user/products/add/', views.add_product, name='add_product'),
     path('user/products/edit/<int:pk>/', views.edit_product, name='edit_product'),
     path('user/products/delete/<int:pk>/', views.delete_product, name='delete_product'),
+    path('user/products/import/', views.import_products, name='import_products'),
+    path('user/products/export/', views.export_products, name='export_products'),
+    path('user/sales/', views.sales_report, name='sales_report'),
     path('profile/', views.profile_view, name='profile'),
+    path('ops/cache-stats/', views.cache_stats, name='cache_stats'),
+    path('ops/request-stats/', views.request_stats, name='request_stats'),
+    path('ops/seller-revenue/', views.seller_revenue, name='seller_revenue'),
 
-] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
\ No newline at end of file
+]
\ No newline at end of file
@@ -1,39 +1,60 @@
-from rest_framework.decorators import api_view
-from rest_framework.response import Response
-from rest_framework import generics, mixins
+import io
+import json
+
 from .models import Product, CartItem, Order, OrderItem
+from django.http import Http404, JsonResponse, StreamingHttpResponse
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth import login, logout, authenticate
-from .forms import SignUpForm, ProductForm, AddToCartForm, ShippingAddressForm, PaymentMethodForm
+from . import analytics, bulk, caching, carts, catalog, metrics, orders, recommendations, search
+from .conditional import catalog_page_etag, product_page_etag, revalidated_page
+from .checkout import place_order, reserve_cart, EmptyCartError, InsufficientStockError
+from .forms import SignUpForm, ProductForm, ProductImportForm, AddToCartForm, SearchForm, ShippingAddressForm, PaymentMethodForm
 from django.contrib.auth.decorators import login_required
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib import messages
+from django.utils.http import url_has_allowed_host_and_scheme
 from django.views.decorators.cache import never_cache
-from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
-from django.db.models import F
+from django.views.decorators.http import require_POST
 
 def home(request):
     return render(request, 'home.html')
 
-@login_required
-@never_cache
+@revalidated_page(catalog_page_etag)
 def products(request):
-    product_list = Product.objects.all().order_by('name')
-    paginator = Paginator(product_list, 6)
-
-    page = request.GET.get('page')
     try:
-        products = paginator.page(page)
-    except PageNotAnInteger:
-        products = paginator.page(1)
-    except EmptyPage:
-        products = paginator.page(paginator.num_pages)
+        page = catalog.get_page(after=request.GET.get('after'), before=request.GET.get('before'))
+    except catalog.InvalidCursor:
+        page = catalog.get_page()
+
+    return render(request, 'products.html', {
+        'products': page,
+        'product_count': catalog.approximate_count(),
+    })
+
+@revalidated_page(catalog_page_etag)
+def search_products(request):
+    form = SearchForm(request.GET or None)
+    results = None
+    if form.is_valid() and form.cleaned_data['q']:
+        data = form.cleaned_data
+        results = search.search(
+            data['q'],
+            min_price=data['min_price'],
+            max_price=data['max_price'],
+            in_stock=data['in_stock'],
+            page=data['page'] or 1,
+        )
 
-    return render(request, 'products.html', {'products': products})
+    query = request.GET.copy()
+    query.pop('page', None)
+    return render(request, 'search.html', {'form': form, 'results': results, 'query_string': query.urlencode()})
 
-@login_required
-@never_cache
+@revalidated_page(product_page_etag)
 def product_detail(request, pk):
-    product = get_object_or_404(Product, pk=pk)
+    try:
+        product = catalog.get_product(pk)
+    except Product.DoesNotExist:
+        raise Http404("No Product matches the given query.")
     add_to_cart_form = AddToCartForm()
 
     if request.method == 'POST':
@@ -44,87 +65,178 @@ def product_detail(request, pk):
                 messages.error(request, "Quantity must be at least 1.")
                 return redirect('product_detail', pk=pk)
 
-            if product.stock < quantity:
+            try:
+                _add_to_cart(request, product, quantity)
+            except carts.OutOfStockError:
                 messages.error(request, f"Not enough stock for {product.name}. Available: {product.stock}")
                 return redirect('product_detail', pk=pk)
+            except carts.CartFullError as e:
+                messages.error(request, str(e))
+                return redirect('product_detail', pk=pk)
 
-            cart_item, created = CartItem.objects.get_or_create(user=request.user, product=product)
-
-            if not created:
-                cart_item.quantity = F('quantity') + quantity
-            else:
-                cart_item.quantity = quantity
-
-            cart_item.save()
             messages.success(request, f"{quantity} x {product.name} added to cart!")
             return redirect('products')
     
-    return render(request, 'product_detail.html', {'product': product, 'add_to_cart_form': add_to_cart_form})
+    return render(request, 'product_detail.html', {
+        'product': product,
+        'add_to_cart_form': add_to_cart_form,
+        'recommendations': recommendations.for_product(pk),
+    })
+
+def _add_to_cart(request, product, quantity=1):
+    # Visitors who have not logged in get a cookie cart, merged into CartItem at login.
+    if request.user.is_authenticated:
+        carts.add_item(request.user, product, quantity)
+    else:
+        carts.guest_cart(request).add(product, quantity)
 
-@login_required
 @never_cache
 def add_to_cart(request, pk):
     product = get_object_or_404(Product, pk=pk)
     
-    if product.stock < 1:
-        messages.error(request, f"Sorry, {product.name} is out of stock.")
+    try:
+        _add_to_cart(request, product)
+    except carts.OutOfStockError as e:
+        if e.in_cart:
+            messages.error(request, f"Cannot add more {product.name}. Only {product.stock} available in total.")
+        else:
+            messages.error(request, f"Sorry, {product.name} is out of stock.")
+        return redirect('products')
+    except carts.CartFullError as e:
+        messages.error(request, str(e))
         return redirect('products')
 
-    item, created = CartItem.objects.get_or_create(user=request.user, product=product)
-
-    if not created:
-        if product.stock < item.quantity + 1:
-            messages.error(request, f"Cannot add more {product.name}. Only {product.stock} available in total.")
-            return redirect('products')
-        item.quantity = F('quantity') + 1
-    item.save()
     messages.success(request, f"{product.name} added to cart!")
     return redirect('products')
 
-@login_required
+def _cart_items(request):
+    if request.user.is_authenticated:
+        return list(carts.lines(request.user))
+    return carts.guest_cart(request).lines()
+
 @never_cache
 def cart(request):
-    items = CartItem.objects.filter(user=request.user)
-    return render(request, 'cart.html', {'items': items})
+    items = _cart_items(request)
+    return render(request, 'cart.html', {'items': items, 'total': carts.grand_total(items)})
+
+def _submitted_quantities(request):
+    """``{line id: quantity}`` from ``{"quantities": {...}}`` JSON or ``quantity-<line id>`` form fields."""
+    if request.content_type == 'application/json':
+        submitted = json.loads(request.body).get('quantities')
+        if not isinstance(submitted, dict):
+            raise ValueError("quantities must be an object")
+    else:
+        submitted = {
+            key.removeprefix('quantity-'): value for key, value in request.POST.items() if key.startswith('quantity-')
+        }
+    return {int(line): int(quantity) for line, quantity in submitted.items()}
+
+@never_cache
+@require_POST
+def update_cart(request):
+    """Apply the quantities of any number of cart lines in one go.
+
+    Answers with the updated cart straight away: the cart page for the form,
+    the summary and lines for JSON, whose errors are 400 and 409 responses.
+    """
+    wants_json = request.content_type == 'application/json'
+    try:
+        quantities = _submitted_quantities(request)
+    except (ValueError, TypeError, AttributeError):
+        if wants_json:
+            return JsonResponse({'detail': "Invalid quantities."}, status=400)
+        messages.error(request, "Invalid quantity.")
+        quantities = {}
+
+    try:
+        if request.user.is_authenticated:
+            carts.update_quantities(request.user, quantities)
+        else:
+            carts.guest_cart(request).update_quantities(quantities)
+    except carts.CartUpdateError as e:
+        if wants_json:
+            return JsonResponse({
+                'detail': str(e),
+                'failed_lines': [
+                    {'line': item.pk or item.product_id, 'product_id': item.product_id, 'requested': requested, 'available': available}
+                    for item, requested, available in e.failed_lines
+                ],
+            }, status=409)
+        for item, requested, available in e.failed_lines:
+            messages.error(request, f"Not enough stock for {item.product.name}. Only {available} available.")
+    else:
+        if quantities and not wants_json:
+            messages.success(request, "Cart updated.")
+
+    items = _cart_items(request)
+    total = carts.grand_total(items)
+    # Every line is loaded anyway, so the navbar needs no query of its own.
+    summary = {'count': sum(item.quantity for item in items), 'total': total}
+    if wants_json:
+        return JsonResponse({
+            'count': summary['count'],
+            'total': f'{total:.2f}',
+            'lines': [
+                {'line': item.pk or item.product_id, 'product_id': item.product_id, 'quantity': item.quantity, 'line_total': f'{item.line_total:.2f}'}
+                for item in items
+            ],
+        })
+    return render(request, 'cart.html', {'items': items, 'total': total, 'cart_summary': summary})
+
+def _cart_line(request, pk):
+    # A guest cart's lines are identified by their product.
+    if request.user.is_authenticated:
+        return get_object_or_404(CartItem.objects.select_related('product'), pk=pk, user=request.user)
+    guest = carts.guest_cart(request)
+    if pk not in guest.quantities:
+        raise Http404("No cart line matches the given query.")
+    return CartItem(product=get_object_or_404(Product, pk=pk), quantity=guest.quantities[pk])
 
-@login_required
 @never_cache
 def update_cart_item(request, pk):
     if request.method == 'POST':
-        item = get_object_or_404(CartItem, pk=pk, user=request.user)
+        item = _cart_line(request, pk)
         try:
             new_quantity = int(request.POST.get('quantity'))
-            
-            if new_quantity <= 0:
-                item.delete()
+
+            if request.user.is_authenticated:
+                updated = carts.set_quantity(item, new_quantity)
+            else:
+                updated = carts.guest_cart(request).set_quantity(item.product, new_quantity)
+            if updated is None:
                 messages.info(request, f"{item.product.name} removed from cart.")
             else:
-                if item.product.stock < new_quantity:
-                    messages.error(request, f"Not enough stock for {item.product.name}. Only {item.product.stock} available.")
-                    return redirect('cart')
-                
-                item.quantity = new_quantity
-                item.save()
                 messages.success(request, f"Quantity for {item.product.name} updated to {new_quantity}.")
+        except carts.OutOfStockError as e:
+            messages.error(request, str(e))
         except (ValueError, TypeError):
             messages.error(request, "Invalid quantity.")
     return redirect('cart')
 
-@login_required
 @never_cache
 def remove_from_cart(request, pk):
-    item = get_object_or_404(CartItem, pk=pk, user=request.user)
-    item.delete()
+    item = _cart_line(request, pk)
+    if request.user.is_authenticated:
+        carts.remove_item(item)
+    else:
+        carts.guest_cart(request).remove(pk)
     messages.info(request, f"{item.product.name} removed from cart.")
     return redirect('cart')
 
 @login_required
 @never_cache
 def checkout_details(request):
-    cart_items = CartItem.objects.filter(user=request.user)
-    if not cart_items.exists():
+    # Hold the cart's stock up front so a sold-out item is reported now, not after the summary.
+    try:
+        reserved_until = reserve_cart(request.user)
+    except EmptyCartError:
         messages.warning(request, "Your cart is empty.")
         return redirect('products')
+    except InsufficientStockError as e:
+        for item, available in e.failed_lines:
+            messages.error(request, f"Not enough stock for {item.product.name}. Only {available} available. Please adjust your cart.")
+        return redirect('cart')
+    cart_items = CartItem.objects.filter(user=request.user)
 
     if request.method == 'POST':
         address_form = ShippingAddressForm(request.POST)
@@ -145,7 +257,8 @@ def checkout_details(request):
     context = {
         'address_form': address_form,
         'payment_form': payment_form,
-        'items': cart_items
+        'items': cart_items,
+        'reserved_until': reserved_until,
     }
     return render(request, 'checkout_details.html', context)
 
@@ -159,57 +272,31 @@ def checkout_summary(request):
         messages.error(request, "Please enter your shipping and payment details first.")
         return redirect('checkout_details')
 
-    cart_items = CartItem.objects.filter(user=request.user)
-    if not cart_items.exists():
-        messages.warning(request, "Your cart is empty.")
-        return redirect('products')
-    
-    # Calculate the total price based on cart items
-    total_order_price = sum(item.total_price() for item in cart_items)
-    
     if request.method == 'POST':
         # This is the final step, process the order
-        # Ensure sufficient stock for all items before creating the order
-        for item in cart_items:
-            product = item.product
-            if product.stock < item.quantity:
-                messages.error(request, f"Not enough stock for {product.name}. Only {product.stock} available. Please adjust your cart.")
-                return redirect('cart')
-
-        # Create the Order object using all shipping details from the session
-        order = Order.objects.create(
-            user=request.user,
-            shipping_address=f"{shipping_data.get('address_line_1')}, {shipping_data.get('address_line_2', '')}",
-            shipping_city=shipping_data.get('city'),
-            shipping_state=shipping_data.get('state'),
-            shipping_postal_code=shipping_data.get('postal_code'),
-            shipping_country=shipping_data.get('country'),
-            payment_method=payment_data.get('payment_method'),
-            total_price=total_order_price
-        )
+        try:
+            order = place_order(request.user, shipping_data, payment_data)
+        except EmptyCartError:
+            messages.warning(request, "Your cart is empty.")
+            return redirect('products')
+        except InsufficientStockError as e:
+            for item, available in e.failed_lines:
+                messages.error(request, f"Not enough stock for {item.product.name}. Only {available} available. Please adjust your cart.")
+            return redirect('cart')
 
-        # Create OrderItems and decrement stock
-        for item in cart_items:
-            product = item.product
-            OrderItem.objects.create(
-                order=order,
-                product=item.product,
-                quantity=item.quantity,
-                price_at_purchase=item.product.price
-            )
-            
-            
-            product.stock = F('stock') - item.quantity
-            product.save(update_fields=['stock'])
-
-        
-        cart_items.delete()
         del request.session['shipping_data']
         del request.session['payment_data']
 
         messages.success(request, f"Checkout successful! Your order (ID: {order.id}) has been placed for ${order.total_price:.2f}.")
         return redirect('order_history')
 
+    cart_items = list(carts.lines(request.user))
+    if not cart_items:
+        messages.warning(request, "Your cart is empty.")
+        return redirect('products')
+
+    total_order_price = carts.grand_total(cart_items)
+
     context = {
         'items': cart_items,
         'shipping_data': shipping_data,
@@ -238,11 +325,16 @@ def login_view(request):
         user = authenticate(request, username=username, password=password)
         if user:
             login(request, user)
+            if carts.guest_cart(request).merge_into(user):
+                messages.info(request, "The items you added before logging in are in your cart.")
             messages.success(request, f"Welcome back, {user.username}!")
+            next_url = request.POST.get('next', '')
+            if url_has_allowed_host_and_scheme(next_url, allowed_hosts={request.get_host()}, require_https=request.is_secure()):
+                return redirect(next_url)
             return redirect('home')
         else:
             messages.error(request, 'Invalid username or password.')
-    return render(request, 'login.html')
+    return render(request, 'login.html', {'next': request.POST.get('next', request.GET.get('next', ''))})
 
 @never_cache
 def logout_view(request):
@@ -300,11 +392,75 @@ def delete_product(request, pk):
         return redirect('admin_products')
     return render(request, 'confirm_delete.html', {'object': product})
 
+@login_required
+def import_products(request):
+    form = ProductImportForm(request.POST or None, request.FILES or None)
+    result = None
+    if form.is_valid():
+        # Read the upload as a text stream; large uploads are spooled to disk, not memory.
+        stream = io.TextIOWrapper(form.cleaned_data['file'].file, encoding='utf-8-sig', newline='')
+        result = bulk.import_products(request.user, bulk.read_rows(stream, form.cleaned_data['format']))
+        if result.imported:
+            messages.success(request, f"Imported {result.imported} products.")
+        if result.unreadable_from:
+            messages.error(request, f"The file could not be read past line {result.unreadable_from - 1}.")
+        elif result.failed:
+            messages.warning(request, f"{result.failed} rows were skipped because of errors.")
+    return render(request, 'import_products.html', {'form': form, 'result': result})
+
+@login_required
+def export_products(request):
+    fmt = request.GET.get('format', 'csv')
+    if fmt not in bulk.FORMATS:
+        raise Http404("Unknown export format.")
+    response = StreamingHttpResponse(
+        bulk.export_lines(bulk.export_rows(request.user), fmt),
+        content_type='text/csv' if fmt == 'csv' else 'application/x-ndjson',
+    )
+    response['Content-Disposition'] = f'attachment; filename="products.{fmt}"'
+    return response
+
+def _report_days(request):
+    try:
+        days = int(request.GET.get('days', ''))
+    except ValueError:
+        days = None
+    return days if days in analytics.REPORT_PERIODS else analytics.REPORT_PERIODS[0]
+
+@login_required
+def sales_report(request):
+    days = _report_days(request)
+    start, end = analytics.period(days)
+    return render(request, 'sales_report.html', {
+        'days': days,
+        'periods': sorted(analytics.REPORT_PERIODS),
+        'totals': analytics.totals(request.user, start, end),
+        'by_day': analytics.revenue_by_day(request.user, start, end),
+        'top_products': analytics.top_products(request.user, start, end),
+    })
+
 @login_required
 def order_history(request):
-    orders = Order.objects.filter(user=request.user).order_by('-created_at')
-    return render(request, 'order_history.html', {'orders': orders})
+    return render(request, 'order_history.html', {'orders': orders.history_page(request.user, request.GET.get('page'))})
 
 @login_required
 def profile_view(request):
-    return render(request, 'profile.html')
\ No newline at end of file
+    return render(request, 'profile.html')
+
+@staff_member_required
+def cache_stats(request):
+    return JsonResponse(caching.stats())
+
+@staff_member_required
+def request_stats(request):
+    return JsonResponse(metrics.stats())
+
+@staff_member_required
+def seller_revenue(request):
+    start, end = analytics.period(_report_days(request))
+    return JsonResponse({
+        'start': start,
+        'end': end,
+        # SQLite sums drop trailing zeros; always send cents.
+        'sellers': [dict(row, revenue=f"{row['revenue']:.2f}") for row in analytics.revenue_by_seller(start, end)],
+    })